@@ -23,7 +23,10 @@ class WebEnv:
                                    num_products=args.num, human_goals=args.human_goals,
                                    get_image=args.get_image,
                                    num_prev_obs=args.num_prev_obs, num_prev_actions=args.num_prev_actions,
-                                   session_prefix=id)
+                                   session_prefix=id, lazy_products=args.lazy_products,
+                                   search_backend=args.search_backend, render_html=args.render_html,
+                                   html_backend=args.html_backend, page_cache_mb=args.page_cache_mb,
+                                   shared_data=True)
         if args.num is None:
             if split == 'test':
                 self.goal_idxs = range(500)
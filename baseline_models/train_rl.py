@@ -97,7 +97,8 @@ def train(agent, eval_env, test_env, envs, args):
         log('>> Action{}: {}'.format(step, action_strs[0]))
         state0 = None
 
-        # step in envs
+        # step in envs, searching for all of them at once
+        envs[0].env.server.prefetch_search_actions(action_strs)
         next_states, next_valids, rewards, dones = [], [], [], []
         for env, action_str, action_id, state in zip(envs, action_strs, action_ids, states):
             ob, reward, done, info = env.step(action_str)
@@ -162,6 +163,10 @@ def train(agent, eval_env, test_env, envs, args):
                 tb.logkv(k, v)
             items_clicked = agg(envs, 'items_clicked')
             tb.logkv('ItemsClicked', len(items_clicked))
+            page_cache = envs[0].env.server.page_cache
+            if page_cache is not None:
+                for k, v in page_cache.stats().items():
+                    tb.logkv(f'PageCache_{k}', v)
             tb.dumpkvs()
 
         if step % args.ckpt_freq == 0:
@@ -208,6 +213,11 @@ def parse_args():
     parser.add_argument('--human_goals', default=1, type=int, help='use human goals')
     parser.add_argument('--num_prev_obs', default=0, type=int, help='number of previous observations')
     parser.add_argument('--num_prev_actions', default=0, type=int, help='number of previous actions')
+    parser.add_argument('--lazy_products', default=0, type=int, help='decode products from shared compiled catalog on access')
+    parser.add_argument('--search_backend', default='lucene', type=str, choices=['lucene', 'native', 'dense', 'hybrid'], help='search engine implementation')
+    parser.add_argument('--render_html', default=1, type=int, help='render every page to HTML (default), 0 to build observations from session state')
+    parser.add_argument('--html_backend', default='bs4', type=str, choices=['bs4', 'lxml', 'selectolax'], help='parser reading observations from rendered HTML')
+    parser.add_argument('--page_cache_mb', default=0, type=float, help='size of the cache of pages shared by sessions, 0 (default) to render every page')
     parser.add_argument('--extra_search_path', default="./data/goal_query_predict.json", type=str, help='path for extra search queries')
     
 
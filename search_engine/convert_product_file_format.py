@@ -1,47 +1,92 @@
-import sys
+"""
+Export products to the JSON corpora indexed by `run_indexing.sh`.
+
+Products are read once, and each document is written to the corpus of
+every index size it belongs to (the first 100, 1k, 100k and all products)
+with only the fields the index needs: the ASIN as `id` and the searched
+text as `contents`.
+"""
+import argparse
 import json
-from tqdm import tqdm
+import multiprocessing
+import os
+import sys
+import time
 sys.path.insert(0, '../')
 
 from web_agent_site.utils import DEFAULT_FILE_PATH
 from web_agent_site.engine.engine import load_products
+from web_agent_site.engine.search_backend import get_product_contents
+
+CORPORA = [
+    (100, 'resources_100'),
+    (1000, 'resources_1k'),
+    (100000, 'resources_100k'),
+    (None, 'resources'),
+]
+BATCH_SIZE = 10000
+
+# products to export, inherited by forked workers
+_products = None
+
+
+def _serialize(bounds):
+    start, end = bounds
+    return ''.join(
+        json.dumps({'id': p['asin'], 'contents': get_product_contents(p)}) + '\n'
+        for p in _products[start:end]
+    )
+
+
+def export_corpora(all_products, corpora=CORPORA, num_workers=1):
+    """
+    Write `all_products` to the `documents.jsonl` file of each directory in
+    `corpora`, (number of products, directory) pairs, with `num_workers`
+    processes serializing batches of products. Returns the number of
+    documents serialized.
+    """
+    global _products
+    _products = all_products
+    n = len(all_products)
+    batches = [(start, min(start + BATCH_SIZE, n)) for start in range(0, n, BATCH_SIZE)]
+    files = []
+    for limit, directory in corpora:
+        os.makedirs(directory, exist_ok=True)
+        files.append((limit, open(os.path.join(directory, 'documents.jsonl'), 'w')))
+
+    start_time = time.time()
+    num_bytes = 0
+    pool = multiprocessing.get_context('fork').Pool(num_workers) if num_workers > 1 else None
+    try:
+        chunks = map(_serialize, batches) if pool is None else pool.imap(_serialize, batches)
+        for (start, end), chunk in zip(batches, chunks):
+            num_bytes += len(chunk)
+            for limit, f in files:
+                if limit is None or end <= limit:
+                    f.write(chunk)
+                elif start < limit:
+                    f.write(''.join(chunk.splitlines(keepends=True)[:limit - start]))
+    finally:
+        if pool is not None:
+            pool.close()
+        for _, f in files:
+            f.close()
+    elapsed = time.time() - start_time
+    print(f'Exported {n} documents ({num_bytes / 2 ** 20:.1f} MiB) in {elapsed:.1f}s '
+          f'({n / max(elapsed, 1e-9):.0f} docs/s)')
+    return n
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export products to corpora for indexing')
+    parser.add_argument('--file_path', default=DEFAULT_FILE_PATH, help='Raw products JSON file')
+    parser.add_argument('--num_workers', default=1, type=int,
+                        help='Number of processes cleaning (without a compiled catalog) '
+                             'and serializing products')
+    args = parser.parse_args()
 
-all_products, *_ = load_products(filepath=DEFAULT_FILE_PATH)
-
-
-docs = []
-for p in tqdm(all_products, total=len(all_products)):
-    option_texts = []
-    options = p.get('options', {})
-    for option_name, option_contents in options.items():
-        option_contents_text = ', '.join(option_contents)
-        option_texts.append(f'{option_name}: {option_contents_text}')
-    option_text = ', and '.join(option_texts)
-
-    doc = dict()
-    doc['id'] = p['asin']
-    doc['contents'] = ' '.join([
-        p['Title'],
-        p['Description'],
-        p['BulletPoints'][0],
-        option_text,
-    ]).lower()
-    doc['product'] = p
-    docs.append(doc)
-
-
-with open('./resources_100/documents.jsonl', 'w+') as f:
-    for doc in docs[:100]:
-        f.write(json.dumps(doc) + '\n')
-
-with open('./resources/documents.jsonl', 'w+') as f:
-    for doc in docs:
-        f.write(json.dumps(doc) + '\n')
-
-with open('./resources_1k/documents.jsonl', 'w+') as f:
-    for doc in docs[:1000]:
-        f.write(json.dumps(doc) + '\n')
-
-with open('./resources_100k/documents.jsonl', 'w+') as f:
-    for doc in docs[:100000]:
-        f.write(json.dumps(doc) + '\n')
+    # with a compiled catalog, products are decoded as they are exported
+    all_products, *_ = load_products(
+        filepath=args.file_path, lazy=True, num_workers=args.num_workers
+    )
+    export_corpora(all_products, num_workers=args.num_workers)
@@ -9,7 +9,7 @@ hits = searcher.search('rubber sole shoes', k=20)
 for hit in hits:
     doc = searcher.doc(hit.docid)
     print(doc)
-    obj = json.loads(doc.raw())['product']['Title']
-    print(obj)
+    contents = json.loads(doc.raw())['contents']
+    print(hit.docid, hit.score, contents[:100])
 
 print(len(hits))
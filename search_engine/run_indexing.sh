@@ -1,31 +1,31 @@
-python -m pyserini.index.lucene \
-  --collection JsonCollection \
-  --input resources_100 \
-  --index indexes_100 \
-  --generator DefaultLuceneDocumentGenerator \
-  --threads 1 \
-  --storePositions --storeDocvectors --storeRaw
+#!/bin/bash
+# Build a Lucene index from each corpus written by convert_product_file_format.py.
+# JOBS sets how many indexes are built at once, THREADS the indexing threads of each.
+# With more than one thread the order of docids, which breaks ties between equal
+# BM25 scores, is not deterministic, so search results differ from the baseline indexes.
+THREADS=${THREADS:-1}
+JOBS=${JOBS:-4}
 
-python -m pyserini.index.lucene \
-  --collection JsonCollection \
-  --input resources \
-  --index indexes \
-  --generator DefaultLuceneDocumentGenerator \
-  --threads 1 \
-  --storePositions --storeDocvectors --storeRaw
+build_index () {
+  local input=$1
+  local index=$2
+  local start=$SECONDS
+  python -m pyserini.index.lucene \
+    --collection JsonCollection \
+    --input $input \
+    --index $index \
+    --generator DefaultLuceneDocumentGenerator \
+    --threads $THREADS \
+    --storePositions --storeDocvectors --storeRaw
+  local docs=$(wc -l < $input/documents.jsonl)
+  local elapsed=$((SECONDS - start))
+  echo "Indexed $docs documents into $index in ${elapsed}s ($((docs / (elapsed > 0 ? elapsed : 1))) docs/s)"
+}
 
-python -m pyserini.index.lucene \
-  --collection JsonCollection \
-  --input resources_1k \
-  --index indexes_1k \
-  --generator DefaultLuceneDocumentGenerator \
-  --threads 1 \
-  --storePositions --storeDocvectors --storeRaw
-
-python -m pyserini.index.lucene \
-  --collection JsonCollection \
-  --input resources_100k \
-  --index indexes_100k \
-  --generator DefaultLuceneDocumentGenerator \
-  --threads 1 \
-  --storePositions --storeDocvectors --storeRaw
+for corpus in resources:indexes resources_100k:indexes_100k resources_1k:indexes_1k resources_100:indexes_100; do
+  build_index ${corpus%%:*} ${corpus##*:} &
+  while (( $(jobs -rp | wc -l) >= JOBS )); do
+    wait -n
+  done
+done
+wait
@@ -47,6 +47,9 @@ cd ..
 # Download spaCy large NLP model
 python -m spacy download en_core_web_lg
 
+# Compile cleaned products into binary catalogs for fast loading
+python -m web_agent_site.engine.catalog
+
 # Build search engine index
 cd search_engine
 mkdir -p resources resources_100 resources_1k resources_100k
@@ -0,0 +1,145 @@
+import json
+import random
+import pytest
+from web_agent_site.engine.catalog import *
+
+def test_record_file_round_trip(tmp_path):
+    path = str(tmp_path / 'records.catalog')
+    records = [
+        ('B000000001', {'asin': 'B000000001', 'pricing': [10.0]}),
+        ('B000000002', {'asin': 'B000000002', 'options': {'color': ['red']}}),
+        ('B000000003', {}),
+    ]
+    writer = RecordWriter(path)
+    for key, value in records:
+        writer.add(key, value)
+    writer.close(meta={'extra': [1, 2, 3]})
+
+    record_file = RecordFile(path)
+    assert len(record_file) == 3
+    assert [record_file.key(i) for i in range(3)] == [k for k, _ in records]
+    assert record_file.meta['extra'] == [1, 2, 3]
+    for i, (key, value) in enumerate(records):
+        assert record_file.get(i) == value
+        assert record_file.get_by_key(key) == value
+    assert record_file.position('B000000004') is None
+    with pytest.raises(KeyError):
+        record_file.get_by_key('B000000004')
+
+def test_load_catalog_stale(tmp_path):
+    source = tmp_path / 'items.json'
+    source.write_text('[]')
+    path = get_catalog_path(str(source), human_goals=True)
+    assert path.endswith('items.human.catalog')
+    assert load_catalog(path, [str(source)]) is None
+
+    products = [{'asin': 'B000000001', 'pricing': [1.0], 'Attributes': ['a']}]
+    write_catalog(path, products, {'a': {'B000000001'}}, [str(source)])
+    catalog = load_catalog(path, [str(source)])
+    assert catalog is not None
+    assert catalog.get(0) == products[0]
+    assert catalog.section('attribute_to_asins') == {'a': ['B000000001']}
+
+    # Modifying the source file invalidates the compiled catalog
+    source.write_text('[{}]')
+    assert load_catalog(path, [str(source)]) is None
+
+def test_product_store(tmp_path):
+    source = tmp_path / 'items.json'
+    source.write_text('[]')
+    path = str(tmp_path / 'items.human.catalog')
+    products = [
+        {'asin': 'B000000003', 'pricing': [5.0, 7.5]},
+        {'asin': 'B000000001', 'pricing': [1.0]},
+        {'asin': 'B0002', 'pricing': [2.0]},
+    ]
+    write_catalog(path, products, {}, [str(source)])
+    catalog = load_catalog(path, [str(source)])
+
+    store = ProductStore(catalog, cache_size=1)
+    assert len(store) == 3
+    assert list(store) == ['B000000003', 'B000000001', 'B0002']
+    assert 'B0002' in store and 'B000000002' not in store
+    assert store['B000000001'] == products[1]
+    assert store['B000000001'] is store['B000000001']
+    assert store.products[-1] == products[2]
+    assert store.products[:2] == products[:2]
+    assert list(store.products.iter_pricing()) == [
+        ('B000000003', [5.0, 7.5]), ('B000000001', [1.0]), ('B0002', [2.0]),
+    ]
+
+    # Limiting the number of records hides the rest of the catalog
+    store = ProductStore(catalog, num_records=1)
+    assert list(store.products) == products[:1]
+    assert 'B000000001' not in store
+    with pytest.raises(KeyError):
+        store['B000000001']
+
+def test_attribute_index(tmp_path):
+    path = tmp_path / 'items_ins.json'
+    entries = {
+        'B000000001': {'attributes': ['vegan'], 'instruction': 'i want vegan tea'},
+        'B000000002': {'attributes': []},
+    }
+    path.write_text(json.dumps(entries))
+    assert load_attribute_index(str(path)) is None
+
+    index_path = write_attribute_index(str(path))
+    assert index_path == str(tmp_path / 'items_ins.index')
+    attributes = load_attribute_index(str(path))
+    assert 'B000000001' in attributes and 'B000000003' not in attributes
+    assert attributes['B000000001'] == entries['B000000001']
+    assert dict(attributes) == entries
+
+def test_product_index(tmp_path):
+    source = tmp_path / 'items.json'
+    source.write_text('[]')
+    path = str(tmp_path / 'items.human.catalog')
+    products = [
+        {'asin': 'B0', 'pricing': [], 'category': 'beauty', 'query': 'soap', 'Attributes': ['vegan']},
+        {'asin': 'B1', 'pricing': [], 'category': 'food', 'query': 'tea', 'Attributes': ['vegan', 'vegan']},
+        {'asin': 'B2', 'pricing': [], 'category': 'beauty', 'query': 'tea', 'Attributes': []},
+    ]
+    write_catalog(path, products, {}, [str(source)])
+    catalog = load_catalog(path, [str(source)])
+
+    for all_products in [products, ProductStore(catalog).products]:
+        index = ProductIndex.build(all_products)
+        assert index.products('category', 'beauty') == [products[0], products[2]]
+        assert index.products('query', 'tea') == products[1:]
+        assert index.products('attribute', 'vegan') == products[:2]
+        assert index.products('attribute', 'organic') == []
+        random.seed(0)
+        sample = index.sample(2)
+        random.seed(0)
+        assert sample == random.sample(products, 2)
+
+    # the catalog index also serves the first products of the catalog
+    index = ProductIndex.build(ProductStore(catalog, num_records=2).products)
+    assert index.products('category', 'beauty') == products[:1]
+
+def test_update_catalog(tmp_path):
+    source = tmp_path / 'items.json'
+    source.write_text('[]')
+    path = str(tmp_path / 'items.human.catalog')
+    products = [
+        {'asin': f'B{i}', 'pricing': [float(i)], 'category': 'beauty', 'query': 'soap',
+         'Attributes': ['vegan'] if i % 2 else []}
+        for i in range(4)
+    ]
+    write_catalog(path, products, {'vegan': {'B1', 'B3'}}, [str(source)])
+    catalog = load_catalog(path, [str(source)])
+
+    changed = dict(products[2], category='food', Attributes=['vegan'])
+    added = {'asin': 'B9', 'pricing': [9.0, 10.0], 'category': 'food', 'query': 'tea', 'Attributes': []}
+    positions = update_catalog(catalog, [changed, added], remove=['B1'])
+    assert list(positions) == [0, -1, 1, 2]
+
+    catalog = load_catalog(path, [str(source)])
+    expected = [products[0], changed, products[3], added]
+    assert [catalog.get(i) for i in range(len(catalog))] == expected
+    assert catalog.get_by_key('B9') == added
+    assert list(ProductStore(catalog).products.iter_pricing()) == \
+        [(p['asin'], p['pricing']) for p in expected]
+    assert catalog.section('attribute_to_asins') == {'vegan': ['B2', 'B3']}
+    assert catalog.section('product_index') == build_product_index(expected)
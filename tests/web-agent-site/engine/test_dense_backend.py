@@ -0,0 +1,33 @@
+from web_agent_site.engine.dense_backend import *
+
+def get_index():
+    documents = [(f'S{i}', f'running shoes sneakers trainers size {i}') for i in range(20)] + \
+        [(f'H{i}', f'wool winter hat beanie cap color {i}') for i in range(20)]
+    bm25 = BM25Index.build(documents, stem=False)
+    return bm25, DenseIndex.build(bm25, dim=4, num_clusters=2, use_faiss=False)
+
+def test_dense_index(tmp_path):
+    bm25, index = get_index()
+    assert len(index) == 40
+
+    # terms that co-occur with the query's rank products without them
+    hits = index.search('sneakers', k=5)
+    assert len(hits) == 5 and all(hit.docid.startswith('S') for hit in hits)
+    assert all(hit.docid.startswith('H') for hit in index.search('beanie cap', k=5))
+    assert index.search('unknown', k=5) == []
+
+    index.save(str(tmp_path / 'index'))
+    loaded = DenseIndex.load(str(tmp_path / 'index'))
+    assert loaded.search('sneakers', k=5) == hits
+    assert loaded.search_many(['sneakers', 'hat'], k=5) == \
+        [hits, index.search('hat', k=5)]
+
+def test_hybrid_backend():
+    bm25, index = get_index()
+    hybrid = HybridBackend(bm25, index, k_rrf=60)
+    hits = hybrid.search('size 3 sneakers', k=3)
+    # the exact match is first in the BM25 ranking, and fused by reciprocal rank
+    assert hits[0].docid == 'S3'
+    dense_rank = [hit.docid for hit in index.search('size 3 sneakers', k=100)].index('S3') + 1
+    assert hits[0].score == 1 / 61 + 1 / (60 + dense_rank)
+    assert hybrid.search_many(['size 3 sneakers'], k=3) == [hits]
@@ -0,0 +1,99 @@
+import json
+import random
+import pytest
+from flask import render_template_string
+from web_agent_site.engine import engine
+from web_agent_site.engine.engine import *
+from web_agent_site.envs.web_agent_text_env import app
+
+def render_from_source(template_name, **context):
+    return render_template_string(
+        read_html_template(os.path.join(TEMPLATE_DIR, template_name)), **context
+    )
+
+def test_render_page():
+    product = {'asin': 'B0', 'Title': 'Red <shoes> & socks', 'Price': '$10.0'}
+    pages = [
+        ('search_page.html', dict(session_id='abc', instruction_text='find <shoes>')),
+        ('results_page.html', dict(
+            session_id='abc', products=[product], keywords=['red', 'shoes'],
+            page=2, total=20, instruction_text='find shoes',
+        )),
+    ]
+    with app.app_context(), app.test_request_context():
+        for template_name, context in pages:
+            html = render_page(template_name, **context)
+            assert html == render_from_source(template_name, **context)
+            # rendered from the compiled template afterwards
+            assert render_page(template_name, **context) == html
+
+        env = get_template_env(app)
+        assert len(env.cache) == 2
+        reload_templates()
+        assert len(env.cache) == 0
+        assert render_page(template_name, **context) == html
+
+def write_raw_products(tmp_path):
+    products = []
+    for i, asin in enumerate(
+        [f'B0000000{i:02d}' for i in range(10)] + ['B000000003', 'nan', 'B0000000001', 'B000000010']
+    ):
+        products.append({
+            'asin': asin,
+            'name': f'Shirt {i}',
+            'category': 'fashion',
+            'query': f' Shirts {i % 3} ',
+            'product_category': 'a › b',
+            'full_description': f'shirt number {i}',
+            'small_description': [f'cotton {i}'] if i % 2 else f'cotton {i}',
+            'pricing': ['', '$12.99', '$5.00 - $25.50'][i % 3],
+            'customization_options': {
+                'Color': [{'value': 'Red/Blue', 'image': 'red.jpg'}, {'value': 'green'}],
+                'Size': None,
+            } if i % 4 else None,
+            'images': [f'{i}.jpg'],
+        })
+    attributes = {
+        p['asin']: {
+            'attributes': ['cotton', f'attr {i % 3}'],
+            'instruction': f'i want shirt {i}',
+            'instruction_attributes': ['cotton'],
+        }
+        for i, p in enumerate(products) if i != 5
+    }
+    attributes['B000000005'] = {'instruction': 'no attributes'}
+    human_attributes = {p['asin']: [{'instruction': f'shirt {i}'}] for i, p in enumerate(products[:4])}
+    paths = []
+    for name, data in [('items.json', products), ('attrs.json', attributes), ('human.json', human_attributes)]:
+        paths.append(str(tmp_path / name))
+        with open(paths[-1], 'w') as f:
+            json.dump(data, f)
+    return paths
+
+@pytest.mark.parametrize('human_goals', [True, False])
+def test_parallel_cleaning_matches_serial(tmp_path, monkeypatch, human_goals):
+    products_path, attrs_path, human_attrs_path = write_raw_products(tmp_path)
+    monkeypatch.setattr(engine, 'DEFAULT_ATTR_PATH', attrs_path)
+    monkeypatch.setattr(engine, 'HUMAN_ATTR_PATH', human_attrs_path)
+    # several batches per worker
+    monkeypatch.setattr(engine, 'CLEAN_BATCH_SIZE', 2)
+
+    # the first `rich.print` imports modules that draw from `random`
+    load_products(products_path, human_goals=human_goals)
+    loaded = []
+    for num_workers in [1, 3]:
+        random.seed(0)
+        loaded.append(load_products(products_path, human_goals=human_goals, num_workers=num_workers))
+    (all_products, product_item_dict, product_prices, attribute_to_asins), parallel = loaded
+
+    assert [p['asin'] for p in all_products] == [f'B0000000{i:02d}' for i in range(11)]
+    assert parallel[0] == all_products
+    assert parallel[1] == product_item_dict
+    assert parallel[2] == product_prices
+    assert parallel[3] == attribute_to_asins
+
+    # num_products stops at the same product
+    random.seed(0)
+    serial = load_products(products_path, num_products=4, human_goals=human_goals, num_workers=1)
+    random.seed(0)
+    assert load_products(products_path, num_products=4, human_goals=human_goals, num_workers=3) == serial
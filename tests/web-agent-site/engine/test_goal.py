@@ -197,4 +197,56 @@ def test_get_reward():
     purchased['query'] = "Query 2"
     purchased['product_category'] = "a › d › e"
     total_reward = get_reward(purchased, goal, 35, purchased['goal_options'])
-    assert isclose(total_reward, 0.2857, abs_tol=1e-2)
\ No newline at end of file
+    assert isclose(total_reward, 0.2857, abs_tol=1e-2)
+
+def test_get_goal_set():
+    all_products = [{
+        'asin': f'b0000000{i:02d}',
+        'category': 'beauty',
+        'query': 'shampoo',
+        'name': f'Shampoo {i}',
+        'product_category': 'a › b',
+        'instructions': [{
+            'instruction': f'i need shampoo number {i}.',
+            'instruction_attributes': ['natural'],
+            'instruction_options': {},
+        }],
+    } for i in range(20)]
+    product_prices = {p['asin']: 10. for p in all_products}
+
+    # Shuffled order is fixed regardless of prior random state
+    random.seed(0)
+    goals = get_goal_set(all_products, product_prices)
+    random.seed(1)
+    assert [g['asin'] for g in goals] == \
+        [g['asin'] for g in get_goal_set(all_products, product_prices)]
+    assert sorted(g['asin'] for g in goals) == [p['asin'] for p in all_products]
+
+    # Filter is applied to the shuffled goals
+    goals = get_goal_set(
+        all_products, product_prices, filter_goals=lambda i, goal: i < 5
+    )
+    assert len(goals) == 5
+
+    # Limit selects distinct goals
+    goals = get_goal_set(all_products, product_prices, limit_goals=7)
+    assert len(goals) == 7
+    assert len(set(g['asin'] for g in goals)) == 7
+
+def test_synthetic_goals_skip_empty_options():
+    all_products = [{
+        'asin': f'b0000000{i:02d}',
+        'category': 'beauty',
+        'query': 'shampoo',
+        'Title': f'Shampoo {i}',
+        'product_category': 'a › b',
+        'instruction_text': f'i need shampoo number {i}',
+        'instruction_attributes': ['natural'] if i else ['vegan'],
+        'options': {'size': [] if i == 0 else ['s', 'm'], 'scent': ['mint']},
+    } for i in range(3)]
+    product_prices = {p['asin']: 15. for p in all_products}
+
+    # an option without values leaves the product without goals
+    goals = get_goals(all_products, product_prices, human_goals=False)
+    assert [g['asin'] for g in goals] == ['b000000001'] * 2 + ['b000000002'] * 2
+    assert all(isclose(g['weight'], 1 / 4) for g in goals)
@@ -0,0 +1,66 @@
+import random
+from web_agent_site.engine.engine import generate_product_prices
+from web_agent_site.engine.goal import get_goal_set, select_goals
+from web_agent_site.engine.goal_cache import *
+
+def make_products():
+    products = []
+    for i in range(12):
+        products.append({
+            'asin': f'B0000000{i:02d}',
+            'category': 'fashion',
+            'query': 'shirt',
+            'name': f'Shirt {i}',
+            'Title': f'Shirt {i}',
+            'product_category': 'a › b',
+            'pricing': [10. * i + 5, 10. * i + 25] if i % 2 else [10. * i + 5],
+            'instruction_text': None if i == 3 else f'i want shirt {i}',
+            'instruction_attributes': ['cotton', 'slim'][:1 + i % 2],
+            'options': {
+                'size': ['s', 'm', 'l'][:1 + i % 3],
+                'color': ['red', 'blue'][:1 + i % 2],
+            } if i != 5 else {},
+        })
+    return products
+
+def test_synthetic_goal_set(tmp_path):
+    products = make_products()
+    random.seed(7)
+    product_prices = generate_product_prices(products)
+    expected = get_goal_set(products, product_prices, human_goals=False)
+    expected_state = random.getstate()
+
+    path = str(tmp_path / 'synthetic.goals')
+    compile_goal_set(path, products, human_goals=False, seed=7)
+    random.seed(0)
+    goals, loaded_prices = load_goal_set(path)
+    assert random.getstate() == expected_state
+    assert loaded_prices == product_prices
+    assert len(goals) == len(expected)
+    assert list(goals) == expected
+    assert goals[-1] == expected[-1]
+    assert list(goals.weights) == [goal['weight'] for goal in expected]
+
+    random.seed(1)
+    expected = select_goals(expected, lambda i, goal: i % 2 == 0, limit_goals=4)
+    random.seed(1)
+    goals = select_goals(goals, lambda i, goal: i % 2 == 0, limit_goals=4)
+    assert list(goals) == expected
+    assert list(goals.weights) == [goal['weight'] for goal in expected]
+
+def test_goal_set_staleness(tmp_path):
+    products = make_products()
+    source = tmp_path / 'items.json'
+    source.write_text('[]')
+    path = get_goal_set_path(str(source), human_goals=False, seed=3, goal_dir=str(tmp_path))
+    assert path != get_goal_set_path(str(source), human_goals=False, seed=4, goal_dir=str(tmp_path))
+    assert load_goal_set(path, [str(source)]) is None
+
+    compile_goal_set(path, products, human_goals=False, seed=3, sources=[str(source)])
+    goals, _ = load_goal_set(path, [str(source)])
+    assert len(goals) == sum(
+        len(p['options'].get('size', [1])) * len(p['options'].get('color', [1]))
+        for p in products if p['instruction_text'] is not None
+    )
+    source.write_text('[{}]')
+    assert load_goal_set(path, [str(source)]) is None
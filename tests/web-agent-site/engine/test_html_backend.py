@@ -0,0 +1,56 @@
+import pytest
+from web_agent_site.engine.html_backend import *
+from web_agent_site.engine.page import Page
+from web_agent_site.envs.web_agent_text_env import app
+
+from test_page import pages
+
+backends = [
+    pytest.param(backend, marks=pytest.mark.skipif(
+        backend not in available_backends(), reason=f'{backend} is not installed'
+    ))
+    for backend in ['lxml', 'selectolax']
+]
+
+def read(page, instruction=True):
+    # newline strings between tags are not part of observations
+    return dict(
+        text_nodes=[node for node in page.text_nodes if node.text != '\n'],
+        clickables=[
+            (text, attrs.get('name'), attrs.get('value'), list(attrs.get('class') or []))
+            for text, attrs in page.clickables.items()
+        ],
+        has_search_bar=page.has_search_bar,
+        image_url=page.image_url,
+        reward=page.reward,
+        instruction_text=page.instruction_text if instruction else None,
+    )
+
+@pytest.mark.parametrize('backend', backends)
+@pytest.mark.parametrize('action, kwargs', pages)
+def test_backend_matches_bs4(action, kwargs, backend):
+    with app.app_context(), app.test_request_context():
+        page = Page(action, **kwargs)
+        html = page.html
+    instruction = page.template != 'done_page.html'
+    assert read(parse_page(html, backend), instruction) == read(parse_page(html), instruction)
+
+@pytest.mark.parametrize('backend', backends)
+def test_backend_reads_strings_as_bs4(backend):
+    html = (
+        '<html><head><title>t</title><style>p {}</style></head><body>'
+        '<div id="instruction-text"><h4>Instruction:<br>a\r\nb</h4></div>'
+        '<h4><a class="product-link">B01</a></h5>\n  <p>x<!-- <h5>y</h5> --> z</p>'
+        '<p><pre>\n1</pre> (code)</p>\n <pre> </pre><div>\t</div>'
+        '<button class="btn btn-primary">Next &gt;</button>'
+        '<input type="radio" name="color" value="red"><label>red</label>'
+        '<script>"</div>"</script></body></html>'
+    )
+    assert read(parse_page(html, backend)) == read(parse_page(html))
+
+def test_parse_page():
+    page = parse_page('<html><body><input id="search_input"><button class="btn">Search</button></body></html>')
+    assert isinstance(page, ParsedPage)
+    assert page.has_search_bar and list(page.clickables) == ['search']
+    with pytest.raises(ValueError):
+        parse_page('', backend='html5lib')
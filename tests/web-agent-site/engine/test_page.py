@@ -0,0 +1,70 @@
+import pytest
+from web_agent_site.engine.page import *
+from web_agent_site.envs.web_agent_text_env import ParsedPage, app
+
+product = {
+    'asin': 'B000000001',
+    'Title': 'Red <shoes> & "socks"',
+    'Price': '$10.0',
+    'Rating': 'N.A.',
+    'MainImage': 'https://example.com/a.jpg',
+    'Description': '   ',
+    'BulletPoints': ['soft', '', 'a\nb'],
+    'Reviews': [{'title': 'good', 'score': '4.0', 'body': ''}, {'title': 'bad', 'score': 1, 'body': 'no'}],
+    'Attributes': ['cotton', ' '],
+    'category': 'shoes',
+    'query': 'red shoes',
+    'options': {'color': ['red', 'blue & green'], 'size': ['10']},
+    'option_to_image': {},
+}
+
+pages = [
+    ('start', dict(session_id='abc', instruction_text='find <shoes>')),
+    ('start', dict(session_id='abc', instruction_text='')),
+    ('search[red shoes]', dict(
+        session_id='abc', products=[product, dict(product, asin='B000000002', Title='')],
+        keywords=['red', 'shoes'], page=1, total=2, instruction_text='find shoes',
+    )),
+    ('search[red shoes]', dict(
+        session_id='abc', products=[], keywords=['red'], page=3, total=0, instruction_text='i',
+    )),
+    ('click[B000000001]', dict(
+        session_id='abc', product_info=product, keywords=['red'], page=1, asin='B000000001',
+        options={'color': 'red'}, instruction_text='i', show_attrs=True,
+    )),
+    ('click[Buy Now]', dict(
+        session_id='abc', reward=0.5, asin='B000000001', options={'color': 'blue & green'},
+        instruction_text='i', goal={'asin': 'B000000001', 'query': 'shoes'},
+    )),
+] + [
+    (f'click[{sub_page}]', dict(
+        session_id='abc', product_info=product, keywords=['red'], page=1, asin='B000000001',
+        options={}, instruction_text='i',
+    ))
+    for sub_page in ['Description', 'Features', 'Reviews', 'Attributes']
+]
+
+@pytest.mark.parametrize('action, kwargs', pages)
+def test_page_matches_rendered_html(action, kwargs):
+    page = Page(action, **kwargs)
+    with app.app_context(), app.test_request_context():
+        parsed = ParsedPage(page.html)
+
+    # newline strings between tags are not part of observations
+    assert [node for node in page.text_nodes if node.text != '\n'] == \
+        [node for node in parsed.text_nodes if node.text != '\n']
+    assert list(page.clickables) == list(parsed.clickables)
+    for text, tag in parsed.clickables.items():
+        assert page.clickables[text].get('name') == tag.get('name')
+        assert ('product-link' in page.clickables[text].get('class', [])) == \
+            ('product-link' in tag.get('class', []))
+    assert page.has_search_bar == parsed.has_search_bar
+    assert page.image_url == parsed.image_url
+    if page.template != 'done_page.html':
+        assert page.instruction_text == parsed.instruction_text
+
+def test_page_keeps_options():
+    options = {'color': 'red'}
+    page = Page('click[Description]', product_info=product, options=options)
+    options['size'] = '10'
+    assert page.kwargs['options'] == {'color': 'red'}
@@ -0,0 +1,66 @@
+import pytest
+from web_agent_site.engine.html_backend import parse_page
+from web_agent_site.engine.page import Page
+from web_agent_site.engine.page_cache import *
+from web_agent_site.envs.web_agent_text_env import app
+
+from test_page import pages, product
+
+def render_parsed(action, **kwargs):
+    return parse_page(Page(action, **kwargs).html)
+
+def read(page):
+    return dict(
+        html=page.html,
+        text_nodes=page.text_nodes,
+        clickables=[
+            (text, attrs.get('name'), attrs.get('value'), list(attrs.get('class') or []))
+            for text, attrs in page.clickables.items()
+        ],
+        has_search_bar=page.has_search_bar,
+        image_url=page.image_url,
+        instruction_text=page.instruction_text,
+    )
+
+@pytest.mark.parametrize('render', [Page, render_parsed])
+@pytest.mark.parametrize('action, kwargs', [page for page in pages if page[0] != 'click[Buy Now]'])
+def test_session_page_matches_rendered_page(action, kwargs, render):
+    cache = PageCache()
+    with app.app_context(), app.test_request_context():
+        for session_id, instruction_text in [
+            ('abc', 'find <shoes> & "socks"'), ('fixed_1', ''), ('x', ' \n '), ('abc', None),
+        ]:
+            kwargs = dict(kwargs, session_id=session_id, instruction_text=instruction_text)
+            page = cache.get(render, action, **kwargs)
+            assert isinstance(page, SessionPage)
+            assert read(page) == read(render(action, **kwargs))
+    assert cache.stats()['hits'] == 3 and cache.stats()['misses'] == 1
+
+def test_page_cache():
+    rendered = []
+    def render(action, **kwargs):
+        rendered.append(action)
+        return Page(action, **kwargs)
+
+    cache = PageCache()
+    kwargs = dict(product_info=product, keywords=['red'], page=1, asin='B000000001', show_attrs=False)
+    cache.get(render, 'click[B000000001]', session_id='a', instruction_text='i', options={}, **kwargs)
+    cache.get(render, 'click[b000000001]', session_id='b', instruction_text='j', options={}, **kwargs)
+    cache.get(render, 'click[B000000001]', session_id='a', instruction_text='i', options={'color': 'red'}, **kwargs)
+    assert rendered == ['click[B000000001]', 'click[B000000001]']
+
+    # done pages, and sessions whose ID is quoted in URLs, are not cached
+    assert cache.get(render, 'click[Buy Now]', session_id='a', reward=1., asin='B000000001', options={}) is None
+    assert cache.get(render, 'start', session_id='a b', instruction_text='i') is None
+    stats = cache.stats()
+    assert stats['size'] == 2 and stats['bytes'] > 0
+    assert (stats['hits'], stats['misses'], stats['uncached']) == (1, 2, 2)
+    assert stats['hit_rate'] == pytest.approx(1 / 3)
+
+    # least recently used pages are evicted past the memory bound
+    cache = PageCache(max_bytes=stats['bytes'] - 1)
+    cache.get(render, 'click[B000000001]', session_id='a', instruction_text='i', options={}, **kwargs)
+    cache.get(render, 'click[B000000001]', session_id='a', instruction_text='i', options={'color': 'red'}, **kwargs)
+    assert len(cache) == 1 and cache.stats()['evictions'] == 1
+    cache.clear()
+    assert len(cache) == 0 and cache.stats()['bytes'] == 0
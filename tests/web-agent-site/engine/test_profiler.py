@@ -0,0 +1,33 @@
+from web_agent_site.engine.profiler import *
+
+
+def test_startup_profile():
+    with phase('outside'):
+        pass
+    with StartupProfile('test') as profile:
+        with phase('outer'):
+            with phase('inner'):
+                pass
+        with phase('second'):
+            pass
+    with phase('after'):
+        pass
+
+    assert [p['name'] for p in profile.phases] == ['outer', 'inner', 'second']
+    assert [p['depth'] for p in profile.phases] == [0, 1, 0]
+    assert all(p['time'] >= 0 for p in profile.phases)
+    assert all(p['peak_rss_delta_mb'] is None or p['peak_rss_delta_mb'] >= 0 for p in profile.phases)
+    assert profile.total_time >= profile.phases[0]['time']
+    assert 'after' in [p['name'] for p in PROCESS_PROFILE.phases]
+
+    summary = profile.summary()
+    assert summary.startswith('test ')
+    assert 'outer' in summary and 'second' in summary and 'inner' not in summary
+    assert 'inner' in profile.summary(max_depth=1)
+    assert profile.to_dict()['phases'][1]['name'] == 'inner'
+
+def test_process_profile_is_bounded():
+    for _ in range(MAX_PROCESS_PHASES + 1):
+        with phase('repeated'):
+            pass
+    assert len(PROCESS_PROFILE.phases) == MAX_PROCESS_PHASES
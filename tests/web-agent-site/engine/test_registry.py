@@ -0,0 +1,43 @@
+import random
+from web_agent_site.engine import registry
+from web_agent_site.engine.registry import *
+
+def test_shared_goal_set_leaves_random_alone(monkeypatch):
+    loads = []
+    def get_goal_set(*args, **kwargs):
+        loads.append(args)
+        random.seed(233)
+        return [f'goal {i}' for i in range(10)]
+    monkeypatch.setattr(registry, 'load_products', lambda **kwargs: ([], {}, {}, {}))
+    monkeypatch.setattr(registry, 'get_goal_set', get_goal_set)
+    clear_registry()
+    try:
+        goals = get_shared_goal_set('items.json', 10, lazy=True)
+        assert random.getstate() == random.Random(233).getstate()
+
+        random.seed(1)
+        state = random.getstate()
+        assert get_shared_goal_set('items.json', 10, lazy=True) is goals
+        assert random.getstate() == state
+        assert len(loads) == 1
+    finally:
+        clear_registry()
+
+def test_filtered_goal_sets_are_not_shared(monkeypatch):
+    builds = []
+    def get_goal_set(*args, filter_goals=None, limit_goals=-1):
+        builds.append(filter_goals)
+        return [f'goal {i}' for i in range(10) if filter_goals is None or filter_goals(i, None)]
+    monkeypatch.setattr(registry, 'load_products', lambda **kwargs: ([], {}, {}, {}))
+    monkeypatch.setattr(registry, 'get_goal_set', get_goal_set)
+    clear_registry()
+    try:
+        for _ in range(3):
+            goals = get_shared_goal_set('items.json', 10, filter_goals=lambda i, goal: i < 5)
+            assert goals == [f'goal {i}' for i in range(5)]
+        assert len(builds) == 3 and len(registry._goal_sets) == 0
+
+        assert get_shared_goal_set('items.json', 10) is get_shared_goal_set('items.json', 10)
+        assert len(builds) == 4 and len(registry._goal_sets) == 1
+    finally:
+        clear_registry()
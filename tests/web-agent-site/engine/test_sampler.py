@@ -0,0 +1,41 @@
+import random
+import numpy as np
+import pytest
+from web_agent_site.engine.sampler import *
+
+def test_weighted_sampler():
+    weights = [1, 0, 2, 7]
+    sampler = WeightedSampler(weights, rng=random.Random(0))
+    counts = np.bincount([sampler.sample() for _ in range(20000)], minlength=4)
+    assert counts[1] == 0
+    assert np.allclose(counts / counts.sum(), [.1, 0, .2, .7], atol=.02)
+
+    counts = np.bincount(sampler.sample_batch(20000), minlength=4)
+    assert counts[1] == 0
+    assert np.allclose(counts / counts.sum(), [.1, 0, .2, .7], atol=.02)
+
+    # Seeded samplers give the same samples
+    other = WeightedSampler(weights, rng=random.Random(0))
+    sampler = WeightedSampler(weights, rng=random.Random(0))
+    assert [sampler.sample() for _ in range(10)] == [other.sample() for _ in range(10)]
+    assert sampler.sample_batch(10).tolist() == other.sample_batch(10).tolist()
+
+def test_sample_without_replacement():
+    sampler = WeightedSampler([1, 0, 2, 7], rng=random.Random(0))
+    for k in range(4):
+        idxs = sampler.sample_without_replacement(k).tolist()
+        assert len(idxs) == len(set(idxs)) == k
+        assert 1 not in idxs
+    with pytest.raises(ValueError):
+        sampler.sample_without_replacement(4)
+
+    # First index drawn follows the weights
+    firsts = np.bincount(
+        [sampler.sample_without_replacement(2)[0] for _ in range(5000)], minlength=4
+    )
+    assert np.allclose(firsts / firsts.sum(), [.1, 0, .2, .7], atol=.03)
+
+def test_weighted_sampler_invalid():
+    for weights in [[], [0, 0], [1, -1], [1, float('nan')]]:
+        with pytest.raises(ValueError):
+            WeightedSampler(weights)
@@ -0,0 +1,82 @@
+import math
+import pytest
+from web_agent_site.engine.search_backend import *
+from web_agent_site.engine.search_backend import _lucene_length_norm
+
+def test_analyzer():
+    analyzer = Analyzer(stem=False)
+    assert analyzer("The Runner's shoes, size 10.5 and 1,000 pairs") == \
+        ['runner', 'shoes', 'size', '10.5', '1,000', 'pairs']
+
+def test_lucene_length_norm():
+    assert [_lucene_length_norm(n) for n in [0, 23, 24, 39, 40, 41, 100]] == \
+        [0, 23, 24, 39, 40, 40, 96]
+
+def test_bm25_index(tmp_path):
+    documents = [
+        ('B0', 'red running shoes'),
+        ('B1', 'blue shoes'),
+        ('B2', 'red red hat'),
+        ('B3', 'blue shoes'),
+    ]
+    index = BM25Index.build(documents, stem=False)
+    assert len(index) == 4
+
+    hits = index.search('red shoes', k=10)
+    assert [hit.docid for hit in hits] == ['B0', 'B2', 'B1', 'B3']
+    # score of a single term matches Lucene's BM25
+    k1, b, avgdl = .9, .4, 10 / 4
+    idf = math.log(1 + (4 - 2 + .5) / (2 + .5))
+    expected = idf * 2 / (2 + k1 * (1 - b + b * 3 / avgdl))
+    assert index.search('hat red', k=1)[0].docid == 'B2'
+    assert math.isclose(index.search('red', k=1)[0].score, expected, rel_tol=1e-6)
+
+    # ties are broken by index order, including at the cutoff
+    assert [hit.docid for hit in index.search('blue', k=1)] == ['B1']
+    assert index.search('green', k=10) == []
+
+    index.save(str(tmp_path / 'index'))
+    loaded = BM25Index.load(str(tmp_path / 'index'))
+    assert loaded.search('red shoes', k=3) == index.search('red shoes', k=3)
+
+def test_bm25_index_search_many():
+    documents = [
+        ('B0', 'red running shoes'),
+        ('B1', 'blue shoes'),
+        ('B2', 'red red hat'),
+        ('B3', 'blue shoes'),
+    ]
+    index = BM25Index.build(documents, stem=False)
+    queries = ['red shoes', 'green', 'blue', 'shoes shoes hat']
+    for k in [1, 2, 10]:
+        assert index.search_many(queries, k=k) == [index.search(q, k=k) for q in queries]
+    assert index.search_many(['green'], k=10) == [[]]
+    assert index.search_many([], k=10) == []
+
+def test_init_search_backend_unknown():
+    with pytest.raises(ValueError):
+        init_search_backend(backend='elastic')
+
+def test_bm25_index_update(tmp_path):
+    documents = [
+        ('B0', 'red running shoes'),
+        ('B1', 'blue shoes'),
+        ('B2', 'red red hat'),
+        ('B3', 'blue shoes'),
+    ]
+    index = BM25Index.build(documents, stem=False)
+    index.save(str(tmp_path / 'index'))
+    index = BM25Index.load(str(tmp_path / 'index'))
+    updated = index.update(['B1', 'B2'], [('B2', 'green hat'), ('B4', 'red socks')])
+    rebuilt = BM25Index.build(
+        [documents[0], documents[3], ('B2', 'green hat'), ('B4', 'red socks')], stem=False
+    )
+    assert updated.terms == rebuilt.terms
+    assert list(updated.docids) == list(rebuilt.docids)
+    for name in ['ptr', 'doc_ids', 'weights', 'tfs']:
+        assert (getattr(updated, name) == getattr(rebuilt, name)).all()
+    assert updated.meta == rebuilt.meta
+
+    # saving over the loaded index leaves it usable
+    updated.save(str(tmp_path / 'index'))
+    assert BM25Index.load(str(tmp_path / 'index')).search('red', k=2) == rebuilt.search('red', k=2)
@@ -0,0 +1,93 @@
+from web_agent_site.engine.engine import (
+    SearchResults,
+    get_product_per_page,
+    get_search_results,
+    get_top_n_product_from_keywords,
+    prefetch_searches,
+)
+from web_agent_site.engine.search_cache import *
+
+def test_search_cache():
+    now = [0.]
+    cache = SearchCache(max_size=2, ttl=10, clock=lambda: now[0])
+    assert cache.get('red shoes') is None
+    cache.put(['Red', 'shoes'], ['B1', 'B2'])
+    assert cache.get('red  shoes ') == ('B1', 'B2')
+
+    cache.put('blue shoes', ['B3'])
+    cache.get('red shoes')
+    cache.put('green shoes', ['B4'])
+    # least recently used entry is evicted
+    assert cache.get('blue shoes') is None
+    assert cache.get('red shoes') == ('B1', 'B2')
+
+    now[0] = 11.
+    assert cache.get('red shoes') is None
+    assert cache.stats() == {
+        'size': 1,
+        'hits': 3,
+        'misses': 3,
+        'hit_rate': .5,
+        'evictions': 1,
+        'expirations': 1,
+    }
+
+class Hit:
+    def __init__(self, docid):
+        self.docid = docid
+
+class CountingSearchEngine:
+    def __init__(self, asins):
+        self.asins = asins
+        self.num_searches = 0
+
+    def search(self, query, k=10):
+        self.num_searches += 1
+        return [Hit(asin) for asin in self.asins[:k]]
+
+    def search_many(self, queries, k=10):
+        return [self.search(query, k=k) for query in queries]
+
+def test_get_top_n_product_from_keywords_cached():
+    products = [{'asin': f'B{i}'} for i in range(3)]
+    product_item_dict = {p['asin']: p for p in products}
+    search_engine = CountingSearchEngine(['B2', 'B9', 'B0'])
+    cache = SearchCache()
+    for _ in range(3):
+        top_n_products = get_top_n_product_from_keywords(
+            ['red', 'shoes'], search_engine, products, product_item_dict,
+            search_cache=cache,
+        )
+        assert top_n_products == [products[2], products[0]]
+    assert search_engine.num_searches == 1
+
+    # random results are never cached
+    get_top_n_product_from_keywords(
+        ['<r>'], search_engine, products * 20, product_item_dict, search_cache=cache,
+    )
+    assert len(cache) == 1
+
+def test_prefetch_searches():
+    search_engine = CountingSearchEngine(['B2', 'B9', 'B0'])
+    cache = SearchCache()
+    keywords_list = [['red', 'shoes'], ['<r>'], ['Red', 'shoes'], ['hat']]
+    assert prefetch_searches(keywords_list, search_engine, cache) == 2
+    assert search_engine.num_searches == 2
+    assert cache.get(['red', 'shoes']) == ('B2', 'B9', 'B0')
+    assert 'hat' in cache and 'green' not in cache
+    # cached queries are not searched again
+    assert prefetch_searches(keywords_list, search_engine, cache) == 0
+    assert search_engine.num_searches == 2
+
+def test_get_search_results_resolves_pages():
+    products = [{'asin': f'B{i}', 'category': 'beauty'} for i in range(10)]
+    resolved = []
+    def resolve(i):
+        resolved.append(i)
+        return products[i]
+    all_products = SearchResults(range(len(products)), resolve)
+    results = get_search_results(['<c>', 'beauty'], None, all_products, {})
+    assert len(results) == 10
+    resolved.clear()
+    assert get_product_per_page(results, 2) == products[4:8]
+    assert resolved == [4, 5, 6, 7]
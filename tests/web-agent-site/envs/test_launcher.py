@@ -0,0 +1,53 @@
+import random
+import pytest
+from web_agent_site.engine import registry
+from web_agent_site.engine.registry import clear_registry, get_shared_goal_set
+from web_agent_site.envs import web_agent_text_env
+from web_agent_site.envs.launcher import *
+
+class GoalEnv:
+    """Stands in for `WebAgentTextEnv`, drawing goals like its server"""
+    def __init__(self, file_path, num_products=None, human_goals=True, filter_goals=None,
+                 limit_goals=-1, lazy_products=True, shared_data=True):
+        self.goals = get_shared_goal_set(
+            file_path, num_products, human_goals, filter_goals, limit_goals, lazy_products
+        )
+
+    def reset(self, session=None, instruction_text=None):
+        return random.choice(self.goals)
+
+def test_workers_draw_different_goals(monkeypatch):
+    def get_goal_set(*args, **kwargs):
+        # building a goal set reseeds random
+        random.seed(233)
+        return [f'goal {i}' for i in range(1000)]
+    monkeypatch.setattr(registry, 'load_products', lambda **kwargs: ([], {}, {}, {}))
+    monkeypatch.setattr(registry, 'get_goal_set', get_goal_set)
+    monkeypatch.setattr(web_agent_text_env, 'WebAgentTextEnv', GoalEnv)
+    clear_registry()
+    try:
+        with EnvLauncher(file_path='items.json', num_products=10, human_goals=True) as launcher:
+            envs = launcher.spawn(4, seed=0)
+            goals = [[env.reset() for _ in range(5)] for env in envs]
+            assert len({tuple(g) for g in goals}) == len(envs)
+    finally:
+        clear_registry()
+
+def test_refuses_to_fork_jvm_search_engine(monkeypatch):
+    monkeypatch.setattr(registry, 'load_products', lambda **kwargs: ([], {}, {}, {}))
+    monkeypatch.setattr(registry, 'get_goal_set', lambda *args, **kwargs: ['goal'])
+    monkeypatch.setattr(registry, 'init_search_engine', lambda num_products, backend: object())
+    clear_registry()
+    try:
+        with pytest.raises(ValueError):
+            EnvLauncher(file_path='items.json', preload_search_engine=True)
+
+        launcher = EnvLauncher(file_path='items.json', search_backend='native', preload_search_engine=True)
+        launcher.close()
+        registry.get_search_engine(None, 'lucene')
+        with pytest.raises(RuntimeError):
+            EnvLauncher(file_path='items.json')
+        with pytest.raises(RuntimeError):
+            launcher.spawn(1)
+    finally:
+        clear_registry()
@@ -1,3 +1,4 @@
+import json
 import logging
 import pytest
 import random
@@ -46,3 +47,27 @@ def test_generate_mturk_code():
         output = generate_mturk_code(session_id)
         assert type(expected) is str
         assert output == expected
+
+def test_iter_json_array(tmp_path):
+    items = [
+        {'asin': 'B000000001', 'name': 'a, b ] c', 'pricing': '$1.00'},
+        {'asin': 'B000000002', 'options': {'color': [{'value': 'red'}]}},
+        12345,
+        [],
+    ]
+    path = tmp_path / 'items.json'
+    for indent in [None, 2]:
+        path.write_text(json.dumps(items, indent=indent))
+        for chunk_size in [1, 5, 1 << 20]:
+            assert list(iter_json_array(path, chunk_size=chunk_size)) == items
+
+    # Only parse as many items as are consumed
+    path.write_text('[{"asin": "B000000001"}, {"asin": ')
+    products = iter_json_array(path, chunk_size=4)
+    assert next(products) == {'asin': 'B000000001'}
+    with pytest.raises(ValueError):
+        next(products)
+
+    path.write_text('{"asin": "B000000001"}')
+    with pytest.raises(ValueError):
+        list(iter_json_array(path))
@@ -1,11 +1,12 @@
 from bs4 import BeautifulSoup
-from bs4.element import Comment
 from enum import Enum
 import re, time
 from urllib.parse import urlencode
 
 import json, requests, torch
 
+from web_agent_site.engine.html_backend import parse_page
+
 class Page(Enum):
     DESC = "description"
     FEATURES = "features"
@@ -391,36 +392,28 @@ def parse_item_page_amz(asin, verbose=True):
 
 # Get text observation from html
 # TODO[john-b-yang]: Similar to web_agent_site/envs/...text_env.py func def, merge?
-def convert_html_to_text(html, simple=False, clicked_options=None, visited_asins=None):
-    def tag_visible(element):
-        ignore = {'style', 'script', 'head', 'title', 'meta', '[document]'}
-        return (
-            element.parent.name not in ignore and not isinstance(element, Comment)
-        )
-    html_obj = BeautifulSoup(html, 'html.parser')
-    texts = html_obj.findAll(text=True)
-    visible_texts = filter(tag_visible, texts)
+def convert_html_to_text(html, simple=False, clicked_options=None, visited_asins=None, html_backend='bs4'):
+    nodes = [node for node in parse_page(html, html_backend).text_nodes if node.text != '\n']
     if simple:
-        return ' [SEP] '.join(t.strip() for t in visible_texts if t != '\n')
+        return ' [SEP] '.join(t.strip() for t, _ in nodes)
     else:
         observation = ''
-        for t in visible_texts:
-            if t == '\n': continue
-            if t.parent.name == 'button':  # button
+        for t, kind in nodes:
+            if kind == 'button':  # button
                 processed_t = f'[button] {t} [button]'
-            elif t.parent.name == 'label':  # options
+            elif kind == 'label':  # options
                 if f'{t}' in clicked_options:
                     processed_t = f'  [clicked button] {t} [clicked button]'
                     observation = f'You have clicked {t}.\n' + observation
                 else:
                     processed_t = f'  [button] {t} [button]'
-            elif t.parent.get('class') == ["product-link"]: # asins
+            elif kind == 'product-link': # asins
                 if f'{t}' in visited_asins:
                     processed_t = f'\n[clicked button] {t} [clicked button]'
                 else:
                     processed_t = f'\n[button] {t} [button]'
             else: # regular, unclickable text
-                processed_t =  str(t)
+                processed_t = t
             observation += processed_t + '\n'
         return observation
 
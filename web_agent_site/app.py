@@ -11,16 +11,20 @@ from flask import (
 
 from rich import print
 
+from web_agent_site.engine.catalog import ProductIndex
 from web_agent_site.engine.engine import (
     load_products,
     init_search_engine,
     convert_web_app_string_to_var,
-    get_top_n_product_from_keywords,
+    get_search_results,
     get_product_per_page,
     map_action_to_html,
+    reload_templates,
     END_BUTTON
 )
 from web_agent_site.engine.goal import get_reward, get_goals
+from web_agent_site.engine.sampler import WeightedSampler
+from web_agent_site.engine.search_cache import SearchCache
 from web_agent_site.utils import (
     generate_mturk_code,
     setup_logger,
@@ -31,16 +35,26 @@ from web_agent_site.utils import (
 app = Flask(__name__)
 
 search_engine = None
+search_cache = SearchCache()
 all_products = None
 product_item_dict = None
 product_prices = None
 attribute_to_asins = None
+product_index = None
 goals = None
-weights = None
+goal_sampler = None
 
 user_sessions = dict()
 user_log_dir = None
 SHOW_ATTRS_TAB = False
+LAZY_PRODUCTS = False
+SEARCH_BACKEND = 'lucene'
+
+@app.before_request
+def reload_templates_in_debug():
+    # pick up edited templates while developing
+    if app.debug:
+        reload_templates()
 
 @app.route('/')
 def home():
@@ -50,21 +64,23 @@ def home():
 def index(session_id):
     global user_log_dir
     global all_products, product_item_dict, \
-           product_prices, attribute_to_asins, \
+           product_prices, attribute_to_asins, product_index, \
            search_engine, \
-           goals, weights, user_sessions
+           goals, goal_sampler, user_sessions
 
     if search_engine is None:
         all_products, product_item_dict, product_prices, attribute_to_asins = \
             load_products(
                 filepath=DEFAULT_FILE_PATH,
-                num_products=DEBUG_PROD_SIZE
+                num_products=DEBUG_PROD_SIZE,
+                lazy=LAZY_PRODUCTS,
             )
-        search_engine = init_search_engine(num_products=DEBUG_PROD_SIZE)
+        product_index = ProductIndex.build(all_products)
+        search_engine = init_search_engine(num_products=DEBUG_PROD_SIZE, backend=SEARCH_BACKEND)
         goals = get_goals(all_products, product_prices)
         random.seed(233)
         random.shuffle(goals)
-        weights = [goal['weight'] for goal in goals]
+        goal_sampler = WeightedSampler([goal['weight'] for goal in goals])
 
     if session_id not in user_sessions and 'fixed' in session_id:
         goal_dix = int(session_id.split('_')[-1])
@@ -74,7 +90,7 @@ def index(session_id):
         if user_log_dir is not None:
             setup_logger(session_id, user_log_dir)
     elif session_id not in user_sessions:
-        goal = random.choices(goals, weights)[0]
+        goal = goals[goal_sampler.sample()]
         instruction_text = goal['instruction_text']
         user_sessions[session_id] = {'goal': goal, 'done': False}
         if user_log_dir is not None:
@@ -109,16 +125,26 @@ def index(session_id):
     methods=['GET', 'POST']
 )
 def search_results(session_id, keywords, page):
-    instruction_text = user_sessions[session_id]['goal']['instruction_text']
+    session = user_sessions[session_id]
+    instruction_text = session['goal']['instruction_text']
     page = convert_web_app_string_to_var('page', page)
     keywords = convert_web_app_string_to_var('keywords', keywords)
-    top_n_products = get_top_n_product_from_keywords(
-        keywords,
-        search_engine,
-        all_products,
-        product_item_dict,
-        attribute_to_asins,
-    )
+    if session.get('results_key') == tuple(keywords):
+        # same search as the last one of this session, on another page
+        top_n_products = session['results']
+    else:
+        top_n_products = get_search_results(
+            keywords,
+            search_engine,
+            all_products,
+            product_item_dict,
+            attribute_to_asins,
+            search_cache=search_cache,
+            product_index=product_index,
+        )
+        if keywords[0] != '<r>':
+            session['results_key'] = tuple(keywords)
+            session['results'] = top_n_products
     products = get_product_per_page(top_n_products, page)
     html = map_action_to_html(
         'search',
@@ -270,11 +296,15 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="WebShop flask app backend configuration")
     parser.add_argument("--log", action='store_true', help="Log actions on WebShop in trajectory file")
     parser.add_argument("--attrs", action='store_true', help="Show attributes tab in item page")
+    parser.add_argument("--lazy_products", action='store_true', help="Decode products from shared compiled catalog on access")
+    parser.add_argument("--search_backend", default='lucene', choices=['lucene', 'native', 'dense', 'hybrid'], help="Search engine implementation")
 
     args = parser.parse_args()
     if args.log:
         user_log_dir = Path('user_session_logs/mturk')
         user_log_dir.mkdir(parents=True, exist_ok=True)
     SHOW_ATTRS_TAB = args.attrs
+    LAZY_PRODUCTS = args.lazy_products
+    SEARCH_BACKEND = args.search_backend
 
     app.run(host='0.0.0.0', port=3000)
@@ -0,0 +1,578 @@
+"""
+Compiled product catalog.
+
+Parsing `items_shuffle.json` and cleaning every product in `load_products`
+takes minutes for the full catalog. `compile_catalog` runs that work once
+and writes the cleaned records to a binary artifact next to the products
+file, which `load_products` memory-maps on start when it is up to date.
+
+Artifact layout (native byte order):
+    header   -- magic, version, number of records, offset + length of toc
+    records  -- one pickled product per record, back to back
+    sections -- named arrays and pickled objects (record offsets, keys,
+                sorted key index, prices, product index, ...)
+    toc      -- pickled dict of section name -> (offset, length, typecode)
+
+Since the file is mapped read-only, all processes opening the same catalog
+share one copy of it in the page cache. `ProductStore` decodes a record
+only when it is accessed, so workers don't hold their own copy of every
+product.
+"""
+import bisect
+import json
+import mmap
+import os
+import pickle
+import random
+import struct
+from array import array
+from collections import OrderedDict, defaultdict
+from collections.abc import Mapping, Sequence
+
+MAGIC = b'WSCATLG\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sIQQQ')
+CATALOG_SUFFIX = '.catalog'
+INDEX_SUFFIX = '.index'
+PICKLE = 'pickle'
+PRODUCT_INDEX_FIELDS = ('category', 'query', 'attribute')
+
+
+class RecordWriter:
+    """Writes pickled records keyed by string to a record file"""
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = f'{path}.tmp'
+        self.keys = []
+        self.offsets = array('Q', [0])
+        self.sections = dict()
+        self.f = open(self.tmp_path, 'wb')
+        self.f.write(b'\x00' * HEADER.size)
+
+    def add(self, key, value):
+        self.add_raw(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def add_raw(self, key, blob):
+        """Add an already pickled record (i.e. copied from another record file)"""
+        self.f.write(blob)
+        self.keys.append(key)
+        self.offsets.append(self.offsets[-1] + len(blob))
+
+    def add_section(self, name, value, typecode=PICKLE):
+        """Add a named section, either an `array` or any picklable object"""
+        if typecode == PICKLE:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        else:
+            blob = array(typecode, value).tobytes()
+        # keep arrays aligned so they can be cast without copying
+        self.f.write(b'\x00' * (-self.f.tell() % 8))
+        self.sections[name] = (self.f.tell(), len(blob), typecode)
+        self.f.write(blob)
+
+    def close(self, meta=None):
+        encoded_keys = [k.encode() for k in self.keys]
+        width = max((len(k) for k in encoded_keys), default=1)
+        order = sorted(range(len(encoded_keys)), key=encoded_keys.__getitem__)
+        self.add_section('offsets', self.offsets, 'Q')
+        self.add_section('keys', b''.join(k.ljust(width, b'\x00') for k in encoded_keys), 'B')
+        self.add_section('sorted_keys', b''.join(encoded_keys[i].ljust(width, b'\x00') for i in order), 'B')
+        self.add_section('sorted_positions', order, 'Q')
+        self.add_section('meta', dict(meta or {}, key_width=width))
+
+        toc_offset = self.f.tell()
+        toc = pickle.dumps(self.sections, protocol=pickle.HIGHEST_PROTOCOL)
+        self.f.write(toc)
+        self.f.seek(0)
+        self.f.write(HEADER.pack(MAGIC, VERSION, len(self.keys), toc_offset, len(toc)))
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
+
+
+class _KeyTable(Sequence):
+    """Fixed-width keys stored in a record file, indexable without decoding all of them"""
+    def __init__(self, buf, width):
+        self.buf = buf
+        self.width = width
+
+    def __len__(self):
+        return len(self.buf) // self.width
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return bytes(self.buf[i * self.width:(i + 1) * self.width])
+
+
+class RecordFile:
+    """
+    Read-only, memory-mapped view of a record file. Records are only
+    unpickled when they are accessed, by position or by key.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, toc_offset, toc_len = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a compatible record file.')
+        self.count = count
+        self.buf = memoryview(self.mm)
+        self.sections = pickle.loads(self.buf[toc_offset:toc_offset + toc_len])
+        self._loaded_sections = dict()
+        self.meta = self.section('meta')
+        self.offsets = self.section('offsets')
+        width = self.meta['key_width']
+        self.keys = _KeyTable(self.section('keys'), width)
+        self.sorted_keys = _KeyTable(self.section('sorted_keys'), width)
+        self.sorted_positions = self.section('sorted_positions')
+
+    def __len__(self):
+        return self.count
+
+    def section(self, name):
+        """
+        Returns named section, arrays as a zero-copy `memoryview` and
+        pickled sections unpickled (once, on first access)
+        """
+        if name not in self._loaded_sections:
+            offset, length, typecode = self.sections[name]
+            data = self.buf[offset:offset + length]
+            if typecode == PICKLE:
+                data = pickle.loads(data)
+            elif typecode != 'B':
+                data = data.cast(typecode)
+            self._loaded_sections[name] = data
+        return self._loaded_sections[name]
+
+    def has_section(self, name):
+        return name in self.sections
+
+    def key(self, i):
+        return self.keys[i].rstrip(b'\x00').decode()
+
+    def position(self, key):
+        """Returns position of record with given key, or `None` if missing"""
+        encoded = key.encode().ljust(self.sorted_keys.width, b'\x00')
+        if len(encoded) > self.sorted_keys.width:
+            return None
+        i = bisect.bisect_left(self.sorted_keys, encoded)
+        if i < len(self.sorted_keys) and self.sorted_keys[i] == encoded:
+            return self.sorted_positions[i]
+        return None
+
+    def raw(self, i):
+        start = HEADER.size + self.offsets[i]
+        end = HEADER.size + self.offsets[i + 1]
+        return self.buf[start:end]
+
+    def get(self, i):
+        return pickle.loads(self.raw(i))
+
+    def get_by_key(self, key):
+        i = self.position(key)
+        if i is None:
+            raise KeyError(key)
+        return self.get(i)
+
+
+class ProductStore(Mapping):
+    """
+    Dict-like view of compiled catalog products keyed by ASIN. Products
+    are decoded from the memory-mapped catalog when accessed, and the most
+    recently used ones are kept in a bounded cache.
+
+    Arguments:
+    catalog (`RecordFile`) -- compiled catalog
+    num_records (`int`) -- only expose the first `num_records` products
+    cache_size (`int`) -- number of decoded products to keep around
+    """
+    def __init__(self, catalog, num_records=None, cache_size=1024):
+        self.catalog = catalog
+        self.num_records = len(catalog) if num_records is None \
+            else min(num_records, len(catalog))
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.products = ProductList(self)
+
+    def product(self, i):
+        """Decoded product at position `i` of the catalog"""
+        if i in self.cache:
+            self.cache.move_to_end(i)
+            return self.cache[i]
+        product = self.catalog.get(i)
+        self.cache[i] = product
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return product
+
+    def position(self, asin):
+        i = self.catalog.position(asin)
+        if i is None or i >= self.num_records:
+            return None
+        return i
+
+    def __getitem__(self, asin):
+        i = self.position(asin)
+        if i is None:
+            raise KeyError(asin)
+        return self.product(i)
+
+    def __contains__(self, asin):
+        return self.position(asin) is not None
+
+    def __iter__(self):
+        for i in range(self.num_records):
+            yield self.catalog.key(i)
+
+    def __len__(self):
+        return self.num_records
+
+
+class ProductList(Sequence):
+    """List-like view of the products in a `ProductStore`, in catalog order"""
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.store.product(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('product index out of range')
+        return self.store.product(i)
+
+    def iter_pricing(self):
+        """Yields (asin, pricing) of each product without decoding the products"""
+        catalog = self.store.catalog
+        pricing = catalog.section('pricing')
+        for i in range(len(self)):
+            low, high = pricing[2 * i], pricing[2 * i + 1]
+            yield catalog.key(i), [low] if high != high else [low, high]
+
+
+class RecordMapping(Mapping):
+    """Read-only dict view of a record file keyed by record key, decoded on access"""
+    def __init__(self, record_file):
+        self.record_file = record_file
+
+    def __getitem__(self, key):
+        return self.record_file.get_by_key(key)
+
+    def __contains__(self, key):
+        return self.record_file.position(key) is not None
+
+    def __iter__(self):
+        for i in range(len(self.record_file)):
+            yield self.record_file.key(i)
+
+    def __len__(self):
+        return len(self.record_file)
+
+
+class LazyMapping(Mapping):
+    """Mapping that is only built, with `loader`, the first time it is used"""
+    def __init__(self, loader):
+        self.loader = loader
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self.loader()
+        return self._data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+def build_product_index(all_products):
+    """
+    Positions in `all_products` of the products with each category, query
+    and attribute, in increasing order:
+    {'category': {category: positions}, 'query': {...}, 'attribute': {...}}
+    """
+    index = {name: defaultdict(lambda: array('I')) for name in PRODUCT_INDEX_FIELDS}
+    for i, p in enumerate(all_products):
+        for name, values in [
+            ('category', [p.get('category')]),
+            ('query', [p.get('query')]),
+            ('attribute', dict.fromkeys(p.get('Attributes', []))),
+        ]:
+            for value in values:
+                if value is not None:
+                    index[name][value].append(i)
+    return {name: dict(positions) for name, positions in index.items()}
+
+
+class ProductIndex:
+    """
+    Looks up the products of a category, query or attribute, and samples
+    random products, in time proportional to the number of products
+    returned rather than the size of the catalog
+
+    Arguments:
+    all_products (`list`) -- products, or a `ProductList`
+    positions (`dict`) -- as returned by `build_product_index`; may index
+        more products than `all_products`, i.e. a whole compiled catalog
+        of which only the first products are loaded
+    """
+    def __init__(self, all_products, positions):
+        self.all_products = all_products
+        self.positions = positions
+        # positions of all products, to sample random products from
+        self.pool = range(len(all_products))
+
+    @classmethod
+    def build(cls, all_products):
+        """
+        Index `all_products`, reading the index of their compiled catalog
+        if they are a `ProductList`, or else scanning the products (on
+        first use for a `ProductList`, which would decode every product)
+        """
+        if isinstance(all_products, ProductList):
+            catalog = all_products.store.catalog
+            if catalog.has_section('product_index'):
+                return cls(all_products, catalog.section('product_index'))
+            return cls(all_products, LazyMapping(lambda: build_product_index(all_products)))
+        return cls(all_products, build_product_index(all_products))
+
+    def find(self, name, value):
+        """Positions of the products whose `name` ('category', 'query' or 'attribute') is `value`"""
+        positions = self.positions[name].get(value, ())
+        return positions[:bisect.bisect_left(positions, len(self.all_products))]
+
+    def products(self, name, value):
+        return [self.all_products[i] for i in self.find(name, value)]
+
+    def sample_positions(self, k):
+        """
+        Positions of `k` random products; draws the same products as
+        `random.sample(all_products, k)`
+        """
+        return random.sample(self.pool, k)
+
+    def sample(self, k):
+        return [self.all_products[i] for i in self.sample_positions(k)]
+
+
+def get_catalog_path(filepath, human_goals=True):
+    """Location of the compiled catalog for a products file and goal type"""
+    goal_type = 'human' if human_goals else 'synthetic'
+    return f'{os.path.splitext(filepath)[0]}.{goal_type}{CATALOG_SUFFIX}'
+
+
+def get_source_signature(paths):
+    """Size and mtime of the files a compiled artifact was built from"""
+    signature = []
+    for path in paths:
+        stat = os.stat(path)
+        signature.append((os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+    return signature
+
+
+def write_catalog(path, all_products, attribute_to_asins, sources):
+    """
+    Write cleaned products to a compiled catalog
+
+    Arguments:
+    all_products (`list`) -- cleaned products, as returned by `load_products`
+    attribute_to_asins (`dict`) -- attribute -> set of ASINs
+    sources (`list`) -- paths of files the products were built from
+    """
+    writer = RecordWriter(path)
+    pricing = array('d')
+    for p in all_products:
+        writer.add(p['asin'], p)
+        # at most two prices per product, missing second price stored as NaN
+        pricing.extend((p['pricing'] + [float('nan')])[:2])
+    writer.add_section('pricing', pricing, 'd')
+    writer.add_section(
+        'attribute_to_asins',
+        {a: sorted(s) for a, s in attribute_to_asins.items()},
+    )
+    writer.add_section('product_index', build_product_index(all_products))
+    writer.close(meta=dict(sources=get_source_signature(sources)))
+
+
+def update_catalog(catalog, products, remove=(), output_path=None):
+    """
+    Write `catalog` with the products of ASINs in `remove` removed and the
+    cleaned `products` added to `output_path` (default: replace `catalog`).
+    A product with the ASIN of a catalog product replaces it in place,
+    others are appended. Unchanged products are copied without decoding
+    them, and the catalog stays valid for the files it was compiled from.
+
+    Returns the positions in the new catalog of the products of `catalog`,
+    -1 for removed products.
+    """
+    if output_path is None:
+        output_path = catalog.path
+    products = {p['asin']: p for p in products}
+    remove = set(remove) - set(products)
+    # old versions of the replaced and removed products, whose attributes
+    # and index entries are dropped
+    old_products = [
+        (i, catalog.get(i)) for i in map(catalog.position, remove | set(products))
+        if i is not None
+    ]
+
+    writer = RecordWriter(output_path)
+    positions = array('q')
+    new_products = []
+    old_pricing = catalog.section('pricing')
+    pricing = array('d')
+    for i in range(len(catalog)):
+        asin = catalog.key(i)
+        if asin in remove:
+            positions.append(-1)
+            continue
+        positions.append(len(writer.keys))
+        p = products.pop(asin, None)
+        if p is None:
+            writer.add_raw(asin, catalog.raw(i))
+            pricing.extend(old_pricing[2 * i:2 * i + 2])
+        else:
+            new_products.append((len(writer.keys), p))
+            writer.add(asin, p)
+            pricing.extend((p['pricing'] + [float('nan')])[:2])
+    for asin, p in products.items():
+        new_products.append((len(writer.keys), p))
+        writer.add(asin, p)
+        pricing.extend((p['pricing'] + [float('nan')])[:2])
+    writer.add_section('pricing', pricing, 'd')
+
+    attribute_to_asins = defaultdict(set, {
+        a: set(asins) for a, asins in catalog.section('attribute_to_asins').items()
+    })
+    for _, p in old_products:
+        for a in p.get('Attributes', []):
+            attribute_to_asins[a].discard(p['asin'])
+    for _, p in new_products:
+        for a in p.get('Attributes', []):
+            attribute_to_asins[a].add(p['asin'])
+    writer.add_section(
+        'attribute_to_asins',
+        {a: sorted(s) for a, s in attribute_to_asins.items() if s},
+    )
+
+    if catalog.has_section('product_index'):
+        old_positions = {positions[i] for i, _ in old_products}
+        product_index = {
+            name: {
+                value: array('I', (
+                    positions[i] for i in ps
+                    if positions[i] >= 0 and positions[i] not in old_positions
+                ))
+                for value, ps in values.items()
+            }
+            for name, values in catalog.section('product_index').items()
+        }
+        new_index = build_product_index([p for _, p in new_products])
+        for name, values in new_index.items():
+            for value, ps in values.items():
+                merged = product_index[name].setdefault(value, array('I'))
+                for j in ps:
+                    bisect.insort(merged, new_products[j][0])
+        writer.add_section('product_index', {
+            name: {value: ps for value, ps in values.items() if ps}
+            for name, values in product_index.items()
+        })
+
+    meta = {k: v for k, v in catalog.meta.items() if k != 'key_width'}
+    writer.close(meta=meta)
+    return positions
+
+
+def load_catalog(path, sources):
+    """
+    Open compiled catalog at `path`. Returns `None` if there is no artifact,
+    or it was compiled from different versions of the `sources` files.
+    """
+    return open_record_file(path, sources)
+
+
+def get_attribute_index_path(path):
+    """Location of the pre-indexed version of an attribute/instruction file"""
+    return f'{os.path.splitext(path)[0]}{INDEX_SUFFIX}'
+
+
+def write_attribute_index(path, output_path=None):
+    """
+    Pre-index a JSON file mapping ASIN -> attributes/instructions, so that
+    single entries can be read without parsing the whole file
+    """
+    if output_path is None:
+        output_path = get_attribute_index_path(path)
+    with open(path) as f:
+        entries = json.load(f)
+    writer = RecordWriter(output_path)
+    for asin, entry in entries.items():
+        writer.add(asin, entry)
+    writer.close(meta=dict(sources=get_source_signature([path])))
+    return output_path
+
+
+def load_attribute_index(path):
+    """
+    Returns a dict view of the pre-indexed version of attribute file
+    `path`, or `None` if there is no up to date index
+    """
+    record_file = open_record_file(get_attribute_index_path(path), [path])
+    return RecordMapping(record_file) if record_file is not None else None
+
+
+def open_record_file(path, sources):
+    """
+    Open record file at `path`. Returns `None` if it does not exist, or it
+    was built from different versions of the `sources` files.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        record_file = RecordFile(path)
+    except ValueError as e:
+        print(f'Ignoring {path}: {e}')
+        return None
+    if record_file.meta.get('sources') != get_source_signature(sources):
+        print(f'Ignoring stale {path}, recompile it to speed up loading.')
+        return None
+    return record_file
+
+
+if __name__ == '__main__':
+    import argparse
+    from web_agent_site.engine.engine import compile_catalog
+    from web_agent_site.utils import (
+        DEFAULT_ATTR_PATH,
+        DEFAULT_FILE_PATH,
+        HUMAN_ATTR_PATH,
+    )
+
+    parser = argparse.ArgumentParser(description='Compile products file into a binary catalog')
+    parser.add_argument('--file_path', default=DEFAULT_FILE_PATH, help='Raw products JSON file')
+    parser.add_argument('--goals', default='all', choices=['human', 'synthetic', 'all'],
+                        help='Goal type(s) to compile catalog for')
+    parser.add_argument('--num_workers', default=None, type=int,
+                        help='Number of processes used to clean products')
+    args = parser.parse_args()
+
+    for attr_path in [DEFAULT_ATTR_PATH, HUMAN_ATTR_PATH]:
+        output_path = write_attribute_index(attr_path)
+        print(f'Attribute index written to {output_path}')
+
+    goal_types = [True, False] if args.goals == 'all' else [args.goals == 'human']
+    for human_goals in goal_types:
+        output_path = compile_catalog(
+            args.file_path, human_goals=human_goals, num_workers=args.num_workers
+        )
+        print(f'Compiled catalog written to {output_path}')
@@ -0,0 +1,209 @@
+"""
+Incremental catalog updates.
+
+Adding, removing or changing a few products used to mean recompiling the
+catalogs and rebuilding every search index from scratch. `apply_delta`
+applies a delta instead:
+
+    catalogs      -- rewritten with `catalog.update_catalog`, which copies
+                     unchanged products without decoding them
+    search index  -- for each index size, the documents that left or
+                     entered the first `num_products` products, or changed,
+                     are deleted from and added to the existing Lucene
+                     and/or native index
+    goal sets     -- compiled goal sets of the catalogs are deleted, to be
+                     recompiled on next use
+
+A delta is a JSON file with raw products, in the format of the products
+file, to add or replace, and ASINs to remove:
+
+    {"products": [{"asin": ..., "name": ..., ...}], "remove": ["B0...", ...]}
+
+Products are cleaned with their entries in the attribute files, which can
+be given for new products with optional `attributes` and `human_attributes`
+keys in the format of those files.
+
+The products file itself is not modified, so the updated catalogs stay
+valid for it; recompiling the catalogs from it drops the delta.
+"""
+import copy
+import glob
+import json
+import os
+import time
+from collections import ChainMap
+
+from web_agent_site.engine.catalog import (
+    get_catalog_path,
+    load_catalog,
+    open_record_file,
+    update_catalog,
+)
+from web_agent_site.engine.dense_backend import get_dense_index_path
+from web_agent_site.engine.engine import (
+    UNUSED_PRODUCT_KEYS,
+    clean_product,
+    get_catalog_sources,
+    load_attributes,
+    load_reviews,
+)
+from web_agent_site.engine.goal_cache import get_goal_set_path
+from web_agent_site.engine.search_backend import (
+    INDEX_SIZES,
+    SEARCH_ENGINE_DIR,
+    BM25Index,
+    get_index_name,
+    get_native_index_path,
+    get_product_contents,
+    update_lucene_index,
+)
+from web_agent_site.utils import DEFAULT_ATTR_PATH, HUMAN_ATTR_PATH
+
+# backends with indexes updated in place; dense indexes are rebuilt from native ones
+INDEX_BACKENDS = ('lucene', 'native')
+
+
+def load_delta(path):
+    """Returns the keyword arguments of `apply_delta` for a delta file"""
+    with open(path) as f:
+        delta = json.load(f)
+    return dict(
+        raw_products=delta.get('products', []),
+        remove=delta.get('remove', []),
+        attributes=delta.get('attributes'),
+        human_attributes=delta.get('human_attributes'),
+    )
+
+
+def clean_products(raw_products, human_goals=True, attributes=None, human_attributes=None):
+    """
+    Clean raw products like `build_products`, skipping invalid ASINs, with
+    `attributes` and `human_attributes` entries taking precedence over the
+    attribute files
+    """
+    attributes = ChainMap(attributes or {}, load_attributes(DEFAULT_ATTR_PATH))
+    human_attributes = ChainMap(human_attributes or {}, load_attributes(HUMAN_ATTR_PATH)) \
+        if human_goals else None
+    all_reviews, all_ratings = load_reviews()
+    products = []
+    for p in raw_products:
+        if p['asin'] == 'nan' or len(p['asin']) > 10:
+            continue
+        # cleaning modifies the product, which is cleaned once per goal type
+        p = copy.deepcopy(p)
+        for key in UNUSED_PRODUCT_KEYS:
+            p.pop(key, None)
+        products.append(clean_product(
+            p, attributes, human_attributes, human_goals, all_reviews, all_ratings,
+        ))
+    return products
+
+
+def get_index_changes(old_asins, new_asins, changed, num_products=None):
+    """
+    ASINs to delete from, and to add to, an index of the first
+    `num_products` products, for a catalog going from `old_asins` to
+    `new_asins` with the products of `changed` ASINs replaced
+    """
+    old_asins = old_asins if num_products is None else old_asins[:num_products]
+    new_asins = new_asins if num_products is None else new_asins[:num_products]
+    old_set, new_set = set(old_asins), set(new_asins)
+    remove = (old_set - new_set) | (old_set & changed)
+    add = [asin for asin in new_asins if asin not in old_set or asin in changed]
+    return remove, add
+
+
+def update_search_indexes(catalog, old_asins, changed, sizes=INDEX_SIZES, backends=INDEX_BACKENDS):
+    """Apply the changes from `old_asins` to updated `catalog` to the existing search indexes"""
+    new_asins = [catalog.key(i) for i in range(len(catalog))]
+    for num_products in sizes:
+        remove, add = get_index_changes(old_asins, new_asins, changed, num_products)
+        if not remove and not add:
+            continue
+        documents = [(asin, get_product_contents(catalog.get_by_key(asin))) for asin in add]
+        if 'lucene' in backends:
+            index_dir = os.path.join(SEARCH_ENGINE_DIR, get_index_name(num_products))
+            if os.path.isdir(index_dir):
+                update_lucene_index(index_dir, remove, documents)
+                print(f'Updated {index_dir}: -{len(remove)} +{len(add)} documents')
+        if 'native' in backends:
+            path = get_native_index_path(num_products)
+            if os.path.exists(os.path.join(path, 'meta.json')):
+                BM25Index.load(path).update(remove, documents).save(path)
+                print(f'Updated {path}: -{len(remove)} +{len(add)} documents')
+                dense_path = get_dense_index_path(num_products)
+                if os.path.exists(os.path.join(dense_path, 'meta.json')):
+                    print(f'{dense_path} is now stale, rebuild it with '
+                          f'`python -m web_agent_site.engine.dense_backend`')
+
+
+def remove_goal_sets(file_path, human_goals=True, sizes=INDEX_SIZES):
+    """Delete compiled goal sets of a catalog, for any seed"""
+    sources = get_catalog_sources(file_path, human_goals)
+    for num_products in sizes:
+        path = get_goal_set_path(file_path, num_products, human_goals, 0, sources)
+        for goal_set_path in glob.glob(path.replace('.seed0.', '.seed*.')):
+            os.remove(goal_set_path)
+            print(f'Removed stale goal set {goal_set_path}')
+
+
+def apply_delta(file_path, raw_products, remove=(), attributes=None, human_attributes=None,
+                goal_types=(True, False), sizes=INDEX_SIZES, backends=INDEX_BACKENDS):
+    """
+    Apply a delta to the compiled catalogs of `file_path` for `goal_types`
+    (`True` for human goals), to its search indexes of `sizes` products
+    with `backends`, and drop its compiled goal sets
+
+    Returns `False` if there is no up to date catalog to update.
+    """
+    updated = None
+    for human_goals in goal_types:
+        start = time.time()
+        sources = get_catalog_sources(file_path, human_goals)
+        path = get_catalog_path(file_path, human_goals)
+        catalog = load_catalog(path, sources)
+        if catalog is None:
+            print(f'No up to date catalog {path}, compile it first.')
+            continue
+        products = clean_products(raw_products, human_goals, attributes, human_attributes)
+        old_asins = [catalog.key(i) for i in range(len(catalog))]
+        changed = {p['asin'] for p in products if catalog.position(p['asin']) is not None}
+        update_catalog(catalog, products, remove)
+        remove_goal_sets(file_path, human_goals)
+        print(f'Updated {path} in {time.time() - start:.1f}s')
+        if updated is None:
+            updated = (open_record_file(path, sources), old_asins, changed)
+    if updated is None:
+        return False
+
+    # the index text of a product is the same for either goal type
+    start = time.time()
+    update_search_indexes(*updated, sizes=sizes, backends=backends)
+    print(f'Updated search indexes in {time.time() - start:.1f}s')
+    return True
+
+
+if __name__ == '__main__':
+    import argparse
+    from web_agent_site.utils import DEFAULT_FILE_PATH
+
+    parser = argparse.ArgumentParser(description='Apply a delta of products to catalogs and search indexes')
+    parser.add_argument('delta', help='JSON file with `products` to add or replace and ASINs to `remove`')
+    parser.add_argument('--file_path', default=DEFAULT_FILE_PATH, help='Raw products JSON file')
+    parser.add_argument('--goals', default='all', choices=['human', 'synthetic', 'all'],
+                        help='Goal type(s) of the catalogs to update')
+    parser.add_argument('--num_products', default=INDEX_SIZES, nargs='+',
+                        type=lambda n: None if n == 'all' else int(n),
+                        help='Index sizes to update, `all` for all products')
+    parser.add_argument('--backends', default=list(INDEX_BACKENDS), nargs='+',
+                        choices=INDEX_BACKENDS, help='Search indexes to update')
+    args = parser.parse_args()
+
+    goal_types = [True, False] if args.goals == 'all' else [args.goals == 'human']
+    apply_delta(
+        args.file_path,
+        goal_types=goal_types,
+        sizes=args.num_products,
+        backends=args.backends,
+        **load_delta(args.delta),
+    )
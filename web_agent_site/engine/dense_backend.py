@@ -0,0 +1,387 @@
+"""
+Dense and hybrid search backends.
+
+    dense  -- `DenseIndex`, nearest neighbours of the query among product
+              embeddings
+    hybrid -- `HybridBackend`, the native BM25 and dense rankings fused by
+              reciprocal rank
+
+Embeddings are computed offline on CPU from the native BM25 index (build it
+first), by latent semantic analysis: a truncated SVD of the document-term
+matrix of BM25 weights, computed with randomized SVD on a sample of the
+products. A product's embedding is its BM25 weight vector projected on the
+singular vectors, and a query's the sum of the projections of its terms,
+so encoding a query is a lookup of a few rows and needs no model at query
+time. Terms that co-occur across products get close projections, which
+helps recall for natural language instructions that share few exact
+terms with the products they ask for.
+
+Embeddings are searched with an inverted file index: products are
+clustered with k-means, and a query is only compared with the products of
+the `nprobe` clusters closest to it. Embeddings are stored as 8-bit
+integers, grouped by cluster, and memory-mapped on load. If faiss is
+installed, an equivalent faiss `IVF,SQ8` index is built and used instead.
+
+The dense index covers the products of the native index it was built from;
+rebuild it after updating the native index with `engine.delta`.
+"""
+import json
+import os
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from web_agent_site.engine.search_backend import (
+    INDEX_SIZES,
+    SEARCH_ENGINE_DIR,
+    Analyzer,
+    BM25Index,
+    SearchBackend,
+    SearchHit,
+    _atomic_write,
+    get_index_name,
+    get_native_index_path,
+)
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+DENSE_INDEX_VERSION = 1
+DENSE_INDEX_ARRAYS = ['components', 'centroids', 'list_ptr', 'order', 'codes', 'scale', 'docids']
+CSR_CHUNK_SIZE = 1 << 20
+
+
+def get_dense_index_path(num_products=None):
+    return os.path.join(SEARCH_ENGINE_DIR, f'{get_index_name(num_products)}_dense')
+
+
+def _csr_matmul(ptr, idx, vals, dense):
+    """Product of the CSR matrix (`ptr`, `idx`, `vals`) with a dense matrix, in chunks of rows"""
+    num_rows = len(ptr) - 1
+    out = np.zeros((num_rows, dense.shape[1]), dtype=np.float32)
+    row = 0
+    while row < num_rows:
+        end = int(np.searchsorted(ptr, ptr[row] + CSR_CHUNK_SIZE, side='right')) - 1
+        end = min(max(end, row + 1), num_rows)
+        start_nnz, end_nnz = ptr[row], ptr[end]
+        if end_nnz > start_nnz:
+            products = vals[start_nnz:end_nnz, None] * dense[idx[start_nnz:end_nnz]]
+            nonempty = ptr[row + 1:end + 1] > ptr[row:end]
+            starts = (ptr[row:end] - start_nnz)[nonempty]
+            out[row:end][nonempty] = np.add.reduceat(products, starts, axis=0)
+        row = end
+    return out
+
+
+def _to_csr(rows, cols, vals, num_rows):
+    order = np.argsort(rows, kind='stable')
+    ptr = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_rows), out=ptr[1:])
+    return ptr, cols[order], vals[order]
+
+
+def _normalize(x):
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def _randomized_svd(rows, cols, vals, shape, dim, num_iter, rng):
+    """
+    Top `dim` right singular vectors of a sparse matrix given as
+    coordinates (Halko et al., with power iterations)
+    """
+    num_rows, num_cols = shape
+    by_row = _to_csr(rows, cols, vals, num_rows)
+    by_col = _to_csr(cols, rows, vals, num_cols)
+    q = _csr_matmul(*by_row, rng.standard_normal((num_cols, dim + 10)).astype(np.float32))
+    q = np.linalg.qr(q)[0]
+    for _ in range(num_iter):
+        q = np.linalg.qr(_csr_matmul(*by_col, q))[0]
+        q = np.linalg.qr(_csr_matmul(*by_row, q))[0]
+    # rows of b span the top right singular vectors
+    b = _csr_matmul(*by_col, q).T
+    _, _, vt = np.linalg.svd(b, full_matrices=False)
+    return vt[:dim]
+
+
+def _kmeans(x, num_clusters, num_iter, rng):
+    """Spherical k-means of the unit vectors `x`; returns unit centroids"""
+    centroids = x[rng.choice(len(x), num_clusters, replace=False)]
+    for _ in range(num_iter):
+        assignment = _assign(x, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, x)
+        empty = np.bincount(assignment, minlength=num_clusters) == 0
+        # restart empty clusters from random points
+        sums[empty] = x[rng.choice(len(x), int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+
+def _assign(x, centroids, chunk_size=65536):
+    return np.concatenate([
+        np.argmax(x[start:start + chunk_size] @ centroids.T, axis=1)
+        for start in range(0, len(x), chunk_size)
+    ]) if len(x) else np.zeros(0, dtype=np.int64)
+
+
+def _top_k(scores, k):
+    if len(scores) > k:
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind='stable')]
+
+
+class DenseIndex(SearchBackend):
+    """
+    Product embeddings in an inverted file index:
+
+        terms, components -- embedding of each term
+        centroids         -- unit centroid of each cluster
+        order             -- documents grouped by cluster; cluster `c` holds
+                             `order[list_ptr[c]:list_ptr[c + 1]]`
+        codes, scale      -- embedding of document `order[i]` is about
+                             `codes[i] * scale`
+        docids            -- ASIN of each document
+
+    Arguments:
+    nprobe (`int`) -- number of clusters searched per query
+    """
+    def __init__(self, terms, components, centroids, list_ptr, order, codes, scale, docids,
+                 meta, ann=None, nprobe=32):
+        self.terms = terms
+        self.term_ids = {t: i for i, t in enumerate(terms)}
+        self.components = components
+        self.centroids = centroids
+        self.list_ptr = list_ptr
+        self.order = order
+        self.codes = codes
+        self.scale = scale
+        self.docids = docids
+        self.meta = meta
+        self.analyzer = Analyzer(stem=meta['stemmed'])
+        self.ann = ann
+        self.nprobe = nprobe
+        if ann is not None:
+            ann.nprobe = nprobe
+
+    def __len__(self):
+        return len(self.docids)
+
+    @classmethod
+    def build(cls, bm25, dim=128, min_df=2, fit_docs=200000, num_clusters=None,
+              num_iter=4, seed=0, use_faiss=True):
+        """
+        Arguments:
+        bm25 (`BM25Index`) -- native index of the products to embed
+        dim (`int`) -- embedding size
+        min_df (`int`) -- ignore terms of fewer products
+        fit_docs (`int`) -- number of products sampled to compute the SVD
+        num_clusters (`int`) -- number of clusters (default: 4 * sqrt(number of products))
+        use_faiss (`bool`) -- build a faiss index if faiss is installed
+        """
+        rng = np.random.default_rng(seed)
+        num_docs = len(bm25)
+        df = np.diff(bm25.ptr)
+        kept = np.flatnonzero(df >= min_df)
+        term_ids = np.full(len(df), -1, dtype=np.int64)
+        term_ids[kept] = np.arange(len(kept))
+        posting_terms = term_ids[np.repeat(np.arange(len(df)), df)]
+        keep = posting_terms >= 0
+        posting_terms = posting_terms[keep]
+        posting_docs = np.asarray(bm25.doc_ids)[keep].astype(np.int64)
+        posting_weights = np.asarray(bm25.weights)[keep].astype(np.float32)
+        dim = max(1, min(dim, len(kept), num_docs))
+
+        # singular vectors of a sample of the document-term matrix
+        sample = np.zeros(num_docs, dtype=bool)
+        sample[rng.choice(num_docs, min(fit_docs, num_docs), replace=False)] = True
+        sample_rows = np.cumsum(sample) - 1
+        in_sample = sample[posting_docs]
+        components = _randomized_svd(
+            sample_rows[posting_docs[in_sample]],
+            posting_terms[in_sample],
+            posting_weights[in_sample],
+            (int(sample.sum()), len(kept)),
+            dim,
+            num_iter,
+            rng,
+        ).T.astype(np.float32)
+
+        embeddings = _normalize(_csr_matmul(
+            *_to_csr(posting_docs, posting_terms, posting_weights, num_docs), components
+        ))
+
+        if num_clusters is None:
+            num_clusters = int(4 * np.sqrt(num_docs))
+        num_clusters = max(1, min(num_clusters, num_docs))
+        train = embeddings[rng.choice(num_docs, min(num_docs, 256 * num_clusters), replace=False)]
+        centroids = _kmeans(train, num_clusters, 10, rng).astype(np.float32)
+        assignment = _assign(embeddings, centroids)
+        order = np.argsort(assignment, kind='stable')
+        list_ptr = np.zeros(num_clusters + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=num_clusters), out=list_ptr[1:])
+        scale = np.maximum(np.abs(embeddings).max(axis=0), 1e-12) / 127
+        codes = np.round(embeddings[order] / scale).astype(np.int8)
+
+        ann = None
+        if use_faiss and faiss is not None:
+            ann = faiss.index_factory(dim, f'IVF{num_clusters},SQ8', faiss.METRIC_INNER_PRODUCT)
+            ann.train(train)
+            ann.add(embeddings)
+
+        meta = dict(
+            version=DENSE_INDEX_VERSION,
+            dim=dim,
+            stemmed=bm25.meta['stemmed'],
+            num_docs=num_docs,
+            num_clusters=num_clusters,
+            faiss=ann is not None,
+        )
+        terms = [bm25.terms[t] for t in kept]
+        return cls(
+            terms, components.astype(np.float16), centroids, list_ptr, order, codes,
+            scale.astype(np.float32), np.asarray(bm25.docids), meta, ann=ann,
+        )
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        _atomic_write(os.path.join(path, 'terms.json'), lambda f: f.write(json.dumps(self.terms).encode()))
+        for name in DENSE_INDEX_ARRAYS:
+            _atomic_write(os.path.join(path, f'{name}.npy'), lambda f: np.save(f, getattr(self, name)))
+        if self.ann is not None:
+            tmp_path = os.path.join(path, 'ann.faiss.tmp')
+            faiss.write_index(self.ann, tmp_path)
+            os.replace(tmp_path, os.path.join(path, 'ann.faiss'))
+        # written last, so an index with meta is complete
+        _atomic_write(os.path.join(path, 'meta.json'), lambda f: f.write(json.dumps(self.meta).encode()))
+
+    @classmethod
+    def load(cls, path, nprobe=32):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('version') != DENSE_INDEX_VERSION:
+            raise ValueError(f'{path} is not a compatible dense index, rebuild it.')
+        with open(os.path.join(path, 'terms.json')) as f:
+            terms = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+            for name in DENSE_INDEX_ARRAYS
+        }
+        ann = None
+        if meta['faiss']:
+            if faiss is None:
+                print(f'faiss is not installed, searching {path} without it.')
+            else:
+                ann = faiss.read_index(os.path.join(path, 'ann.faiss'), faiss.IO_FLAG_MMAP)
+        return cls(terms, meta=meta, ann=ann, nprobe=nprobe, **arrays)
+
+    def encode(self, query):
+        """Unit embedding of `query`, zero if it has no indexed terms"""
+        rows = [self.term_ids[t] for t in self.analyzer(query) if t in self.term_ids]
+        if not rows:
+            return np.zeros(self.meta['dim'], dtype=np.float32)
+        return _normalize(self.components[rows].astype(np.float32).sum(axis=0))
+
+    def _search_embedding(self, q, k):
+        if not q.any():
+            return []
+        if self.ann is not None:
+            scores, docs = self.ann.search(q[None], k)
+            return [
+                SearchHit(str(self.docids[d]), float(s))
+                for d, s in zip(docs[0], scores[0]) if d >= 0
+            ]
+        clusters = _top_k(self.centroids @ q, self.nprobe)
+        ranges = [(self.list_ptr[c], self.list_ptr[c + 1]) for c in clusters]
+        candidates = np.concatenate([np.arange(start, end) for start, end in ranges])
+        codes = np.concatenate([self.codes[start:end] for start, end in ranges])
+        scores = codes.astype(np.float32) @ (q * self.scale)
+        return [
+            SearchHit(str(self.docids[self.order[candidates[i]]]), float(scores[i]))
+            for i in _top_k(scores, k)
+        ]
+
+    def search(self, query, k=10):
+        return self._search_embedding(self.encode(query), k)
+
+
+class HybridBackend(SearchBackend):
+    """
+    Fuses the rankings of a sparse and a dense backend by reciprocal rank:
+    a document ranked `r`-th (from 1) by a backend scores `1 / (k_rrf + r)`,
+    summed over backends
+
+    Arguments:
+    depth (`int`) -- number of hits fused from each backend
+    """
+    def __init__(self, sparse, dense, depth=100, k_rrf=60):
+        self.sparse = sparse
+        self.dense = dense
+        self.depth = depth
+        self.k_rrf = k_rrf
+
+    def _fuse(self, rankings, k):
+        scores = defaultdict(float)
+        for hits in rankings:
+            for rank, hit in enumerate(hits, 1):
+                scores[hit.docid] += 1 / (self.k_rrf + rank)
+        # ties keep the sparse ranking's order
+        docids = sorted(scores, key=lambda docid: -scores[docid])[:k]
+        return [SearchHit(docid, scores[docid]) for docid in docids]
+
+    def search(self, query, k=10):
+        depth = max(k, self.depth)
+        return self._fuse([self.sparse.search(query, k=depth), self.dense.search(query, k=depth)], k)
+
+    def search_many(self, queries, k=10):
+        depth = max(k, self.depth)
+        return [
+            self._fuse(rankings, k) for rankings in zip(
+                self.sparse.search_many(queries, k=depth),
+                self.dense.search_many(queries, k=depth),
+            )
+        ]
+
+
+def measure_latency(backend, queries, k=10):
+    """Returns (median, 95th percentile) milliseconds per query of `backend`"""
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        backend.search(query, k=k)
+        times.append((time.perf_counter() - start) * 1000)
+    return float(np.median(times)), float(np.percentile(times, 95))
+
+
+if __name__ == '__main__':
+    import argparse
+    import random
+
+    parser = argparse.ArgumentParser(description='Build dense search indexes from native search indexes')
+    parser.add_argument('--num_products', default=INDEX_SIZES, nargs='+',
+                        type=lambda n: None if n == 'all' else int(n),
+                        help='Index sizes to build, `all` for all products')
+    parser.add_argument('--dim', default=128, type=int, help='Embedding size')
+    parser.add_argument('--no_faiss', action='store_true', help='Do not build a faiss index')
+    args = parser.parse_args()
+
+    for num_products in args.num_products:
+        start = time.time()
+        bm25 = BM25Index.load(get_native_index_path(num_products))
+        index = DenseIndex.build(bm25, dim=args.dim, use_faiss=not args.no_faiss)
+        output_path = get_dense_index_path(num_products)
+        index.save(output_path)
+        print(f'Dense index of {len(index)} products written to {output_path} '
+              f'in {time.time() - start:.1f}s')
+
+        # latency on queries made of random words of the indexed products
+        words = random.Random(0).sample(bm25.terms, min(len(bm25.terms), 3000))
+        queries = [' '.join(words[i:i + 6]) for i in range(0, len(words), 6)]
+        for name, backend in [('dense', index), ('hybrid', HybridBackend(bm25, index))]:
+            median, p95 = measure_latency(backend, queries)
+            print(f'{name} search: {median:.2f} ms median, {p95:.2f} ms p95 per query')
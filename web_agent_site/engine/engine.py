@@ -4,18 +4,32 @@ import os
 import re
 import json
 import random
+import multiprocessing
 from collections import defaultdict
+from collections.abc import Sequence
 from ast import literal_eval
 from decimal import Decimal
 
-import cleantext
 from tqdm import tqdm
-from rank_bm25 import BM25Okapi
-from flask import render_template_string
+from flask import current_app
+from jinja2 import FileSystemBytecodeCache, FileSystemLoader
 from rich import print
-from pyserini.search.lucene import LuceneSearcher
 
+from web_agent_site.engine.profiler import phase
+from web_agent_site.engine.search_backend import init_search_backend
+from web_agent_site.engine.search_cache import normalize_keywords
+from web_agent_site.engine.catalog import (
+    LazyMapping,
+    ProductList,
+    ProductStore,
+    get_catalog_path,
+    get_source_signature,
+    load_attribute_index,
+    load_catalog,
+    write_catalog,
+)
 from web_agent_site.utils import (
+    iter_json_array,
     BASE_DIR,
     DEFAULT_FILE_PATH,
     DEFAULT_REVIEW_PATH,
@@ -34,6 +48,12 @@ NEXT_PAGE = 'Next >'
 PREV_PAGE = '< Prev'
 BACK_TO_SEARCH = 'Back to Search'
 
+CLEAN_BATCH_SIZE = 1000
+
+_attributes_cache = dict()
+_template_envs = dict()
+_clean_worker_state = dict()
+
 ACTION_TO_TEMPLATE = {
     'Description': 'description_page.html',
     'Features': 'features_page.html',
@@ -44,16 +64,14 @@ ACTION_TO_TEMPLATE = {
 def map_action_to_html(action, **kwargs):
     action_name, action_arg = parse_action(action)
     if action_name == 'start':
-        path = os.path.join(TEMPLATE_DIR, 'search_page.html')
-        html = render_template_string(
-            read_html_template(path=path),
+        html = render_page(
+            'search_page.html',
             session_id=kwargs['session_id'],
             instruction_text=kwargs['instruction_text'],
         )
     elif action_name == 'search':
-        path = os.path.join(TEMPLATE_DIR, 'results_page.html')
-        html = render_template_string(
-            read_html_template(path=path),
+        html = render_page(
+            'results_page.html',
             session_id=kwargs['session_id'],
             products=kwargs['products'],
             keywords=kwargs['keywords'],
@@ -62,9 +80,8 @@ def map_action_to_html(action, **kwargs):
             instruction_text=kwargs['instruction_text'],
         )
     elif action_name == 'click' and action_arg == END_BUTTON:
-        path = os.path.join(TEMPLATE_DIR, 'done_page.html')
-        html = render_template_string(
-            read_html_template(path),
+        html = render_page(
+            'done_page.html',
             session_id=kwargs['session_id'],
             reward=kwargs['reward'],
             asin=kwargs['asin'],
@@ -79,9 +96,8 @@ def map_action_to_html(action, **kwargs):
             product_category=kwargs.get('product_category'),
         )
     elif action_name == 'click' and action_arg in ACTION_TO_TEMPLATE:
-        path = os.path.join(TEMPLATE_DIR, ACTION_TO_TEMPLATE[action_arg])
-        html = render_template_string(
-            read_html_template(path),
+        html = render_page(
+            ACTION_TO_TEMPLATE[action_arg],
             session_id=kwargs['session_id'],
             product_info=kwargs['product_info'],
             keywords=kwargs['keywords'],
@@ -91,9 +107,8 @@ def map_action_to_html(action, **kwargs):
             instruction_text=kwargs.get('instruction_text')
         )
     elif action_name == 'click':
-        path = os.path.join(TEMPLATE_DIR, 'item_page.html')
-        html = render_template_string(
-            read_html_template(path),
+        html = render_page(
+            'item_page.html',
             session_id=kwargs['session_id'],
             product_info=kwargs['product_info'],
             keywords=kwargs['keywords'],
@@ -114,6 +129,40 @@ def read_html_template(path):
     return template
 
 
+def get_template_env(app):
+    """
+    Jinja environment rendering the page templates of `TEMPLATE_DIR` for
+    the Flask `app`: an overlay of the app's environment, so templates see
+    its globals (`url_for`, ...), that compiles each template once and keeps
+    the compiled code in Jinja's bytecode cache for later processes
+    """
+    env = _template_envs.get(app)
+    if env is None:
+        env = _template_envs[app] = app.jinja_env.overlay(
+            loader=FileSystemLoader(TEMPLATE_DIR),
+            bytecode_cache=FileSystemBytecodeCache(),
+            auto_reload=False,
+        )
+    return env
+
+
+def render_page(template_name, **context):
+    """Render the page template `template_name` in the current Flask app, like `render_template_string`"""
+    app = current_app._get_current_object()
+    template = get_template_env(app).get_template(template_name)
+    app.update_template_context(context)
+    return template.render(context)
+
+
+def reload_templates():
+    """
+    Drop compiled templates, so that the next renders read the template
+    files again; call it after editing templates of a running server
+    """
+    for env in _template_envs.values():
+        env.cache.clear()
+
+
 def parse_action(action):
     """
     Parse action string to action name and its arguments.
@@ -145,119 +194,326 @@ def convert_web_app_string_to_var(name, string):
     return var
 
 
-def get_top_n_product_from_keywords(
+class SearchResults(Sequence):
+    """
+    Ranked results of a search, which resolves products only when they are
+    accessed, e.g. for the page of results being shown
+
+    Arguments:
+    keys (`Sequence`) -- ranked keys of the resulting products
+    resolve (`func`) -- maps a key to its product
+    """
+    def __init__(self, keys, resolve):
+        self.keys = keys
+        self.resolve = resolve
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.resolve(key) for key in self.keys[i]]
+        return self.resolve(self.keys[i])
+
+
+def get_search_results(
         keywords,
         search_engine,
         all_products,
         product_item_dict,
         attribute_to_asins=None,
+        search_cache=None,
+        product_index=None,
     ):
+    """
+    Returns `SearchResults` of products matching `keywords`, which either
+    start with one of `<r>` (random), `<a>` (attribute), `<c>` (category),
+    `<q>` (query), or are searched with `search_engine`. Searches are
+    looked up in, and added to, `search_cache` if given. The other modes
+    use `product_index` if given, and otherwise scan `all_products`.
+    """
     if keywords[0] == '<r>':
-        top_n_products = random.sample(all_products, k=SEARCH_RETURN_N)
+        if product_index is not None:
+            positions = product_index.sample_positions(SEARCH_RETURN_N)
+        else:
+            positions = random.sample(range(len(all_products)), k=SEARCH_RETURN_N)
     elif keywords[0] == '<a>':
         attribute = ' '.join(keywords[1:]).strip()
-        asins = attribute_to_asins[attribute]
-        top_n_products = [p for p in all_products if p['asin'] in asins]
+        if product_index is not None:
+            positions = product_index.find('attribute', attribute)
+        else:
+            asins = attribute_to_asins[attribute]
+            positions = [i for i, p in enumerate(all_products) if p['asin'] in asins]
     elif keywords[0] == '<c>':
         category = keywords[1].strip()
-        top_n_products = [p for p in all_products if p['category'] == category]
+        if product_index is not None:
+            positions = product_index.find('category', category)
+        else:
+            positions = [i for i, p in enumerate(all_products) if p['category'] == category]
     elif keywords[0] == '<q>':
         query = ' '.join(keywords[1:]).strip()
-        top_n_products = [p for p in all_products if p['query'] == query]
+        if product_index is not None:
+            positions = product_index.find('query', query)
+        else:
+            positions = [i for i, p in enumerate(all_products) if p['query'] == query]
     else:
         keywords = ' '.join(keywords)
-        hits = search_engine.search(keywords, k=SEARCH_RETURN_N)
-        docs = [search_engine.doc(hit.docid) for hit in hits]
-        top_n_asins = [json.loads(doc.raw())['id'] for doc in docs]
-        top_n_products = [product_item_dict[asin] for asin in top_n_asins if asin in product_item_dict]
-    return top_n_products
+        top_n_asins = None if search_cache is None else search_cache.get(keywords)
+        if top_n_asins is None:
+            hits = search_engine.search(keywords, k=SEARCH_RETURN_N)
+            # documents are indexed with the ASIN as their id (see
+            # search_engine/convert_product_file_format.py), so there is no
+            # need to fetch and decode the stored document
+            top_n_asins = [hit.docid for hit in hits]
+            if search_cache is not None:
+                search_cache.put(keywords, top_n_asins)
+        top_n_asins = [asin for asin in top_n_asins if asin in product_item_dict]
+        return SearchResults(top_n_asins, product_item_dict.__getitem__)
+    return SearchResults(positions, all_products.__getitem__)
+
+
+def get_top_n_product_from_keywords(*args, **kwargs):
+    """Returns the list of all products of `get_search_results`"""
+    return list(get_search_results(*args, **kwargs))
+
+
+def prefetch_searches(keywords_list, search_engine, search_cache):
+    """
+    Runs the engine searches among `keywords_list` (lists of keywords, as
+    passed to `get_top_n_product_from_keywords`) that are not in
+    `search_cache` with one `search_many` call, and caches their results.
+    Returns the number of queries searched.
+    """
+    queries = dict()
+    for keywords in keywords_list:
+        if not keywords or keywords[0] in ('<r>', '<a>', '<c>', '<q>'):
+            continue
+        query = ' '.join(keywords)
+        if query not in search_cache:
+            queries.setdefault(normalize_keywords(query), query)
+    queries = list(queries.values())
+    if not queries:
+        return 0
+    results = search_engine.search_many(queries, k=SEARCH_RETURN_N)
+    for query, hits in zip(queries, results):
+        search_cache.put(query, [hit.docid for hit in hits])
+    return len(queries)
 
 
 def get_product_per_page(top_n_products, page):
+    """Products on `page` of a list of products or `SearchResults`"""
     return top_n_products[(page - 1) * PRODUCT_WINDOW:page * PRODUCT_WINDOW]
 
 
-def generate_product_prices(all_products):
+def generate_product_prices(all_products, rng=random):
+    if isinstance(all_products, ProductList):
+        pricings = all_products.iter_pricing()
+    else:
+        pricings = ((p['asin'], p['pricing']) for p in all_products)
     product_prices = dict()
-    for product in all_products:
-        asin = product['asin']
-        pricing = product['pricing']
+    for asin, pricing in pricings:
         if not pricing:
             price = 100.0
         elif len(pricing) == 1:
             price = pricing[0]
         else:
-            price = random.uniform(*pricing[:2])
+            price = rng.uniform(*pricing[:2])
         product_prices[asin] = price
     return product_prices
 
 
-def init_search_engine(num_products=None):
-    if num_products == 100:
-        indexes = 'indexes_100'
-    elif num_products == 1000:
-        indexes = 'indexes_1k'
-    elif num_products == 100000:
-        indexes = 'indexes_100k'
-    elif num_products is None:
-        indexes = 'indexes'
-    else:
-        raise NotImplementedError(f'num_products being {num_products} is not supported yet.')
-    search_engine = LuceneSearcher(os.path.join(BASE_DIR, f'../search_engine/{indexes}'))
+def init_search_engine(num_products=None, backend='lucene'):
+    """
+    Open the search index for `num_products` products with search backend
+    `backend` (see `search_backend.py`)
+    """
+    with phase(f'open_{backend}_index'):
+        search_engine = init_search_backend(num_products, backend)
     return search_engine
 
 
+UNUSED_PRODUCT_KEYS = (
+    'product_information',
+    'brand',
+    'brand_url',
+    'list_price',
+    'availability_quantity',
+    'availability_status',
+    'total_reviews',
+    'total_answered_questions',
+    'seller_id',
+    'seller_name',
+    'fulfilled_by_amazon',
+    'fast_track_message',
+    'aplus_present',
+    'small_description_old',
+)
+
+
 def clean_product_keys(products):
     for product in products:
-        product.pop('product_information', None)
-        product.pop('brand', None)
-        product.pop('brand_url', None)
-        product.pop('list_price', None)
-        product.pop('availability_quantity', None)
-        product.pop('availability_status', None)
-        product.pop('total_reviews', None)
-        product.pop('total_answered_questions', None)
-        product.pop('seller_id', None)
-        product.pop('seller_name', None)
-        product.pop('fulfilled_by_amazon', None)
-        product.pop('fast_track_message', None)
-        product.pop('aplus_present', None)
-        product.pop('small_description_old', None)
+        for key in UNUSED_PRODUCT_KEYS:
+            product.pop(key, None)
     print('Keys cleaned.')
     return products
 
 
-def load_products(filepath, num_products=None, human_goals=True):
-    # TODO: move to preprocessing step -> enforce single source of truth
-    with open(filepath) as f:
-        products = json.load(f)
-    print('Products loaded.')
-    products = clean_product_keys(products)
-    
-    # with open(DEFAULT_REVIEW_PATH) as f:
-    #     reviews = json.load(f)
-    all_reviews = dict()
-    all_ratings = dict()
-    # for r in reviews:
-    #     all_reviews[r['asin']] = r['reviews']
-    #     all_ratings[r['asin']] = r['average_rating']
-
+def get_catalog_sources(filepath, human_goals=True):
+    """Files that the cleaned products of `load_products` are built from"""
+    sources = [filepath, DEFAULT_ATTR_PATH]
     if human_goals:
-        with open(HUMAN_ATTR_PATH) as f:
-            human_attributes = json.load(f)
-    with open(DEFAULT_ATTR_PATH) as f:
-        attributes = json.load(f)
-    with open(HUMAN_ATTR_PATH) as f:
-        human_attributes = json.load(f)
+        sources.append(HUMAN_ATTR_PATH)
+    return sources
+
+
+def load_attributes(path):
+    """
+    Load file mapping ASIN -> attributes/instructions. Uses the pre-indexed
+    version of the file if it is up to date, so only entries that are
+    accessed are decoded. Loaded files are reused within the process until
+    the file changes.
+    """
+    key = tuple(get_source_signature([path])[0])
+    if key not in _attributes_cache:
+        attributes = load_attribute_index(path)
+        if attributes is None:
+            with open(path) as f:
+                attributes = json.load(f)
+        _attributes_cache[key] = attributes
+    return _attributes_cache[key]
+
+
+def build_attribute_to_asins(all_products):
+    attribute_to_asins = defaultdict(set)
+    for p in all_products:
+        for a in p['Attributes']:
+            attribute_to_asins[a].add(p['asin'])
+    return attribute_to_asins
+
+
+def load_products(filepath, num_products=None, human_goals=True, lazy=False, num_workers=None):
+    """
+    Load cleaned products, from the compiled catalog if there is an up to
+    date one, otherwise from the raw products file, with `num_workers`
+    processes cleaning products.
+
+    If `lazy` is set and a compiled catalog exists, `all_products` and
+    `product_item_dict` are views that decode products from the shared,
+    memory-mapped catalog on access instead of materializing all of them.
+    """
+    with phase('open_catalog'):
+        catalog = load_catalog(
+            get_catalog_path(filepath, human_goals),
+            get_catalog_sources(filepath, human_goals),
+        )
+    if catalog is not None:
+        # compiled catalog stores products in the same order as `build_products`
+        n = len(catalog) if num_products is None \
+            else min(num_products, len(catalog))
+        if lazy:
+            product_item_dict = ProductStore(catalog, num_records=n)
+            all_products = product_item_dict.products
+        else:
+            with phase('decode_products'):
+                all_products = [catalog.get(i) for i in range(n)]
+                product_item_dict = {p['asin']: p for p in all_products}
+
+        def load_attribute_to_asins():
+            if n < len(catalog):
+                return build_attribute_to_asins(all_products)
+            return defaultdict(set, {
+                a: set(asins)
+                for a, asins in catalog.section('attribute_to_asins').items()
+            })
+        if lazy:
+            attribute_to_asins = LazyMapping(load_attribute_to_asins)
+        else:
+            with phase('attribute_to_asins'):
+                attribute_to_asins = load_attribute_to_asins()
+        print(f'Products loaded from compiled catalog {catalog.path}.')
+    else:
+        if lazy:
+            print('No compiled catalog found, loading all products into memory.')
+        all_products = build_products(filepath, num_products, human_goals, num_workers)
+        product_item_dict = {p['asin']: p for p in all_products}
+        with phase('attribute_to_asins'):
+            attribute_to_asins = build_attribute_to_asins(all_products)
+
+    with phase('generate_prices'):
+        product_prices = generate_product_prices(all_products)
+    return all_products, product_item_dict, product_prices, attribute_to_asins
+
+
+def compile_catalog(filepath, human_goals=True, output_path=None, num_workers=None):
+    """
+    Clean all products in `filepath` once and write them to a compiled
+    catalog that `load_products` loads instead of the raw JSON.
+    """
+    if output_path is None:
+        output_path = get_catalog_path(filepath, human_goals)
+    all_products = build_products(
+        filepath, human_goals=human_goals, num_workers=num_workers
+    )
+    attribute_to_asins = build_attribute_to_asins(all_products)
+    write_catalog(
+        output_path,
+        all_products,
+        attribute_to_asins,
+        get_catalog_sources(filepath, human_goals),
+    )
+    return output_path
+
+
+def build_products(filepath, num_products=None, human_goals=True, num_workers=None):
+    """
+    Stream products from the raw products file, keeping only the first
+    `num_products` products with a valid, unique ASIN, and clean them.
+    Only the kept products are held in memory, not the whole raw file.
+
+    If `num_workers` > 1, products are cleaned in batches by a pool of
+    worker processes. Batches are merged back in file order, so the result
+    is the same as cleaning them in this process.
+    """
+    with phase('load_attributes'):
+        attributes = load_attributes(DEFAULT_ATTR_PATH)
+        human_attributes = load_attributes(HUMAN_ATTR_PATH) if human_goals else None
     print('Attributes loaded.')
 
+    # Reading the products file is streamed, so it is part of this phase
+    with phase('read_and_clean_products'):
+        products = tqdm(iter_unique_products(filepath, num_products), total=num_products)
+        if num_workers is not None and num_workers > 1:
+            all_products = []
+            with multiprocessing.Pool(
+                num_workers,
+                initializer=_init_clean_worker,
+                initargs=(human_goals,),
+            ) as pool:
+                batches = _batched(products, CLEAN_BATCH_SIZE)
+                for batch in pool.imap(_clean_product_batch, batches):
+                    all_products.extend(batch)
+        else:
+            all_reviews, all_ratings = load_reviews()
+            all_products = [
+                clean_product(
+                    p, attributes, human_attributes, human_goals,
+                    all_reviews, all_ratings,
+                )
+                for p in products
+            ]
+    print('Products loaded.')
+    return all_products
+
+
+def iter_unique_products(filepath, num_products=None):
+    """
+    Yield raw products with a valid ASIN from the products file, skipping
+    duplicate ASINs, until `num_products` products have been yielded
+    """
+    # TODO: move to preprocessing step -> enforce single source of truth
     asins = set()
-    all_products = []
-    attribute_to_asins = defaultdict(set)
-    if num_products is not None:
-        # using item_shuffle.json, we assume products already shuffled
-        products = products[:num_products]
-    for i, p in tqdm(enumerate(products), total=len(products)):
+    # using item_shuffle.json, we assume products already shuffled
+    for p in iter_json_array(filepath):
         asin = p['asin']
         if asin == 'nan' or len(asin) > 10:
             continue
@@ -267,96 +523,142 @@ def load_products(filepath, num_products=None, human_goals=True):
         else:
             asins.add(asin)
 
-        products[i]['category'] = p['category']
-        products[i]['query'] = p['query']
-        products[i]['product_category'] = p['product_category']
-
-        products[i]['Title'] = p['name']
-        products[i]['Description'] = p['full_description']
-        products[i]['Reviews'] = all_reviews.get(asin, [])
-        products[i]['Rating'] = all_ratings.get(asin, 'N.A.')
-        for r in products[i]['Reviews']:
-            if 'score' not in r:
-                r['score'] = r.pop('stars')
-            if 'review' not in r:
-                r['body'] = ''
-            else:
-                r['body'] = r.pop('review')
-        products[i]['BulletPoints'] = p['small_description'] \
-            if isinstance(p['small_description'], list) else [p['small_description']]
-
-        pricing = p.get('pricing')
-        if pricing is None or not pricing:
-            pricing = [100.0]
-            price_tag = '$100.0'
-        else:
-            pricing = [
-                float(Decimal(re.sub(r'[^\d.]', '', price)))
-                for price in pricing.split('$')[1:]
-            ]
-            if len(pricing) == 1:
-                price_tag = f"${pricing[0]}"
-            else:
-                price_tag = f"${pricing[0]} to ${pricing[1]}"
-                pricing = pricing[:2]
-        products[i]['pricing'] = pricing
-        products[i]['Price'] = price_tag
-
-        options = dict()
-        customization_options = p['customization_options']
-        option_to_image = dict()
-        if customization_options:
-            for option_name, option_contents in customization_options.items():
-                if option_contents is None:
-                    continue
-                option_name = option_name.lower()
-
-                option_values = []
-                for option_content in option_contents:
-                    option_value = option_content['value'].strip().replace('/', ' | ').lower()
-                    option_image = option_content.get('image', None)
-
-                    option_values.append(option_value)
-                    option_to_image[option_value] = option_image
-                options[option_name] = option_values
-        products[i]['options'] = options
-        products[i]['option_to_image'] = option_to_image
-
-        # without color, size, price, availability
-        # if asin in attributes and 'attributes' in attributes[asin]:
-        #     products[i]['Attributes'] = attributes[asin]['attributes']
-        # else:
-        #     products[i]['Attributes'] = ['DUMMY_ATTR']
-        # products[i]['instruction_text'] = \
-        #     attributes[asin].get('instruction', None)
-        # products[i]['instruction_attributes'] = \
-        #     attributes[asin].get('instruction_attributes', None)
-
-        # without color, size, price, availability
-        if asin in attributes and 'attributes' in attributes[asin]:
-            products[i]['Attributes'] = attributes[asin]['attributes']
-        else:
-            products[i]['Attributes'] = ['DUMMY_ATTR']
-            
-        if human_goals:
-            if asin in human_attributes:
-                products[i]['instructions'] = human_attributes[asin]
-        else:
-            products[i]['instruction_text'] = \
-                attributes[asin].get('instruction', None)
+        for key in UNUSED_PRODUCT_KEYS:
+            p.pop(key, None)
+        yield p
+        if num_products is not None and len(asins) >= num_products:
+            break
 
-            products[i]['instruction_attributes'] = \
-                attributes[asin].get('instruction_attributes', None)
 
-        products[i]['MainImage'] = p['images'][0]
-        products[i]['query'] = p['query'].lower().strip()
+def load_reviews():
+    # with open(DEFAULT_REVIEW_PATH) as f:
+    #     reviews = json.load(f)
+    all_reviews = dict()
+    all_ratings = dict()
+    # for r in reviews:
+    #     all_reviews[r['asin']] = r['reviews']
+    #     all_ratings[r['asin']] = r['average_rating']
+    return all_reviews, all_ratings
+
+
+def _batched(iterable, n):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _init_clean_worker(human_goals):
+    """Load lookups needed by `clean_product` once per worker process"""
+    _clean_worker_state['human_goals'] = human_goals
+    _clean_worker_state['attributes'] = load_attributes(DEFAULT_ATTR_PATH)
+    _clean_worker_state['human_attributes'] = \
+        load_attributes(HUMAN_ATTR_PATH) if human_goals else None
+    _clean_worker_state['reviews'] = load_reviews()
+
+
+def _clean_product_batch(batch):
+    state = _clean_worker_state
+    all_reviews, all_ratings = state['reviews']
+    return [
+        clean_product(
+            p, state['attributes'], state['human_attributes'],
+            state['human_goals'], all_reviews, all_ratings,
+        )
+        for p in batch
+    ]
+
+
+def clean_product(p, attributes, human_attributes, human_goals,
+                  all_reviews, all_ratings):
+    """Convert a raw product into the fields used by the web app and goals"""
+    asin = p['asin']
+    p['category'] = p['category']
+    p['query'] = p['query']
+    p['product_category'] = p['product_category']
+
+    p['Title'] = p['name']
+    p['Description'] = p['full_description']
+    p['Reviews'] = all_reviews.get(asin, [])
+    p['Rating'] = all_ratings.get(asin, 'N.A.')
+    for r in p['Reviews']:
+        if 'score' not in r:
+            r['score'] = r.pop('stars')
+        if 'review' not in r:
+            r['body'] = ''
+        else:
+            r['body'] = r.pop('review')
+    p['BulletPoints'] = p['small_description'] \
+        if isinstance(p['small_description'], list) else [p['small_description']]
+
+    pricing = p.get('pricing')
+    if pricing is None or not pricing:
+        pricing = [100.0]
+        price_tag = '$100.0'
+    else:
+        pricing = [
+            float(Decimal(re.sub(r'[^\d.]', '', price)))
+            for price in pricing.split('$')[1:]
+        ]
+        if len(pricing) == 1:
+            price_tag = f"${pricing[0]}"
+        else:
+            price_tag = f"${pricing[0]} to ${pricing[1]}"
+            pricing = pricing[:2]
+    p['pricing'] = pricing
+    p['Price'] = price_tag
+
+    options = dict()
+    customization_options = p['customization_options']
+    option_to_image = dict()
+    if customization_options:
+        for option_name, option_contents in customization_options.items():
+            if option_contents is None:
+                continue
+            option_name = option_name.lower()
+
+            option_values = []
+            for option_content in option_contents:
+                option_value = option_content['value'].strip().replace('/', ' | ').lower()
+                option_image = option_content.get('image', None)
+
+                option_values.append(option_value)
+                option_to_image[option_value] = option_image
+            options[option_name] = option_values
+    p['options'] = options
+    p['option_to_image'] = option_to_image
+
+    # without color, size, price, availability
+    # if asin in attributes and 'attributes' in attributes[asin]:
+    #     p['Attributes'] = attributes[asin]['attributes']
+    # else:
+    #     p['Attributes'] = ['DUMMY_ATTR']
+    # p['instruction_text'] = \
+    #     attributes[asin].get('instruction', None)
+    # p['instruction_attributes'] = \
+    #     attributes[asin].get('instruction_attributes', None)
+
+    # without color, size, price, availability
+    if asin in attributes and 'attributes' in attributes[asin]:
+        p['Attributes'] = attributes[asin]['attributes']
+    else:
+        p['Attributes'] = ['DUMMY_ATTR']
+        
+    if human_goals:
+        if asin in human_attributes:
+            p['instructions'] = human_attributes[asin]
+    else:
+        p['instruction_text'] = \
+            attributes[asin].get('instruction', None)
 
-        all_products.append(products[i])
+        p['instruction_attributes'] = \
+            attributes[asin].get('instruction_attributes', None)
 
-    for p in all_products:
-        for a in p['Attributes']:
-            attribute_to_asins[a].add(p['asin'])
+    p['MainImage'] = p['images'][0]
+    p['query'] = p['query'].lower().strip()
 
-    product_item_dict = {p['asin']: p for p in all_products}
-    product_prices = generate_product_prices(all_products)
-    return all_products, product_item_dict, product_prices, attribute_to_asins
+    return p
@@ -3,23 +3,95 @@ Functions for specifying goals and reward calculations.
 """
 import itertools
 import random
-import spacy
 from collections import defaultdict
 from rich import print
 from thefuzz import fuzz
 from web_agent_site.engine.normalize import normalize_color
+from web_agent_site.engine.profiler import phase
+from web_agent_site.engine.sampler import WeightedSampler
 
-nlp = spacy.load("en_core_web_sm")
+_nlp = None
+
+
+def get_nlp():
+    """spaCy pipeline used to compare product types, loaded on first use"""
+    global _nlp
+    if _nlp is None:
+        import spacy
+        with phase('spacy_load'):
+            _nlp = spacy.load("en_core_web_sm")
+    return _nlp
 
 PRICE_RANGE = [10.0 * i for i in range(1, 100)]
 
-def get_goals(all_products, product_prices, human_goals=True):
+def get_goals(all_products, product_prices, human_goals=True, rng=random):
     if human_goals:
-        return get_human_goals(all_products, product_prices)
+        return get_human_goals(all_products, product_prices, rng)
     else:
-        return get_synthetic_goals(all_products, product_prices)
+        return get_synthetic_goals(all_products, product_prices, rng)
     
-def get_human_goals(all_products, product_prices):
+def get_goal_set(all_products, product_prices, human_goals=True, filter_goals=None, limit_goals=-1):
+    """
+    Get goals in a fixed shuffled order, optionally filtered and limited
+
+    Arguments:
+    filter_goals (`func`) -- Select specific goal(s) for consideration based on criteria of custom function
+    limit_goals (`int`) -- Limit to number of goals available
+    """
+    with phase('build_goals'):
+        goals = get_goals(all_products, product_prices, human_goals)
+
+    # Fix outcome for random shuffling of goals
+    random.seed(233)
+    random.shuffle(goals)
+
+    return select_goals(goals, filter_goals, limit_goals)
+
+def select_goals(goals, filter_goals=None, limit_goals=-1):
+    """
+    Apply `filter_goals` and `limit_goals` to a list of goals, or to a
+    lazily decoded goal set (see `goal_cache.GoalSet`) without decoding all
+    of its goals at once
+    """
+    # Apply `filter_goals` parameter if exists to select speific goal(s)
+    if filter_goals is not None:
+        idxs = [
+            i for (i, goal) in enumerate(goals)
+            if filter_goals(i, goal)
+        ]
+        goals = _take_goals(goals, idxs)
+
+    # Imposes `limit` on goals via random selection
+    if limit_goals != -1 and limit_goals < len(goals):
+        sampler = WeightedSampler(get_goal_weights(goals))
+        idxs = sampler.sample_without_replacement(limit_goals).tolist()
+        goals = _take_goals(goals, idxs)
+    return goals
+
+def get_goal_weights(goals):
+    """Sampling weight of each goal"""
+    if hasattr(goals, 'weights'):
+        return goals.weights
+    return [goal['weight'] for goal in goals]
+
+def _take_goals(goals, idxs):
+    if hasattr(goals, 'subset'):
+        return goals.subset(idxs)
+    return [goals[i] for i in idxs]
+
+def sample_price_upper(price, rng=random):
+    """Pick the price limit stated in a goal for a product with `price`"""
+    price_range = [p for p in PRICE_RANGE if p > price][:4]
+    if len(price_range) >= 2:
+        _, price_upper = sorted(rng.sample(price_range, 2))
+        price_text = \
+            f', and price lower than {price_upper:.2f} dollars'
+    else:
+        price_upper = 1000000
+        price_text = ''
+    return price_upper, price_text
+
+def get_human_goals(all_products, product_prices, rng=random):
     goals = []
     cnt_atts = defaultdict(int)
     cnt = 0
@@ -34,14 +106,7 @@ def get_human_goals(all_products, product_prices):
 
             if product_prices is not None:
                 price = product_prices[asin]
-                price_range = [p for p in PRICE_RANGE if p > price][:4]
-                if len(price_range) >= 2:
-                    _, price_upper = sorted(random.sample(price_range, 2))
-                    price_text = \
-                        f', and price lower than {price_upper:.2f} dollars'
-                else:
-                    price_upper = 1000000
-                    price_text = ''
+                price_upper, price_text = sample_price_upper(price, rng)
             else:
                 price_upper = 1000000
 
@@ -65,66 +130,90 @@ def get_human_goals(all_products, product_prices):
     return goals
 
 
-def get_synthetic_goals(all_products, product_prices):
+def get_synthetic_goals(all_products, product_prices, rng=random):
+    templates = get_synthetic_goal_templates(all_products, product_prices, rng)
     goals = []
+    for template in templates:
+        for combination in itertools.product(*template['option_values']):
+            goals.append(make_synthetic_goal(template, combination))
+    return goals
+
+
+def get_synthetic_goal_templates(all_products, product_prices, rng=random):
+    """
+    Returns one template per product with synthetic goals. A product has
+    one goal per combination of its options (see `make_synthetic_goal`),
+    all sharing the same price limit and weight.
+    """
+    templates = []
     cnt_atts = defaultdict(int)
     for product in all_products:
         if ('instruction_text' not in product or 
             product['instruction_text'] is None):
             continue
-        product_goals = []        
         asin = product['asin']
         attributes = product['instruction_attributes']
         assert len(attributes) > 0
 
         if product_prices is not None:
             price = product_prices[asin]
-            price_range = [p for p in PRICE_RANGE if p > price][:4]
-            if len(price_range) >= 2:
-                _, price_upper = sorted(random.sample(price_range, 2))
-                price_text = \
-                    f', and price lower than {price_upper:.2f} dollars'
-            else:
-                price_upper = 1000000
-                price_text = ''
+            price_upper, price_text = sample_price_upper(price, rng)
         else:
             price_upper = 1000000
             price_text = ''
 
-        instruction_text = product['instruction_text']
-
         options = product['options']
         option_names = sorted(options)
-        combinations = list(itertools.product(
-            *(options[option_name] for option_name in option_names)
-        ))
-        for combination in combinations:
-            goal_options = dict()
-            for i, o in enumerate(combination):
-#                option_text.append(f'{option_names[i]}: {o}')
-                goal_options[option_names[i]] = o
-            option_text = ', and '.join([
-                f'{k}: {v}' for k, v in goal_options.items()
-            ])
-            option_text = ' with ' + option_text if option_text else ''
-            product_goals.append({
-                'asin': asin,
-                'category': product['category'],
-                'query': product['query'],
-                'name': product['name'],
-                'product_category': product['product_category'],
-                'instruction_text': f'{instruction_text}{option_text}{price_text}',
-                'attributes': attributes,
-                'price_upper': price_upper,
-                'goal_options': goal_options,
-                'name': product['Title'],
-            })
-            for att in attributes:
-                cnt_atts[att] += 1
-        goals += product_goals
-    for goal in goals:
-        goal['weight'] = sum(1. / cnt_atts[att] for att in goal['attributes']) / len(goal['attributes'])
-    return goals
+        option_values = [options[option_name] for option_name in option_names]
+        num_goals = 1
+        for values in option_values:
+            num_goals *= len(values)
+        # products with an option without values have no goals
+        if num_goals == 0:
+            continue
+        templates.append({
+            'asin': asin,
+            'category': product['category'],
+            'query': product['query'],
+            'name': product['Title'],
+            'product_category': product['product_category'],
+            'instruction_text': product['instruction_text'],
+            'attributes': attributes,
+            'price_upper': price_upper,
+            'price_text': price_text,
+            'option_names': option_names,
+            'option_values': option_values,
+            'num_goals': num_goals,
+        })
+        for att in attributes:
+            cnt_atts[att] += num_goals
+    for template in templates:
+        attributes = template['attributes']
+        template['weight'] = sum(1. / cnt_atts[att] for att in attributes) / len(attributes)
+    return templates
+
+
+def make_synthetic_goal(template, combination):
+    """Goal for one combination of option values of a synthetic goal template"""
+    goal_options = dict()
+    for i, o in enumerate(combination):
+        goal_options[template['option_names'][i]] = o
+    option_text = ', and '.join([
+        f'{k}: {v}' for k, v in goal_options.items()
+    ])
+    option_text = ' with ' + option_text if option_text else ''
+    return {
+        'asin': template['asin'],
+        'category': template['category'],
+        'query': template['query'],
+        'name': template['name'],
+        'product_category': template['product_category'],
+        'instruction_text': f"{template['instruction_text']}{option_text}{template['price_text']}",
+        'attributes': template['attributes'],
+        'price_upper': template['price_upper'],
+        'goal_options': goal_options,
+        'weight': template['weight'],
+    }
 
 
 def get_type_reward(purchased_product, goal):
@@ -140,6 +229,7 @@ def get_type_reward(purchased_product, goal):
     purchased_type = purchased_product['name']
     desired_type = goal['name']
 
+    nlp = get_nlp()
     purchased_type_parse = nlp(purchased_type)
     desired_type_parse = nlp(desired_type)
 
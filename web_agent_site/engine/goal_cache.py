@@ -0,0 +1,234 @@
+"""
+Precomputed goal sets.
+
+`get_goal_set` rebuilds every goal on start, and for synthetic goals that
+means one dict per combination of product options, millions of them for the
+full catalog. `compile_goal_set` instead writes a goal set once to a record
+file (see `catalog.py`) keyed by a hash of the catalog it was built from and
+the seed used to draw prices, and `GoalSet` decodes goals from it by index
+on access.
+
+For synthetic goals the file stores one template per product (see
+`goal.get_synthetic_goal_templates`); goal `i` is found by locating its
+product from cumulative goal counts and decoding its option combination
+from `i` in the order `itertools.product` enumerates them. The shuffled
+order used by `get_goal_set` is stored as a permutation of goal indices.
+
+A goal set compiled with seed `s` is the same as the one `get_goal_set`
+returns after `random.seed(s)` is called right before `load_products`, and
+the state of `random` after loading it is the same as after `get_goal_set`.
+"""
+import bisect
+import hashlib
+import os
+import random
+from array import array
+from collections.abc import Sequence
+
+import numpy as np
+
+from web_agent_site.engine.catalog import RecordWriter, open_record_file, get_source_signature
+from web_agent_site.engine.goal import (
+    get_human_goals,
+    get_synthetic_goal_templates,
+    make_synthetic_goal,
+    select_goals,
+)
+from web_agent_site.engine.profiler import phase
+from web_agent_site.utils import DEFAULT_GOAL_DIR
+
+GOAL_SET_VERSION = 1
+GOAL_SET_SUFFIX = '.goals'
+
+
+class GoalSet(Sequence):
+    """
+    Read-only sequence of goals decoded from a compiled goal set, in the
+    same order as the list returned by `get_goal_set`
+    """
+    def __init__(self, record_file, idxs=None):
+        self.record_file = record_file
+        self.human_goals = record_file.meta['human_goals']
+        self.order = record_file.section('order')
+        self.idxs = idxs
+        if not self.human_goals:
+            self.goal_starts = record_file.section('goal_starts')
+
+    def __len__(self):
+        return len(self.order) if self.idxs is None else len(self.idxs)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.goal(self._goal_index(i))
+
+    def _goal_index(self, i):
+        """Index of the `i`-th goal of this set in the unshuffled goal list"""
+        return self.order[i if self.idxs is None else self.idxs[i]]
+
+    def goal(self, g):
+        """Returns goal `g` of the unshuffled goal list"""
+        if self.human_goals:
+            return self.record_file.get(g)
+        p = bisect.bisect_right(self.goal_starts, g) - 1
+        template = self.record_file.get(p)
+        # `itertools.product` order, the last option varies fastest
+        k = g - self.goal_starts[p]
+        combination = []
+        for values in reversed(template['option_values']):
+            k, j = divmod(k, len(values))
+            combination.append(values[j])
+        return make_synthetic_goal(template, combination[::-1])
+
+    @property
+    def weights(self):
+        """Sampling weight of each goal, as an array"""
+        if self.human_goals:
+            return np.ones(len(self))
+        template_weights = np.frombuffer(self.record_file.section('weights'), dtype=np.float64)
+        goal_starts = np.frombuffer(self.goal_starts, dtype=np.uint64)
+        order = np.frombuffer(self.order, dtype=np.uint64)
+        if self.idxs is not None:
+            order = order[np.asarray(self.idxs, dtype=np.int64)]
+        templates = np.searchsorted(goal_starts, order, side='right') - 1
+        return template_weights[templates]
+
+    def subset(self, idxs):
+        """Goal set of the goals at positions `idxs` of this one"""
+        if self.idxs is not None:
+            idxs = [self.idxs[i] for i in idxs]
+        return GoalSet(self.record_file, array('Q', idxs))
+
+
+def get_goal_set_path(file_path, num_products=None, human_goals=True, seed=0,
+                      sources=None, goal_dir=DEFAULT_GOAL_DIR):
+    """
+    Location of the compiled goal set for a catalog and seed. The catalog is
+    identified by the signature of the `sources` files it is built from
+    (default: the products file) and the number of products loaded.
+    """
+    sources = [file_path] if sources is None else sources
+    catalog_hash = hashlib.sha1(repr((
+        GOAL_SET_VERSION,
+        get_source_signature(sources),
+        num_products,
+        bool(human_goals),
+    )).encode()).hexdigest()[:16]
+    goal_type = 'human' if human_goals else 'synthetic'
+    return os.path.join(goal_dir, f'{goal_type}.{catalog_hash}.seed{seed}{GOAL_SET_SUFFIX}')
+
+
+def compile_goal_set(path, all_products, human_goals=True, seed=0, sources=()):
+    """
+    Draw product prices and goals with `seed` and write them to a goal set
+    file. Goals are stored unshuffled, followed by the shuffling permutation.
+    """
+    rng = random.Random(seed)
+    # Same draws, in the same order, as `load_products` and `get_goals`
+    from web_agent_site.engine.engine import generate_product_prices
+    product_prices = generate_product_prices(all_products, rng)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    writer = RecordWriter(path)
+    if human_goals:
+        goals = get_human_goals(all_products, product_prices, rng)
+        for goal in goals:
+            writer.add(goal['asin'], goal)
+        num_goals = len(goals)
+    else:
+        templates = get_synthetic_goal_templates(all_products, product_prices, rng)
+        goal_starts = array('Q', [0])
+        for template in templates:
+            writer.add(template['asin'], template)
+            goal_starts.append(goal_starts[-1] + template['num_goals'])
+        num_goals = goal_starts.pop()
+        writer.add_section('goal_starts', goal_starts, 'Q')
+        writer.add_section('weights', [t['weight'] for t in templates], 'd')
+
+    # Shuffling an array of indices draws the same numbers as shuffling the
+    # goals, so it gives the same order as `get_goal_set`
+    order = array('Q', range(num_goals))
+    random.seed(233)
+    random.shuffle(order)
+    writer.add_section('order', order, 'Q')
+    writer.add_section('random_state', random.getstate())
+    writer.add_section('product_prices', product_prices)
+    writer.close(meta=dict(
+        sources=get_source_signature(sources),
+        version=GOAL_SET_VERSION,
+        human_goals=bool(human_goals),
+        seed=seed,
+        num_goals=num_goals,
+    ))
+    return path
+
+
+def load_goal_set(path, sources=()):
+    """
+    Returns (goals, product_prices) of the compiled goal set at `path`, or
+    `None` if there is no up to date one. Leaves `random` in the same state
+    as `get_goal_set` does.
+    """
+    record_file = open_record_file(path, sources)
+    if record_file is None or record_file.meta.get('version') != GOAL_SET_VERSION:
+        return None
+    random.setstate(record_file.section('random_state'))
+    return GoalSet(record_file), record_file.section('product_prices')
+
+
+def get_cached_goal_set(
+        file_path,
+        all_products,
+        num_products=None,
+        human_goals=True,
+        seed=0,
+        filter_goals=None,
+        limit_goals=-1,
+        sources=None,
+    ):
+    """
+    Returns (goals, product_prices) for the products loaded from
+    `file_path`, from the compiled goal set for `seed`, compiling it first
+    if there is none. Goals are filtered and limited as by `get_goal_set`.
+    """
+    sources = [file_path] if sources is None else sources
+    path = get_goal_set_path(file_path, num_products, human_goals, seed, sources)
+    with phase('load_goal_set'):
+        loaded = load_goal_set(path, sources)
+    if loaded is None:
+        with phase('compile_goal_set'):
+            compile_goal_set(path, all_products, human_goals, seed, sources)
+            loaded = load_goal_set(path, sources)
+    goals, product_prices = loaded
+    return select_goals(goals, filter_goals, limit_goals), product_prices
+
+
+if __name__ == '__main__':
+    import argparse
+    from web_agent_site.engine.engine import get_catalog_sources, load_products
+    from web_agent_site.utils import DEFAULT_FILE_PATH
+
+    parser = argparse.ArgumentParser(description='Precompute goal sets for a products file')
+    parser.add_argument('--file_path', default=DEFAULT_FILE_PATH, help='Raw products JSON file')
+    parser.add_argument('--goals', default='all', choices=['human', 'synthetic', 'all'],
+                        help='Goal type(s) to compile goal sets for')
+    parser.add_argument('--num_products', default=None, type=int,
+                        help='Number of products loaded')
+    parser.add_argument('--seed', default=0, type=int, help='Seed for prices and price limits')
+    args = parser.parse_args()
+
+    goal_types = [True, False] if args.goals == 'all' else [args.goals == 'human']
+    for human_goals in goal_types:
+        all_products = load_products(
+            args.file_path, args.num_products, human_goals=human_goals, lazy=True
+        )[0]
+        sources = get_catalog_sources(args.file_path, human_goals)
+        path = get_goal_set_path(
+            args.file_path, args.num_products, human_goals, args.seed, sources
+        )
+        compile_goal_set(path, all_products, human_goals, args.seed, sources)
+        print(f'Goal set written to {path}')
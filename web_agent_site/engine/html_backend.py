@@ -0,0 +1,387 @@
+"""
+Parsers extracting observations from rendered WebShop pages.
+
+A parsed page gives what the environments read from a page's HTML: its
+visible `TextNode`s, in document order, with what makes them clickable;
+its clickable elements, keyed by their text; whether it has a search bar;
+its instruction, product image and reward. `ParsedPage` parses with
+BeautifulSoup's `html.parser` and is the reference. `LxmlPage` (libxml2)
+and `SelectolaxPage` (lexbor) use C parsers, several times faster, and
+read their trees the way BeautifulSoup reads its own: whitespace-only
+strings are collapsed to a newline or a space (except in `<pre>`), and
+text in comments, scripts, styles and the head is hidden. Only newline
+strings between tags, which observations skip, may differ, and their
+clickables are attribute dicts instead of BeautifulSoup tags. They are
+optional: install `lxml` or `selectolax` to use them.
+
+Usage: python -m web_agent_site.engine.html_backend [--num_pages N]
+(measures the time each available backend takes per page)
+"""
+import re
+import time
+from collections import namedtuple
+from functools import cached_property
+
+from bs4 import BeautifulSoup
+from bs4.element import Comment
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+# `kind` is 'button', 'label' (buying option), 'product-link' or None
+TextNode = namedtuple('TextNode', ['text', 'kind'])
+
+# what BeautifulSoup considers whitespace
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+# tags whose text is hidden, and those where BeautifulSoup keeps whitespace
+INVISIBLE_TAGS = {'style', 'script', 'head', 'title', 'meta', '[document]'}
+PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+
+# BeautifulSoup ends a string at every tag, even an end tag closing nothing,
+# which libxml2 and lexbor drop: end tags are followed by a processing
+# instruction (parsed as an invisible comment) to end their strings too
+END_TAG = re.compile(r'(</[a-zA-Z][^>]*>)')
+STRING_END = r'\1<?s>'
+# HTML5 parsers drop a newline starting a `<pre>`, BeautifulSoup keeps it
+PRE_NEWLINE = re.compile(r'(<(?:pre|textarea|listing)\b[^>]*>)\n')
+
+
+def collapse_whitespace(text, preserve=False):
+    """`text` as BeautifulSoup keeps it, whitespace-only strings collapsed unless preserved"""
+    if text and not preserve and not text.strip(ASCII_SPACES):
+        return '\n' if '\n' in text else ' '
+    return text
+
+
+def _prepare(html):
+    """`html` marked up for a C parser to split and keep its strings as BeautifulSoup does"""
+    # carriage returns are normalized away in markup, kept in character references
+    return END_TAG.sub(STRING_END, html.replace('\r', '&#13;'))
+
+
+def tag_visible(element):
+    return (
+        element.parent.name not in INVISIBLE_TAGS and not isinstance(element, Comment)
+    )
+
+
+def get_text_nodes(html_obj):
+    """Visible text of parsed HTML, as the `TextNode`s a `Page` produces"""
+    nodes = []
+    for t in filter(tag_visible, html_obj.find_all(string=True)):
+        if t.parent.name in ('button', 'label'):
+            kind = t.parent.name
+        elif t.parent.get('class') == ['product-link']:
+            kind = 'product-link'
+        else:
+            kind = None
+        nodes.append(TextNode(str(t), kind))
+    return nodes
+
+
+def _text_node(text, tag, classes, preserve):
+    """`TextNode` of a string of a `tag` element, None if BeautifulSoup would hide or drop it"""
+    if tag in INVISIBLE_TAGS:
+        return None
+    text = collapse_whitespace(text, preserve)
+    if not text:
+        return None
+    if tag in ('button', 'label'):
+        kind = tag
+    elif classes == ['product-link']:
+        kind = 'product-link'
+    else:
+        kind = None
+    return TextNode(text, kind)
+
+
+def _clickables(buttons, product_links, buying_options):
+    """Clickables keyed as `get_available_actions` does, from (text, attributes) pairs"""
+    clickables = {text.lower(): attrs for text, attrs in buttons}
+    clickables.update((text.lower(), attrs) for text, attrs in product_links)
+    for _, attrs in buying_options:
+        clickables[f'{attrs.get("value")}'] = attrs
+    return clickables
+
+
+def _attributes(attrs):
+    """Attributes of an element as a dict, `class` split into a list like BeautifulSoup does"""
+    attrs = dict(attrs)
+    if 'class' in attrs:
+        attrs['class'] = (attrs['class'] or '').split()
+    return attrs
+
+
+class ParsedPage:
+    """Rendered HTML of a page, parsed once with BeautifulSoup, with the content accessors of `Page`"""
+    def __init__(self, html):
+        self.html = html
+        self.html_obj = BeautifulSoup(html, 'html.parser')
+
+    @cached_property
+    def text_nodes(self):
+        return get_text_nodes(self.html_obj)
+
+    @cached_property
+    def clickables(self):
+        buttons = self.html_obj.find_all(class_='btn')
+        product_links = self.html_obj.find_all(class_='product-link')
+        buying_options = self.html_obj.select('input[type="radio"]')
+        clickables = {
+            f'{b.get_text()}'.lower(): b
+            for b in buttons + product_links
+        }
+        for opt in buying_options:
+            opt_value = opt.get('value')
+            clickables[f'{opt_value}'] = opt
+        return clickables
+
+    @property
+    def has_search_bar(self):
+        return self.html_obj.find(id='search_input') is not None
+
+    @property
+    def instruction_text(self):
+        return self.html_obj.find(id='instruction-text').h4.text
+
+    @property
+    def image_url(self):
+        image = self.html_obj.find(id='product-image')
+        return None if image is None else image['src']
+
+    @property
+    def reward(self):
+        r = self.html_obj.find(id='reward')
+        return float(r.find_all('pre')[0].string) if r is not None else 0.0
+
+
+class LxmlPage:
+    """Rendered HTML of a page, parsed once with lxml, read as `ParsedPage` reads it"""
+    def __init__(self, html):
+        if etree is None:
+            raise ImportError('The lxml HTML backend needs lxml: pip install lxml')
+        self.html = html
+        self.root = etree.HTML(_prepare(html))
+
+    @staticmethod
+    def _preserved(element):
+        return any(
+            e.tag in PRESERVE_WHITESPACE_TAGS
+            for e in (element, *element.iterancestors())
+        )
+
+    def _strings(self, element):
+        """(string, parent element) pairs of the text under `element`, in document order"""
+        for s in element.xpath('.//text()'):
+            # a tail string follows its element, inside the element's parent
+            parent = s.getparent().getparent() if s.is_tail else s.getparent()
+            yield str(s), parent
+
+    def _get_text(self, element):
+        return ''.join(
+            collapse_whitespace(s, not s.strip(ASCII_SPACES) and self._preserved(parent))
+            for s, parent in self._strings(element)
+        )
+
+    def _find_id(self, id_):
+        found = self.root.xpath('//*[@id=$id]', id=id_)
+        return found[0] if found else None
+
+    @cached_property
+    def text_nodes(self):
+        nodes = []
+        if self.root is None:
+            return nodes
+        for s, parent in self._strings(self.root):
+            if parent is None:
+                tag, classes = '[document]', []
+            else:
+                tag, classes = parent.tag, (parent.get('class') or '').split()
+            # only whitespace-only strings depend on being in a `<pre>`
+            preserve = parent is not None and not s.strip(ASCII_SPACES) and self._preserved(parent)
+            node = _text_node(s, tag, classes, preserve)
+            if node is not None:
+                nodes.append(node)
+        return nodes
+
+    @cached_property
+    def clickables(self):
+        def with_text(elements):
+            return [(self._get_text(e), _attributes(e.attrib)) for e in elements]
+        return _clickables(
+            with_text(self.root.xpath('//*[contains(concat(" ", normalize-space(@class), " "), " btn ")]')),
+            with_text(self.root.xpath('//*[contains(concat(" ", normalize-space(@class), " "), " product-link ")]')),
+            with_text(self.root.xpath('//input[@type="radio"]')),
+        )
+
+    @property
+    def has_search_bar(self):
+        return self._find_id('search_input') is not None
+
+    @property
+    def instruction_text(self):
+        return self._get_text(self._find_id('instruction-text').xpath('.//h4')[0])
+
+    @property
+    def image_url(self):
+        image = self._find_id('product-image')
+        return None if image is None else image.attrib['src']
+
+    @property
+    def reward(self):
+        r = self._find_id('reward')
+        return float(self._get_text(r.xpath('.//pre')[0])) if r is not None else 0.0
+
+
+class SelectolaxPage:
+    """Rendered HTML of a page, parsed once with selectolax's lexbor parser, read as `ParsedPage` reads it"""
+    def __init__(self, html):
+        if LexborHTMLParser is None:
+            raise ImportError('The selectolax HTML backend needs selectolax: pip install selectolax')
+        self.html = html
+        self.tree = LexborHTMLParser(PRE_NEWLINE.sub('\\1\n\n', _prepare(html)))
+
+    @staticmethod
+    def _preserved(node):
+        while node is not None:
+            if node.tag in PRESERVE_WHITESPACE_TAGS:
+                return True
+            node = node.parent
+        return False
+
+    def _strings(self, node):
+        """(string, parent node) pairs of the text under `node`, in document order"""
+        for n in node.traverse(include_text=True):
+            if n.tag == '-text':
+                yield n.text_content, n.parent
+
+    def _get_text(self, node):
+        return ''.join(
+            collapse_whitespace(s, not s.strip(ASCII_SPACES) and self._preserved(parent))
+            for s, parent in self._strings(node)
+        )
+
+    @cached_property
+    def text_nodes(self):
+        nodes = []
+        if self.tree.root is None:
+            return nodes
+        for s, parent in self._strings(self.tree.root):
+            node = _text_node(
+                s, parent.tag, (parent.attributes.get('class') or '').split(),
+                not s.strip(ASCII_SPACES) and self._preserved(parent),
+            )
+            if node is not None:
+                nodes.append(node)
+        return nodes
+
+    @cached_property
+    def clickables(self):
+        def with_text(nodes):
+            return [(self._get_text(n), _attributes(n.attributes)) for n in nodes]
+        return _clickables(
+            with_text(self.tree.css('.btn')),
+            with_text(self.tree.css('.product-link')),
+            with_text(self.tree.css('input[type="radio"]')),
+        )
+
+    @property
+    def has_search_bar(self):
+        return self.tree.css_first('#search_input') is not None
+
+    @property
+    def instruction_text(self):
+        return self._get_text(self.tree.css_first('#instruction-text h4'))
+
+    @property
+    def image_url(self):
+        image = self.tree.css_first('#product-image')
+        return None if image is None else image.attributes['src']
+
+    @property
+    def reward(self):
+        r = self.tree.css_first('#reward')
+        return float(self._get_text(r.css_first('pre'))) if r is not None else 0.0
+
+
+HTML_BACKENDS = {
+    'bs4': ParsedPage,
+    'lxml': LxmlPage,
+    'selectolax': SelectolaxPage,
+}
+
+
+def parse_page(html, backend='bs4'):
+    """Parse rendered `html` with the `backend` named in `HTML_BACKENDS`"""
+    if backend not in HTML_BACKENDS:
+        raise ValueError(f'Unknown HTML backend {backend!r}, expected one of {list(HTML_BACKENDS)}')
+    return HTML_BACKENDS[backend](html)
+
+
+def available_backends():
+    """Names of the backends whose parser is installed"""
+    return [
+        name for name, installed in [
+            ('bs4', True),
+            ('lxml', etree is not None),
+            ('selectolax', LexborHTMLParser is not None),
+        ]
+        if installed
+    ]
+
+
+def measure_parse_time(pages, backend):
+    """Mean seconds `backend` takes to parse a page and read its text nodes and clickables"""
+    start_time = time.perf_counter()
+    for html in pages:
+        page = parse_page(html, backend)
+        page.text_nodes, page.clickables
+    return (time.perf_counter() - start_time) / max(len(pages), 1)
+
+
+if __name__ == '__main__':
+    import argparse
+    import random
+
+    from web_agent_site.engine.engine import END_BUTTON, load_products
+    from web_agent_site.engine.page import Page
+    from web_agent_site.envs.web_agent_text_env import app
+    from web_agent_site.utils import DEFAULT_FILE_PATH
+
+    parser = argparse.ArgumentParser(description='Measure the time HTML backends take per page')
+    parser.add_argument('--num_pages', default=1000, type=int, help='Number of pages to parse')
+    args = parser.parse_args()
+
+    # every type of page, of random products
+    all_products, product_item_dict, _, _ = load_products(DEFAULT_FILE_PATH, num_products=1000)
+    rng = random.Random(0)
+    pages = []
+    with app.app_context(), app.test_request_context():
+        while len(pages) < args.num_pages:
+            asin = rng.choice(all_products)['asin']
+            product_info = product_item_dict[asin]
+            kwargs = dict(
+                session_id='abc', product_info=product_info, keywords=['abc'], page=1,
+                asin=asin, options={}, instruction_text='i', show_attrs=True,
+            )
+            actions = ['click[item]'] + [f'click[{sub_page}]' for sub_page in ['Description', 'Features', 'Reviews']]
+            pages.extend(Page(action, **kwargs).html for action in actions)
+            pages.append(Page(
+                'search[abc]', session_id='abc', products=rng.sample(all_products, 10),
+                keywords=['abc'], page=1, total=50, instruction_text='i',
+            ).html)
+            pages.append(Page(
+                f'click[{END_BUTTON}]', session_id='abc', reward=1.0, asin=asin, options={},
+                instruction_text='i', goal={}, reward_info={},
+            ).html)
+    pages = pages[:args.num_pages]
+
+    for backend in available_backends():
+        print(f'{backend}: {measure_parse_time(pages, backend) * 1000:.2f} ms per page')
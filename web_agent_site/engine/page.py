@@ -0,0 +1,227 @@
+"""
+Semantic content of WebShop pages, without rendering them.
+
+A `Page` takes the same arguments as `map_action_to_html` and produces what
+the text environment extracts from the rendered HTML: the visible text
+nodes, in document order, with what makes them clickable; the clickable
+elements; the instruction; and the product image. It follows the page
+templates, and the way BeautifulSoup's `html.parser` reads their output:
+entities are unescaped, whitespace-only strings are collapsed to a newline
+or a space (except in `<pre>`), and empty strings are dropped. Changes to
+the templates' visible text must be mirrored here; the parity tests
+compare both for every page type.
+"""
+from functools import cached_property
+from pprint import pformat
+
+from jinja2.utils import htmlsafe_json_dumps
+
+from web_agent_site.engine.engine import (
+    ACTION_TO_TEMPLATE,
+    END_BUTTON,
+    map_action_to_html,
+    parse_action,
+)
+from web_agent_site.engine.html_backend import TextNode, collapse_whitespace
+
+_MISSING = object()
+
+
+def _text(obj, key):
+    """`{{ obj.key }}`, rendered as Jinja does, missing keys as empty strings"""
+    value = _MISSING if obj is None else obj.get(key, _MISSING)
+    return '' if value is _MISSING else str(value)
+
+
+class Page:
+    """Content of the page `map_action_to_html(action, **kwargs)` renders"""
+    def __init__(self, action, **kwargs):
+        if 'options' in kwargs:
+            # the session's options change as the episode goes on
+            kwargs['options'] = dict(kwargs['options'])
+        self.action = action
+        self.kwargs = kwargs
+        self.action_name, self.action_arg = parse_action(action)
+
+    @cached_property
+    def html(self):
+        """The rendered page, rendered once, in a Flask app context"""
+        return map_action_to_html(self.action, **self.kwargs)
+
+    @property
+    def template(self):
+        if self.action_name == 'start':
+            return 'search_page.html'
+        elif self.action_name == 'search':
+            return 'results_page.html'
+        elif self.action_name == 'click' and self.action_arg == END_BUTTON:
+            return 'done_page.html'
+        elif self.action_name == 'click' and self.action_arg in ACTION_TO_TEMPLATE:
+            return ACTION_TO_TEMPLATE[self.action_arg]
+        elif self.action_name == 'click':
+            return 'item_page.html'
+        raise ValueError('Action name not recognized.')
+
+    @cached_property
+    def text_nodes(self):
+        """Visible `TextNode`s of the page"""
+        template = self.template
+        if template == 'search_page.html':
+            strings = self._search_strings()
+        elif template == 'results_page.html':
+            strings = self._results_strings()
+        elif template == 'done_page.html':
+            strings = self._done_strings()
+        elif template == 'item_page.html':
+            strings = self._item_strings()
+        else:
+            strings = self._sub_page_strings(template)
+        nodes = []
+        for text, kind, preserve in strings:
+            text = collapse_whitespace(text, preserve)
+            if text:
+                nodes.append(TextNode(text, kind))
+        return nodes
+
+    @cached_property
+    def clickables(self):
+        """
+        Attributes of the clickable elements, keyed by their text like
+        `WebAgentTextEnv.get_available_actions`: buttons and product links,
+        lowercased, then buying options
+        """
+        clickables = dict()
+        for text, kind in self.text_nodes:
+            if kind == 'button':
+                clickables[text.lower()] = {'class': ['btn']}
+        for text, kind in self.text_nodes:
+            if kind == 'product-link':
+                clickables[text.lower()] = {'class': ['product-link']}
+        if self.template == 'item_page.html':
+            for option_name, option_contents in self.kwargs['product_info']['options'].items():
+                for option_content in option_contents:
+                    clickables[str(option_content)] = dict(
+                        type='radio', name=str(option_name), value=str(option_content),
+                    )
+        return clickables
+
+    @property
+    def has_search_bar(self):
+        return self.template == 'search_page.html'
+
+    @property
+    def instruction_text(self):
+        """Text of the instruction heading, as `get_instruction_text` reads it"""
+        if self.template == 'done_page.html':
+            raise AttributeError('The done page has no instruction')
+        heading = 'Instruction: ' if self.template == 'search_page.html' else 'Instruction:'
+        return heading + collapse_whitespace(str(self.kwargs.get('instruction_text')))
+
+    @property
+    def image_url(self):
+        """Source of the product image, None if the page has none"""
+        if self.template != 'item_page.html':
+            return None
+        return _text(self.kwargs['product_info'], 'MainImage')
+
+    # The methods below yield the (text, kind, whitespace preserved) strings
+    # of each template, in document order
+
+    def _header_strings(self):
+        yield 'Instruction:', None, False
+        yield str(self.kwargs.get('instruction_text')), None, False
+        yield 'Back to Search', 'button', False
+
+    def _search_strings(self):
+        yield 'WebShop', None, False
+        yield 'Instruction: ', None, False
+        yield str(self.kwargs['instruction_text']), None, False
+        yield 'Search', 'button', False
+
+    def _results_strings(self):
+        page = self.kwargs['page']
+        yield from self._header_strings()
+        yield f'Page {page} (Total results: {self.kwargs["total"]})', None, False
+        if page > 1:
+            yield '< Prev', 'button', False
+        yield 'Next >', 'button', False
+        for item in self.kwargs['products']:
+            yield _text(item, 'asin'), 'product-link', False
+            yield _text(item, 'Title'), None, False
+            yield _text(item, 'Price'), None, False
+
+    def _item_strings(self):
+        product_info = self.kwargs['product_info']
+        yield from self._header_strings()
+        yield '< Prev', 'button', False
+        for option_name, option_contents in product_info['options'].items():
+            yield str(option_name), None, False
+            for option_content in option_contents:
+                yield str(option_content), 'label', False
+        yield _text(product_info, 'Title'), None, False
+        yield 'Price: ' + _text(product_info, 'Price'), None, False
+        yield 'Rating: ' + _text(product_info, 'Rating'), None, False
+        buttons = ['Description', 'Features', 'Reviews']
+        if self.kwargs['show_attrs']:
+            buttons.append('Attributes')
+        for button in buttons + [END_BUTTON]:
+            yield button, 'button', False
+
+    def _sub_page_strings(self, template):
+        product_info = self.kwargs['product_info']
+        yield from self._header_strings()
+        yield '< Prev', 'button', False
+        if template == 'description_page.html':
+            yield _text(product_info, 'Description'), None, False
+        elif template == 'features_page.html':
+            for bulletpoint in product_info['BulletPoints']:
+                yield f' {bulletpoint}', None, False
+        elif template == 'review_page.html':
+            for review in product_info['Reviews']:
+                yield f'"{_text(review, "title")}"', None, False
+                yield _text(review, 'score'), None, False
+                yield _text(review, 'body'), None, False
+        elif template == 'attributes_page.html':
+            for attribute in product_info['Attributes']:
+                yield f' {attribute}', None, False
+            for key in ['category', 'query', 'product_category']:
+                yield _text(product_info, key), None, False
+
+    def _done_strings(self):
+        kwargs = self.kwargs
+        goal = kwargs.get('goal')
+        yield 'Thank you for shopping with us!', None, False
+        yield 'Your code: ', None, False
+        yield str(kwargs.get('mturk_code')), None, True
+        yield ' (Paste it in your MTurk interface.)', None, False
+        yield 'Purchased', None, False
+        for heading, text in [
+            ('asin', str(kwargs['asin'])),
+            ('options', htmlsafe_json_dumps(kwargs['options'], sort_keys=True)),
+            ('attrs', str(kwargs.get('purchased_attrs'))),
+            ('category', str(kwargs.get('category'))),
+            ('query', str(kwargs.get('query'))),
+            ('product category', str(kwargs.get('product_category'))),
+        ]:
+            yield heading, None, False
+            yield text, None, True
+        yield 'Target', None, False
+        for heading, key in [
+            ('asin', 'asin'),
+            ('options', 'goal_options'),
+            ('attrs', 'attributes'),
+            ('price upper', 'price_upper'),
+            ('instuction text', 'instruction_text'),
+            ('category', 'category'),
+            ('product category', 'product_category'),
+            ('query', 'query'),
+        ]:
+            yield heading, None, False
+            yield _text(goal, key), None, True
+        yield 'Goal ', None, False
+        yield pformat(goal), None, True
+        yield 'Reward', None, False
+        yield 'Your score (min 0.0, max 1.0)', None, False
+        yield str(kwargs['reward']), None, True
+        yield 'Reward Details ', None, False
+        yield pformat(kwargs.get('reward_info')), None, True
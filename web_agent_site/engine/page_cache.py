@@ -0,0 +1,264 @@
+"""
+Cache of pages shared by sessions.
+
+Sessions keep rendering the same pages: the results of the same search,
+the item page of the same product with the same options. Such pages only
+differ in the session ID of their links and in the instruction they show.
+`PageCache` renders each page once for no session in particular, with
+placeholders for these two fields, and keeps its HTML, text nodes and
+clickables. Every session then gets a `SessionPage` filling them in, so
+cached pages are neither rendered nor parsed again. Done pages, which show
+the session's reward and goal, are not cached.
+"""
+import re
+import secrets
+import sys
+import threading
+from collections import OrderedDict
+from functools import cached_property
+
+from markupsafe import escape
+
+from web_agent_site.engine.engine import ACTION_TO_TEMPLATE, END_BUTTON, parse_action
+from web_agent_site.engine.html_backend import collapse_whitespace
+from web_agent_site.engine.page import Page
+
+# placeholders rendered in place of the session fields, left as they are by
+# HTML escaping and URL quoting
+_token = secrets.token_hex(8)
+SESSION_PLACEHOLDER = f'session-{_token}'
+INSTRUCTION_PLACEHOLDER = f'instruction-{_token}'
+# session IDs that `url_for` puts in URLs as they are
+SAFE_SESSION_ID = re.compile(r'[A-Za-z0-9_.~-]+')
+
+
+def page_cache_key(action, **kwargs):
+    """
+    Key of the page `map_action_to_html(action, **kwargs)` renders, from the
+    arguments its template uses besides the session ID and instruction;
+    None for pages that are not cached
+    """
+    action_name, action_arg = parse_action(action)
+    if action_name == 'start':
+        return ('search_page.html',)
+    elif action_name == 'search':
+        return (
+            'results_page.html',
+            tuple(product['asin'] for product in kwargs['products']),
+            tuple(kwargs['keywords']),
+            kwargs['page'],
+            kwargs['total'],
+        )
+    elif action_name == 'click' and action_arg == END_BUTTON:
+        return None
+    elif action_name == 'click':
+        template = ACTION_TO_TEMPLATE.get(action_arg, 'item_page.html')
+        keywords = kwargs['keywords']
+        return (
+            template,
+            kwargs['product_info']['asin'],
+            kwargs['asin'],
+            keywords if isinstance(keywords, str) else tuple(keywords),
+            kwargs['page'],
+            tuple(kwargs['options'].items()),
+            kwargs.get('show_attrs') if template == 'item_page.html' else None,
+        )
+    return None
+
+
+def _size(obj):
+    """Approximate bytes taken by strings and containers of strings"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_size(k) + _size(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(_size(v) for v in obj)
+    return size
+
+
+class CachedPage:
+    """
+    Content of a page rendered with placeholders for the session fields
+
+    Arguments:
+    source -- `Page` or parsed page (see `html_backend`) of the page rendered with placeholders
+    """
+    def __init__(self, source):
+        self.text_nodes = list(source.text_nodes)
+        # BeautifulSoup tags are kept as their attributes
+        self.clickables = {
+            text: dict(getattr(clickable, 'attrs', clickable))
+            for text, clickable in source.clickables.items()
+        }
+        self.has_search_bar = source.has_search_bar
+        self.image_url = source.image_url
+        self.instruction_text = source.instruction_text
+        # a `Page` is kept to render its HTML only if it is asked for
+        self._source = source if isinstance(source, Page) else None
+        self._html = None if isinstance(source, Page) else source.html
+        self.cache = None
+        self.size = self._get_size()
+
+    def _get_size(self):
+        return _size(self.text_nodes) + _size(self.clickables) + _size(self.instruction_text) \
+            + (0 if self._html is None else _size(self._html))
+
+    @property
+    def html(self):
+        if self._html is None:
+            self._html = self._source.html
+            self._source = None
+            size, self.size = self.size, self._get_size()
+            if self.cache is not None:
+                self.cache.resize(self, self.size - size)
+        return self._html
+
+
+class SessionPage:
+    """A `CachedPage` as shown to a session, with the content accessors of `Page`"""
+    def __init__(self, cached_page, session_id, instruction_text):
+        self.cached_page = cached_page
+        self.session_id = session_id
+        self.instruction = instruction_text
+
+    def _fill(self, value):
+        """`value`, a string or list of strings, with the session fields filled in"""
+        if isinstance(value, list):
+            return [self._fill(v) for v in value]
+        if isinstance(value, str) and SESSION_PLACEHOLDER in value:
+            value = value.replace(SESSION_PLACEHOLDER, self.session_id)
+        return value
+
+    @cached_property
+    def html(self):
+        return self._fill(self.cached_page.html).replace(
+            INSTRUCTION_PLACEHOLDER, str(escape(self.instruction))
+        )
+
+    @cached_property
+    def text_nodes(self):
+        instruction = collapse_whitespace(str(self.instruction))
+        nodes = []
+        for node in self.cached_page.text_nodes:
+            if node.text == INSTRUCTION_PLACEHOLDER:
+                if not instruction:
+                    continue
+                node = node._replace(text=instruction)
+            nodes.append(node)
+        return nodes
+
+    @cached_property
+    def clickables(self):
+        return {
+            text: {name: self._fill(value) for name, value in attrs.items()}
+            for text, attrs in self.cached_page.clickables.items()
+        }
+
+    @property
+    def has_search_bar(self):
+        return self.cached_page.has_search_bar
+
+    @property
+    def instruction_text(self):
+        return self.cached_page.instruction_text.replace(
+            INSTRUCTION_PLACEHOLDER, collapse_whitespace(str(self.instruction))
+        )
+
+    @property
+    def image_url(self):
+        return self.cached_page.image_url
+
+    @property
+    def reward(self):
+        return 0.0
+
+
+class PageCache:
+    """
+    Memory bounded LRU cache of pages shared by sessions
+
+    Arguments:
+    max_bytes (`int`) -- Approximate memory taken by cached pages, least recently used are evicted first
+    """
+    def __init__(self, max_bytes=256 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, render, action, **kwargs):
+        """
+        `SessionPage` of the page for `action`, rendering the page with
+        placeholders for the session fields with `render(action, **kwargs)`
+        on a miss; None if the page is not cached
+        """
+        session_id = str(kwargs.get('session_id'))
+        key = page_cache_key(action, **kwargs)
+        if key is None or not SAFE_SESSION_ID.fullmatch(session_id):
+            with self.lock:
+                self.uncached += 1
+            return None
+        instruction_text = kwargs.get('instruction_text')
+        with self.lock:
+            cached_page = self.entries.get(key)
+            if cached_page is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if cached_page is None:
+            kwargs.update(session_id=SESSION_PLACEHOLDER, instruction_text=INSTRUCTION_PLACEHOLDER)
+            cached_page = CachedPage(render(action, **kwargs))
+            self.put(key, cached_page)
+        return SessionPage(cached_page, session_id, instruction_text)
+
+    def put(self, key, cached_page):
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                previous.cache = None
+                self.num_bytes -= previous.size
+            self.entries[key] = cached_page
+            cached_page.cache = self
+            self.num_bytes += cached_page.size
+            self._evict()
+
+    def resize(self, cached_page, num_bytes):
+        """Account for `num_bytes` more taken by `cached_page`, i.e. once its HTML is rendered"""
+        with self.lock:
+            if cached_page.cache is self:
+                self.num_bytes += num_bytes
+                self._evict()
+
+    def _evict(self):
+        while self.num_bytes > self.max_bytes and self.entries:
+            _, evicted = self.entries.popitem(last=False)
+            evicted.cache = None
+            self.num_bytes -= evicted.size
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            for cached_page in self.entries.values():
+                cached_page.cache = None
+            self.entries.clear()
+            self.num_bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'bytes': self.num_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.,
+            'uncached': self.uncached,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,130 @@
+"""
+Wall time and memory of startup phases (loading products, goals, search
+engine, models).
+
+Code marks phases with `phase(name)`. Each phase is recorded into every
+`StartupProfile` that is active when it runs, and into `PROCESS_PROFILE`,
+which keeps the last `MAX_PROCESS_PHASES` phases run in this process,
+including those run at import time. Phases may nest; nested phases are recorded with a greater depth.
+"""
+import os
+import sys
+import time
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+_active_profiles = []
+_depth = [0]
+
+MAX_PROCESS_PHASES = 1000
+
+
+def get_rss_mb():
+    """Current resident set size of this process in MB, if known"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def get_peak_rss_mb():
+    """Peak resident set size of this process so far in MB, if known"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+class StartupProfile:
+    """
+    Records the phases run while it is active, i.e.
+
+        with StartupProfile('SimServer') as profile:
+            ...
+        print(profile.summary())
+
+    Arguments:
+    name (`str`) -- Name of the profile in its summary
+    max_phases (`int`) -- If set, only the last `max_phases` phases are kept
+    """
+    def __init__(self, name='startup', max_phases=None):
+        self.name = name
+        self.phases = [] if max_phases is None else deque(maxlen=max_phases)
+        self.total_time = None
+        self.peak_rss_mb = None
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        _active_profiles.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        _active_profiles.remove(self)
+        self.total_time = time.perf_counter() - self._start
+        self.peak_rss_mb = get_peak_rss_mb()
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'total_time': self.total_time,
+            'peak_rss_mb': self.peak_rss_mb,
+            'phases': [dict(p) for p in self.phases],
+        }
+
+    def summary(self, max_depth=0):
+        """One line summary of the phases up to `max_depth` levels deep"""
+        min_depth = min((p['depth'] for p in self.phases), default=0)
+        parts = [
+            f'{p["name"]} {p["time"]:.2f}s'
+            + (f' ({p["rss_delta_mb"]:+.0f} MB)' if p['rss_delta_mb'] is not None else '')
+            for p in self.phases
+            if p['depth'] - min_depth <= max_depth and p['time'] is not None
+        ]
+        total = '' if self.total_time is None else f' {self.total_time:.2f}s'
+        peak = '' if self.peak_rss_mb is None else f', process peak RSS {self.peak_rss_mb:.0f} MB'
+        return f'{self.name}{total}{peak}: ' + ', '.join(parts)
+
+
+PROCESS_PROFILE = StartupProfile('process', max_phases=MAX_PROCESS_PHASES)
+
+
+@contextmanager
+def phase(name):
+    """Record wall time and memory of the enclosed block as phase `name`"""
+    record = {
+        'name': name,
+        'depth': _depth[0],
+        'time': None,
+        'rss_mb': None,
+        'rss_delta_mb': None,
+        # growth of the process peak RSS, which never decreases, during the phase
+        'peak_rss_delta_mb': None,
+    }
+    profiles = [PROCESS_PROFILE] + _active_profiles
+    for profile in profiles:
+        profile.phases.append(record)
+    rss_before = get_rss_mb()
+    peak_before = get_peak_rss_mb()
+    start = time.perf_counter()
+    _depth[0] += 1
+    try:
+        yield record
+    finally:
+        _depth[0] -= 1
+        record['time'] = time.perf_counter() - start
+        rss_after = get_rss_mb()
+        record['rss_mb'] = rss_after
+        record['rss_delta_mb'] = None if rss_after is None or rss_before is None \
+            else rss_after - rss_before
+        peak_after = get_peak_rss_mb()
+        record['peak_rss_delta_mb'] = None if peak_after is None or peak_before is None \
+            else peak_after - peak_before
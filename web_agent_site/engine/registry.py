@@ -0,0 +1,181 @@
+"""
+Process-wide registry of loaded catalogs, search engines and goal sets.
+
+Every `SimServer` used to load its own products, search engine and goals,
+so each `gym.make('WebAgentTextEnv-v0')` paid the full startup cost. The
+registry keeps what has been loaded in this process, and servers created
+with the same configuration attach to it instead.
+
+Filtered goal sets are built for every call and not kept: they would be
+keyed by the `filter_goals` function object, and every new lambda would keep
+a goal set alive for the life of the process.
+"""
+import os
+import threading
+
+from web_agent_site.engine.catalog import ProductIndex
+from web_agent_site.engine.engine import (
+    get_catalog_sources,
+    init_search_engine,
+    load_products,
+)
+from web_agent_site.engine.goal import get_goal_set
+from web_agent_site.engine.goal_cache import get_cached_goal_set
+from web_agent_site.engine.page_cache import PageCache
+from web_agent_site.engine.search_cache import SearchCache
+
+_lock = threading.RLock()
+_catalogs = dict()
+_product_indexes = dict()
+_search_engines = dict()
+_search_caches = dict()
+_page_caches = dict()
+_goal_sets = dict()
+
+
+def _catalog_key(file_path, num_products, human_goals, lazy):
+    return (os.path.abspath(file_path), num_products, bool(human_goals), bool(lazy))
+
+
+def get_catalog(file_path, num_products=None, human_goals=True, lazy=False):
+    """
+    Returns (all_products, product_item_dict, product_prices, attribute_to_asins)
+    as returned by `load_products`, loading them on first use
+    """
+    key = _catalog_key(file_path, num_products, human_goals, lazy)
+    with _lock:
+        if key not in _catalogs:
+            _catalogs[key] = load_products(
+                filepath=file_path,
+                num_products=num_products,
+                human_goals=human_goals,
+                lazy=lazy,
+            )
+        return _catalogs[key]
+
+
+def get_product_index(file_path, num_products=None, human_goals=True, lazy=False):
+    """`ProductIndex` of the products returned by `get_catalog`"""
+    key = _catalog_key(file_path, num_products, human_goals, lazy)
+    with _lock:
+        if key not in _product_indexes:
+            all_products = get_catalog(file_path, num_products, human_goals, lazy)[0]
+            _product_indexes[key] = ProductIndex.build(all_products)
+        return _product_indexes[key]
+
+
+def get_search_engine(num_products=None, backend='lucene'):
+    key = (num_products, backend)
+    with _lock:
+        if key not in _search_engines:
+            _search_engines[key] = init_search_engine(num_products=num_products, backend=backend)
+        return _search_engines[key]
+
+
+def get_loaded_search_backends():
+    """Backends of the search engines opened in this process"""
+    with _lock:
+        return {backend for _, backend in _search_engines}
+
+
+def get_search_cache(num_products=None, backend='lucene'):
+    """Search result cache shared by users of the same search engine"""
+    key = (num_products, backend)
+    with _lock:
+        if key not in _search_caches:
+            _search_caches[key] = SearchCache()
+        return _search_caches[key]
+
+
+def get_page_cache(file_path, num_products=None, human_goals=True, lazy=False, max_bytes=256 * 2 ** 20):
+    """
+    Page cache shared by users of the same catalog, bounded by the
+    `max_bytes` of its first user
+    """
+    key = _catalog_key(file_path, num_products, human_goals, lazy)
+    with _lock:
+        if key not in _page_caches:
+            _page_caches[key] = PageCache(max_bytes)
+        return _page_caches[key]
+
+
+def get_shared_goal_set(
+        file_path,
+        num_products=None,
+        human_goals=True,
+        filter_goals=None,
+        limit_goals=-1,
+        lazy=False,
+    ):
+    """
+    Returns goals for a catalog, shuffled, filtered and limited as by
+    `get_goal_set`. Building a goal set reseeds `random` as `get_goal_set`
+    does; later calls return the shared goals and leave `random` alone.
+    Goal sets filtered by `filter_goals` are built on every call.
+    """
+    def build():
+        all_products, _, product_prices, _ = \
+            get_catalog(file_path, num_products, human_goals, lazy)
+        return get_goal_set(
+            all_products,
+            product_prices,
+            human_goals,
+            filter_goals=filter_goals,
+            limit_goals=limit_goals,
+        )
+
+    if filter_goals is not None:
+        return build()
+    key = _catalog_key(file_path, num_products, human_goals, lazy) + (limit_goals,)
+    with _lock:
+        if key not in _goal_sets:
+            _goal_sets[key] = build()
+        return _goal_sets[key]
+
+
+def get_shared_cached_goal_set(
+        file_path,
+        num_products=None,
+        human_goals=True,
+        seed=0,
+        filter_goals=None,
+        limit_goals=-1,
+        lazy=False,
+    ):
+    """
+    Returns (goals, product_prices) from the compiled goal set for `seed`,
+    as by `goal_cache.get_cached_goal_set`, leaving `random` alone on later
+    calls and building filtered goal sets on every call like
+    `get_shared_goal_set`
+    """
+    def build():
+        all_products = get_catalog(file_path, num_products, human_goals, lazy)[0]
+        return get_cached_goal_set(
+            file_path,
+            all_products,
+            num_products,
+            human_goals,
+            seed,
+            filter_goals=filter_goals,
+            limit_goals=limit_goals,
+            sources=get_catalog_sources(file_path, human_goals),
+        )
+
+    if filter_goals is not None:
+        return build()
+    key = _catalog_key(file_path, num_products, human_goals, lazy) + (seed, limit_goals)
+    with _lock:
+        if key not in _goal_sets:
+            _goal_sets[key] = build()
+        return _goal_sets[key]
+
+
+def clear_registry():
+    """Drop all shared data, i.e. to free memory or pick up new data files"""
+    with _lock:
+        _catalogs.clear()
+        _product_indexes.clear()
+        _search_engines.clear()
+        _search_caches.clear()
+        _page_caches.clear()
+        _goal_sets.clear()
@@ -0,0 +1,89 @@
+"""
+Weighted sampling of goals.
+"""
+import random
+
+import numpy as np
+
+
+class WeightedSampler:
+    """
+    Samples indices `0..n-1` with probability proportional to `weights`.
+
+    Single samples use alias tables (Vose's method), so each costs one draw
+    from `rng` and O(1) work regardless of the number of weights. Batches,
+    and samples without replacement, are drawn with NumPy from a generator
+    seeded by `rng`, so seeding `rng` (by default the `random` module) makes
+    all samples reproducible.
+    """
+    def __init__(self, weights, rng=random):
+        weights = np.asarray(weights, dtype=np.float64)
+        if weights.ndim != 1 or len(weights) == 0:
+            raise ValueError('weights must be a non-empty 1-d sequence')
+        if (weights < 0).any() or not np.isfinite(weights).all():
+            raise ValueError('weights must be finite and non-negative')
+        total = weights.sum()
+        if total <= 0:
+            raise ValueError('weights must not all be zero')
+        self.rng = rng
+        self.weights = weights
+        self.probs = weights / total
+        # lists for single samples, which are faster to index from Python
+        self.prob, self.alias = self._build_alias_table(self.probs)
+        self.prob_array = np.array(self.prob)
+        self.alias_array = np.array(self.alias, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.weights)
+
+    @staticmethod
+    def _build_alias_table(probs):
+        n = len(probs)
+        scaled = (probs * n).tolist()
+        prob = [1.] * n
+        alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.]
+        large = [i for i, p in enumerate(scaled) if p >= 1.]
+        while small and large:
+            s = small.pop()
+            l = large[-1]
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] -= 1. - scaled[s]
+            if scaled[l] < 1.:
+                small.append(large.pop())
+        # leftovers are 1 up to rounding error
+        for i in small + large:
+            prob[i] = 1.
+        return prob, alias
+
+    def sample(self):
+        """Returns one index"""
+        u = self.rng.random() * len(self.prob)
+        i = int(u)
+        return i if u - i < self.prob[i] else self.alias[i]
+
+    def _numpy_rng(self):
+        return np.random.default_rng(self.rng.getrandbits(64))
+
+    def sample_batch(self, k):
+        """Returns an array of `k` indices, sampled with replacement"""
+        gen = self._numpy_rng()
+        u = gen.random(k) * len(self.prob)
+        i = u.astype(np.int64)
+        return np.where(u - i < self.prob_array[i], i, self.alias_array[i])
+
+    def sample_without_replacement(self, k):
+        """
+        Returns `k` distinct indices in the order they would be drawn one
+        after another, each with probability proportional to its weight
+        among the indices not drawn yet (Efraimidis-Spirakis)
+        """
+        num_positive = int((self.weights > 0).sum())
+        if k > num_positive:
+            raise ValueError(f'Cannot sample {k} of {num_positive} indices with positive weight')
+        gen = self._numpy_rng()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            keys = np.log(gen.random(len(self.weights))) / self.weights
+        top = np.argpartition(-keys, k - 1)[:k] if k > 0 else np.array([], dtype=np.int64)
+        return top[np.argsort(-keys[top], kind='stable')]
@@ -0,0 +1,490 @@
+"""
+Search backends.
+
+A search backend has a `search(query, k)` method returning the top `k`
+hits, best first, each with the ASIN of the product as its `docid` and a
+`score`, and a `search_many(queries, k)` method running several queries in
+one call. These backends are available:
+
+    lucene -- pyserini's `LuceneSearcher` over the `search_engine/indexes*`
+              directories built by `search_engine/run_indexing.sh`
+              (needs Java)
+    native -- `BM25Index`, a BM25 index held in NumPy arrays, over the same
+              product text, built with `python -m web_agent_site.engine.search_backend`
+    dense  -- nearest neighbours in product embeddings derived from the
+              native index (see `engine.dense_backend`)
+    hybrid -- the native and dense rankings fused
+
+`BM25Index` follows Lucene's BM25 as configured by pyserini (k1=0.9, b=0.4,
+Lucene's idf and lossy document length encoding) and approximates its
+English analyzer (possessive removal, lowercasing, stop words, Porter
+stemming when nltk is installed), so rankings are close to Lucene's but not
+identical.
+"""
+import json
+import os
+import re
+import time
+from collections import Counter, namedtuple
+
+import numpy as np
+
+from web_agent_site.utils import BASE_DIR
+
+SEARCH_ENGINE_DIR = os.path.join(BASE_DIR, '../search_engine')
+SEARCH_BACKENDS = ('lucene', 'native', 'dense', 'hybrid')
+# numbers of products indexed, `None` for all products
+INDEX_SIZES = [100, 1000, 100000, None]
+NATIVE_INDEX_VERSION = 2
+NATIVE_INDEX_ARRAYS = ['ptr', 'doc_ids', 'weights', 'tfs', 'docids']
+
+SearchHit = namedtuple('SearchHit', ['docid', 'score'])
+
+# Lucene's EnglishAnalyzer stop words
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'if',
+    'in', 'into', 'is', 'it', 'no', 'not', 'of', 'on', 'or', 'such', 'that',
+    'the', 'their', 'then', 'there', 'these', 'they', 'this', 'to', 'was',
+    'will', 'with',
+])
+# Words joined by apostrophes or periods, and numbers with separators, are
+# single tokens, as with Lucene's StandardTokenizer
+TOKEN_RE = re.compile(r"\w+(?:(?:['’.]|(?<=\d),(?=\d))\w+)*")
+
+try:
+    from nltk.stem.porter import PorterStemmer
+    _stem = PorterStemmer(mode=PorterStemmer.ORIGINAL_ALGORITHM).stem
+except ImportError:
+    _stem = None
+
+
+def get_index_name(num_products=None):
+    """Name of the search index directory for a number of products"""
+    if num_products == 100:
+        return 'indexes_100'
+    elif num_products == 1000:
+        return 'indexes_1k'
+    elif num_products == 100000:
+        return 'indexes_100k'
+    elif num_products is None:
+        return 'indexes'
+    raise NotImplementedError(f'num_products being {num_products} is not supported yet.')
+
+
+def get_native_index_path(num_products=None):
+    return os.path.join(SEARCH_ENGINE_DIR, f'{get_index_name(num_products)}_native')
+
+
+def get_product_contents(p):
+    """Text of a cleaned product that is indexed for search"""
+    option_texts = []
+    options = p.get('options', {})
+    for option_name, option_contents in options.items():
+        option_contents_text = ', '.join(option_contents)
+        option_texts.append(f'{option_name}: {option_contents_text}')
+    option_text = ', and '.join(option_texts)
+    return ' '.join([
+        p['Title'],
+        p['Description'],
+        p['BulletPoints'][0],
+        option_text,
+    ]).lower()
+
+
+class SearchBackend:
+    """Interface of search backends"""
+    def search(self, query, k=10):
+        """Returns the top `k` `SearchHit`s for `query`, best first"""
+        raise NotImplementedError
+
+    def search_many(self, queries, k=10):
+        """Returns the top `k` `SearchHit`s of each query in `queries`"""
+        return [self.search(query, k=k) for query in queries]
+
+
+class LuceneBackend(SearchBackend):
+    """Searches a pyserini Lucene index"""
+    def __init__(self, index_dir):
+        # Importing pyserini starts a JVM, so only do it once a searcher is needed
+        from pyserini.search.lucene import LuceneSearcher
+        self.searcher = LuceneSearcher(index_dir)
+
+    def search(self, query, k=10):
+        return [SearchHit(hit.docid, hit.score) for hit in self.searcher.search(query, k=k)]
+
+    def search_many(self, queries, k=10, threads=4):
+        """Runs `queries` with Lucene's `batch_search` on `threads` threads"""
+        qids = [str(i) for i in range(len(queries))]
+        results = self.searcher.batch_search(list(queries), qids, k=k, threads=threads)
+        return [[SearchHit(hit.docid, hit.score) for hit in results[qid]] for qid in qids]
+
+
+class Analyzer:
+    """Turns text into index terms, caching stems of words seen before"""
+    def __init__(self, stem=True):
+        self.stem = _stem if stem else None
+        self.stems = dict()
+
+    def __call__(self, text):
+        terms = []
+        for token in TOKEN_RE.findall(text.lower()):
+            if token.endswith("'s") or token.endswith('’s'):
+                token = token[:-2]
+            if token in STOP_WORDS or not token:
+                continue
+            if self.stem is not None:
+                stem = self.stems.get(token)
+                if stem is None:
+                    stem = self.stems[token] = self.stem(token)
+                token = stem
+            terms.append(token)
+        return terms
+
+
+def _lucene_length_norm(length):
+    """
+    Document length as Lucene stores it, in one byte with 4 significant bits
+    (`SmallFloat.intToByte4` followed by `SmallFloat.byte4ToInt`)
+    """
+    num_free_values = 24
+    if length < num_free_values:
+        return length
+    i = length - num_free_values
+    shift = i.bit_length() - 4
+    if shift <= 0:
+        return length
+    return num_free_values + ((i >> shift) << shift)
+
+
+def _analyze(documents, analyzer, term_ids):
+    """
+    Returns ASINs and (term ids, document ids, term frequencies) of the
+    postings of `documents`, adding new terms to `term_ids`
+    """
+    docids = []
+    posting_terms, posting_docs, posting_tfs = [], [], []
+    for doc, (asin, contents) in enumerate(documents):
+        docids.append(asin)
+        for term, tf in Counter(analyzer(contents)).items():
+            posting_terms.append(term_ids.setdefault(term, len(term_ids)))
+            posting_docs.append(doc)
+            posting_tfs.append(tf)
+    return docids, (posting_terms, posting_docs, posting_tfs)
+
+
+def _atomic_write(path, write):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+class BM25Index(SearchBackend):
+    """
+    BM25 index stored as NumPy arrays:
+
+        terms    -- term of each term id, sorted
+        postings -- for term `t`, documents `doc_ids[ptr[t]:ptr[t + 1]]` with
+                    BM25 weights `weights[ptr[t]:ptr[t + 1]]` and term
+                    frequencies `tfs[ptr[t]:ptr[t + 1]]`
+        docids   -- ASIN of each document
+
+    The saved arrays are memory-mapped on load, so processes loading the
+    same index share it.
+    """
+    def __init__(self, terms, ptr, doc_ids, weights, tfs, docids, meta):
+        self.terms = terms
+        self.term_ids = {t: i for i, t in enumerate(terms)}
+        self.ptr = ptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.tfs = tfs
+        self.docids = docids
+        self.meta = meta
+        self.analyzer = Analyzer(stem=meta['stemmed'])
+
+    def __len__(self):
+        return len(self.docids)
+
+    @classmethod
+    def build(cls, documents, k1=0.9, b=0.4, stem=True):
+        """
+        Arguments:
+        documents (`iterable`) -- (ASIN, contents) pairs
+        k1, b (`float`) -- BM25 parameters; defaults are pyserini's
+        stem (`bool`) -- If true, stem terms (needs nltk)
+        """
+        stem = stem and _stem is not None
+        term_ids = dict()
+        docids, postings = _analyze(documents, Analyzer(stem=stem), term_ids)
+        return cls._from_postings(
+            list(term_ids), *postings, docids, dict(k1=k1, b=b, stemmed=stem)
+        )
+
+    @classmethod
+    def _from_postings(cls, terms, posting_terms, posting_docs, posting_tfs, docids, params):
+        """
+        Index from postings in document order, with terms given as ids into
+        `terms`, which may include terms without postings
+        """
+        k1, b = params['k1'], params['b']
+        # renumber terms with postings in sorted order, and group postings by term
+        posting_terms = np.asarray(posting_terms, dtype=np.int64)
+        df = np.bincount(posting_terms, minlength=len(terms))
+        used = sorted(np.flatnonzero(df).tolist(), key=terms.__getitem__)
+        renumber = np.full(len(terms), -1, dtype=np.int64)
+        renumber[used] = np.arange(len(used))
+        posting_terms = renumber[posting_terms]
+        order = np.argsort(posting_terms, kind='stable')
+        doc_ids = np.asarray(posting_docs, dtype=np.int32)[order]
+        tfs = np.asarray(posting_tfs, dtype=np.int32)[order]
+        df = df[used]
+        ptr = np.zeros(len(used) + 1, dtype=np.int64)
+        np.cumsum(df, out=ptr[1:])
+
+        # every term of a document is indexed, so its length is the sum of its tfs
+        num_docs = len(docids)
+        lengths = np.bincount(doc_ids, weights=tfs, minlength=num_docs)
+        avgdl = float(lengths.sum()) / num_docs if num_docs else 0.
+        norms = np.array([_lucene_length_norm(int(n)) for n in lengths], dtype=np.float64)
+        idf = np.log(1 + (num_docs - df + .5) / (df + .5))
+        dl = norms[doc_ids]
+        weights = np.repeat(idf, df) * tfs / (tfs + k1 * (1 - b + b * dl / max(avgdl, 1e-9)))
+
+        meta = dict(
+            version=NATIVE_INDEX_VERSION,
+            k1=k1,
+            b=b,
+            stemmed=params['stemmed'],
+            num_docs=num_docs,
+            avgdl=avgdl,
+        )
+        return cls(
+            [terms[t] for t in used],
+            ptr,
+            doc_ids,
+            weights.astype(np.float32),
+            tfs,
+            np.array(docids, dtype=str),
+            meta,
+        )
+
+    def _posting_terms(self):
+        """Term id of each posting"""
+        return np.repeat(np.arange(len(self.terms)), np.diff(self.ptr))
+
+    def head(self, num_docs):
+        """Index of the first `num_docs` documents, scored as if built from them alone"""
+        keep = np.asarray(self.doc_ids) < num_docs
+        return self._from_postings(
+            self.terms,
+            self._posting_terms()[keep],
+            np.asarray(self.doc_ids)[keep],
+            np.asarray(self.tfs)[keep],
+            np.asarray(self.docids)[:num_docs],
+            self.meta,
+        )
+
+    def update(self, remove=(), documents=()):
+        """
+        Returns the index with the documents of the ASINs in `remove` removed
+        and `documents`, (ASIN, contents) pairs, added at the end, scored as
+        if built from scratch. Only added documents are analyzed, so updating
+        costs a pass over the postings rather than over the product text.
+        """
+        keep_doc = ~np.isin(self.docids, np.array(list(remove), dtype=str))
+        new_doc = np.cumsum(keep_doc) - 1
+        keep = keep_doc[self.doc_ids]
+        posting_terms = self._posting_terms()[keep]
+        posting_docs = new_doc[self.doc_ids[keep]]
+        posting_tfs = np.asarray(self.tfs)[keep]
+        num_kept = int(keep_doc.sum())
+
+        term_ids = dict(self.term_ids)
+        docids, postings = _analyze(documents, self.analyzer, term_ids)
+        added_terms, added_docs, added_tfs = postings
+        return self._from_postings(
+            list(term_ids),
+            np.concatenate([posting_terms, np.asarray(added_terms, dtype=np.int64)]),
+            np.concatenate([posting_docs, np.asarray(added_docs, dtype=np.int64) + num_kept]),
+            np.concatenate([posting_tfs, np.asarray(added_tfs, dtype=np.int32)]),
+            np.concatenate([np.asarray(self.docids)[keep_doc], np.array(docids, dtype=str)]),
+            self.meta,
+        )
+
+    def save(self, path):
+        """Write the index to `path`, replacing the files of an index there atomically"""
+        os.makedirs(path, exist_ok=True)
+        # processes may have the old files mapped, so replace rather than overwrite them
+        _atomic_write(os.path.join(path, 'terms.json'), lambda f: f.write(json.dumps(self.terms).encode()))
+        for name in NATIVE_INDEX_ARRAYS:
+            _atomic_write(os.path.join(path, f'{name}.npy'), lambda f: np.save(f, getattr(self, name)))
+        # written last, so an index with meta is complete
+        _atomic_write(os.path.join(path, 'meta.json'), lambda f: f.write(json.dumps(self.meta).encode()))
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('version') != NATIVE_INDEX_VERSION:
+            raise ValueError(f'{path} is not a compatible search index, rebuild it.')
+        with open(os.path.join(path, 'terms.json')) as f:
+            terms = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+            for name in NATIVE_INDEX_ARRAYS
+        }
+        return cls(terms, meta=meta, **arrays)
+
+    def _query_terms(self, query):
+        """Term ids of `query` in the index, with their number of occurrences"""
+        return Counter(
+            self.term_ids[t] for t in self.analyzer(query) if t in self.term_ids
+        )
+
+    def _postings(self, counts):
+        """Postings of the terms in `counts` as (document ids, weights)"""
+        docs, weights = [], []
+        for t, count in counts.items():
+            start, end = self.ptr[t], self.ptr[t + 1]
+            docs.append(self.doc_ids[start:end])
+            # repeated query terms count once per occurrence, as in pyserini
+            weights.append(self.weights[start:end] * np.float32(count))
+        if not docs:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        return np.concatenate(docs), np.concatenate(weights).astype(np.float64)
+
+    def score(self, query):
+        """Returns (document ids, scores) of documents matching any term of `query`"""
+        docs, weights = self._postings(self._query_terms(query))
+        docs, inverse = np.unique(docs, return_inverse=True)
+        return docs, np.bincount(inverse, weights=weights)
+
+    def _top_k(self, docs, scores, k):
+        if len(docs) > k > 0:
+            # keep every document tied with the k-th best, so that ties are
+            # broken by index order below rather than arbitrarily
+            kth = -np.partition(-scores, k - 1)[k - 1]
+            keep = scores >= kth
+            docs, scores = docs[keep], scores[keep]
+        # best score first, ties broken by index order like Lucene
+        order = np.lexsort((docs, -scores))[:k]
+        return [SearchHit(str(self.docids[docs[i]]), float(scores[i])) for i in order]
+
+    def search(self, query, k=10):
+        return self._top_k(*self.score(query), k)
+
+    def search_many(self, queries, k=10):
+        """
+        Scores all `queries` at once: the postings of every query are tagged
+        with the query's position, so one `np.unique` and `np.bincount` over
+        (query, document) keys sum the scores of all queries
+        """
+        postings = [self._postings(self._query_terms(query)) for query in queries]
+        lengths = [len(docs) for docs, _ in postings]
+        if not sum(lengths):
+            return [[] for _ in queries]
+        num_docs = max(len(self.docids), 1)
+        qs = np.repeat(np.arange(len(queries), dtype=np.int64), lengths)
+        keys = qs * num_docs + np.concatenate([docs for docs, _ in postings])
+        weights = np.concatenate([weights for _, weights in postings])
+        keys, inverse = np.unique(keys, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+        # keys are sorted, so the documents of each query are contiguous
+        qs, docs = np.divmod(keys, num_docs)
+        bounds = np.searchsorted(qs, np.arange(len(queries) + 1))
+        return [
+            self._top_k(docs[start:end], scores[start:end], k)
+            for start, end in zip(bounds[:-1], bounds[1:])
+        ]
+
+
+def init_search_backend(num_products=None, backend='lucene'):
+    """Open the search index for `num_products` products with `backend`"""
+    if backend == 'lucene':
+        return LuceneBackend(os.path.join(SEARCH_ENGINE_DIR, get_index_name(num_products)))
+    elif backend == 'native':
+        return BM25Index.load(get_native_index_path(num_products))
+    elif backend in ('dense', 'hybrid'):
+        from web_agent_site.engine.dense_backend import DenseIndex, HybridBackend, get_dense_index_path
+        dense = DenseIndex.load(get_dense_index_path(num_products))
+        if backend == 'dense':
+            return dense
+        return HybridBackend(BM25Index.load(get_native_index_path(num_products)), dense)
+    raise ValueError(f'Unknown search backend {backend}, expected one of {SEARCH_BACKENDS}')
+
+
+def update_lucene_index(index_dir, remove=(), documents=()):
+    """
+    Deletes the documents of the ASINs in `remove` from the pyserini Lucene
+    index in `index_dir`, then adds `documents`, (ASIN, contents) pairs,
+    with the options `search_engine/run_indexing.sh` indexes with
+    """
+    from jnius import autoclass
+    from pyserini.index.lucene import LuceneIndexer
+
+    remove = list(remove)
+    if remove:
+        FSDirectory = autoclass('org.apache.lucene.store.FSDirectory')
+        IndexWriter = autoclass('org.apache.lucene.index.IndexWriter')
+        IndexWriterConfig = autoclass('org.apache.lucene.index.IndexWriterConfig')
+        Paths = autoclass('java.nio.file.Paths')
+        Term = autoclass('org.apache.lucene.index.Term')
+        writer = IndexWriter(FSDirectory.open(Paths.get(index_dir)), IndexWriterConfig())
+        # documents are indexed with the ASIN as their id
+        writer.deleteDocuments(*[Term('id', asin) for asin in remove])
+        writer.commit()
+        writer.close()
+
+    documents = list(documents)
+    if documents:
+        indexer = LuceneIndexer(
+            args=['-index', index_dir, '-storePositions', '-storeDocvectors', '-storeRaw'],
+            append=True,
+            threads=1,
+        )
+        for asin, contents in documents:
+            indexer.add_doc_dict({'id': asin, 'contents': contents})
+        indexer.close()
+
+
+def build_native_indexes(all_products, sizes=INDEX_SIZES):
+    """
+    Index the first products of `all_products` for each of `sizes` (`None`
+    for all products) for the native backend. Product text is analyzed
+    once, for the largest size, and smaller indexes are derived from it.
+    Returns the paths of the indexes.
+    """
+    largest = None if None in sizes else max(sizes)
+    products = all_products if largest is None else all_products[:largest]
+    start = time.time()
+    index = BM25Index.build((p['asin'], get_product_contents(p)) for p in products)
+    elapsed = time.time() - start
+    print(f'Indexed {len(index)} products in {elapsed:.1f}s '
+          f'({len(index) / max(elapsed, 1e-9):.0f} products/s)')
+    paths = []
+    for num_products in sizes:
+        path = get_native_index_path(num_products)
+        if num_products is None or num_products >= len(index):
+            index.save(path)
+        else:
+            index.head(num_products).save(path)
+        paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    import argparse
+    from web_agent_site.engine.engine import load_products
+    from web_agent_site.utils import DEFAULT_FILE_PATH
+
+    parser = argparse.ArgumentParser(description='Build native search indexes')
+    parser.add_argument('--file_path', default=DEFAULT_FILE_PATH, help='Raw products JSON file')
+    parser.add_argument('--num_products', default=INDEX_SIZES, nargs='+',
+                        type=lambda n: None if n == 'all' else int(n),
+                        help='Index sizes to build, `all` for all products')
+    args = parser.parse_args()
+
+    all_products = load_products(filepath=args.file_path, lazy=True)[0]
+    for output_path in build_native_indexes(all_products, args.num_products):
+        print(f'Search index written to {output_path}')
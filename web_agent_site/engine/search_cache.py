@@ -0,0 +1,89 @@
+"""
+Cache of search results.
+
+Agents issue the same queries over and over, and every page of the results
+and every "< Prev" back to them searches again. `SearchCache` keeps the
+ranked ASINs returned for recent queries, so those searches don't hit the
+search engine.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_keywords(keywords):
+    """Cache key for a query, given as a string or a list of keywords"""
+    if not isinstance(keywords, str):
+        keywords = ' '.join(keywords)
+    return ' '.join(keywords.lower().split())
+
+
+class SearchCache:
+    """
+    Size bounded LRU cache of query -> ranked ASINs, with optional expiry
+
+    Arguments:
+    max_size (`int`) -- Maximum number of queries kept; least recently used are evicted first
+    ttl (`float`) -- Seconds after which an entry expires, or `None` to keep entries until evicted
+    """
+    def __init__(self, max_size=10000, ttl=None, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, keywords):
+        """True if `keywords` have an unexpired entry; does not count as a lookup"""
+        entry = self.entries.get(normalize_keywords(keywords))
+        return entry is not None and (
+            self.ttl is None or self.clock() - entry[0] <= self.ttl
+        )
+
+    def get(self, keywords):
+        """Returns cached ASINs for `keywords`, or `None` on a miss"""
+        key = normalize_keywords(keywords)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None \
+                    and self.clock() - entry[0] > self.ttl:
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, keywords, asins):
+        key = normalize_keywords(keywords)
+        with self.lock:
+            self.entries[key] = (self.clock(), tuple(asins))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
@@ -1,7 +1,22 @@
+import importlib
+
 from gym.envs.registration import register
 
-from web_agent_site.envs.web_agent_site_env import WebAgentSiteEnv
-from web_agent_site.envs.web_agent_text_env import WebAgentTextEnv
+# Environments are imported on first access, so that importing one does not
+# pull in the dependencies of the other (i.e. playwright for the site env)
+_ENV_MODULES = {
+  'WebAgentSiteEnv': 'web_agent_site.envs.web_agent_site_env',
+  'WebAgentTextEnv': 'web_agent_site.envs.web_agent_text_env',
+}
+
+__all__ = list(_ENV_MODULES)
+
+
+def __getattr__(name):
+  if name in _ENV_MODULES:
+    return getattr(importlib.import_module(_ENV_MODULES[name]), name)
+  raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 
 register(
   id='WebAgentSiteEnv-v0',
@@ -11,4 +26,4 @@ register(
 register(
   id='WebAgentTextEnv-v0',
   entry_point='web_agent_site.envs:WebAgentTextEnv',
-)
\ No newline at end of file
+)
@@ -0,0 +1,254 @@
+"""
+Fork-server launcher for running many `WebAgentTextEnv` workers in parallel.
+
+The parent loads products and goals once through the process registry, then
+freezes everything allocated so far out of the garbage collector and forks
+workers. Workers attach to the registry entries inherited from the parent,
+so constructing an env in a worker costs a fork instead of a full
+`load_products` + `get_goals`, and the catalog pages stay shared between
+all workers.
+
+Reference counting still writes to every object a worker touches. With
+`lazy_products` (the default here) products are decoded on access from a
+memory-mapped catalog, so most of the catalog is never materialised as
+Python objects and stays shared through the page cache.
+
+The Lucene search engine runs in a JVM, which does not survive a fork, so
+each worker opens its own searcher, and the launcher refuses to fork from a
+process that has already opened one. The index files themselves are
+memory-mapped and shared. The other search backends can be loaded once in
+the parent with `preload_search_engine=True`.
+"""
+import gc
+import multiprocessing
+import random
+import traceback
+
+import numpy as np
+
+from web_agent_site.engine.registry import (
+    get_catalog,
+    get_loaded_search_backends,
+    get_search_engine,
+    get_shared_cached_goal_set,
+    get_shared_goal_set,
+)
+from web_agent_site.utils import DEFAULT_FILE_PATH
+
+# Search backends whose engines run in a JVM, which forked workers cannot use
+JVM_SEARCH_BACKENDS = ('lucene',)
+
+
+def _worker(conn, index, seed, env_kwargs):
+    from web_agent_site.envs.web_agent_text_env import WebAgentTextEnv
+
+    try:
+        env = WebAgentTextEnv(**env_kwargs)
+    except Exception as e:
+        conn.send(('error', _picklable(e)))
+        conn.close()
+        return
+    # Forked workers inherit the parent's random state, and building an env
+    # may reseed it, so reseed afterwards so that workers do not all draw
+    # the same goals
+    seed = None if seed is None else seed + index
+    random.seed(seed)
+    np.random.seed(seed)
+    conn.send(('ok', None))
+
+    while True:
+        try:
+            cmd, name, args, kwargs = conn.recv()
+        except EOFError:
+            break
+        if cmd == 'close':
+            break
+        try:
+            if cmd == 'call':
+                result = getattr(env, name)(*args, **kwargs)
+            elif cmd == 'getattr':
+                result = getattr(env, name)
+            else:
+                raise ValueError(f'Unknown command {cmd}')
+        except Exception as e:
+            conn.send(('error', _picklable(e)))
+        else:
+            conn.send(('ok', result))
+    conn.close()
+
+
+def _check_fork_safe():
+    """Raise if this process holds search engines that forked workers would inherit broken"""
+    backends = get_loaded_search_backends().intersection(JVM_SEARCH_BACKENDS)
+    if backends:
+        raise RuntimeError(
+            f'Cannot fork env workers after opening {", ".join(sorted(backends))} search engines '
+            'in this process, their JVM does not survive a fork; start the launcher before '
+            'creating shared envs, or use another search backend'
+        )
+
+
+def _picklable(e):
+    return RuntimeError(''.join(
+        traceback.format_exception(type(e), e, e.__traceback__)
+    ))
+
+
+class EnvProxy:
+    """Handle to a `WebAgentTextEnv` running in a forked worker process"""
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+
+    def _request(self, cmd, name=None, *args, **kwargs):
+        self.conn.send((cmd, name, args, kwargs))
+
+    def _result(self):
+        status, result = self.conn.recv()
+        if status == 'error':
+            raise result
+        return result
+
+    def call(self, name, *args, **kwargs):
+        """Calls method `name` of the remote env and returns its result"""
+        self._request('call', name, *args, **kwargs)
+        return self._result()
+
+    def reset(self, session=None, instruction_text=None):
+        return self.call('reset', session=session, instruction_text=instruction_text)
+
+    def step(self, action):
+        return self.call('step', action)
+
+    def get_available_actions(self):
+        return self.call('get_available_actions')
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        self._request('getattr', name)
+        return self._result()
+
+    def close(self):
+        if self.process.is_alive():
+            try:
+                self._request('close')
+            except (BrokenPipeError, OSError):
+                pass
+        self.process.join()
+        self.conn.close()
+
+
+class EnvLauncher:
+    """
+    Loads shared data once and forks `WebAgentTextEnv` workers from it
+
+    Example:
+        with EnvLauncher(num_products=1000, human_goals=True) as launcher:
+            envs = launcher.spawn(64)
+            obs = launcher.step_all(envs, actions)
+    """
+    def __init__(
+            self,
+            file_path=DEFAULT_FILE_PATH,
+            preload_search_engine=False,
+            **env_kwargs
+        ):
+        """
+        Arguments:
+        file_path (`str`) -- Path to products file
+        preload_search_engine (`bool`) -- If true, open the search engine in the parent
+            and share it with workers; not supported for the Lucene search engine
+        env_kwargs -- Keyword arguments passed to every `WebAgentTextEnv`
+        """
+        env_kwargs.setdefault('lazy_products', True)
+        env_kwargs['shared_data'] = True
+        search_backend = env_kwargs.get('search_backend', 'lucene')
+        if preload_search_engine and search_backend in JVM_SEARCH_BACKENDS:
+            raise ValueError(f'The {search_backend} search engine cannot be shared with forked workers')
+        _check_fork_safe()
+        self.env_kwargs = dict(env_kwargs, file_path=file_path)
+        self.context = multiprocessing.get_context('fork')
+        self.envs = []
+
+        num_products = env_kwargs.get('num_products')
+        human_goals = env_kwargs.get('human_goals')
+        lazy = env_kwargs['lazy_products']
+        get_catalog(file_path, num_products, human_goals, lazy)
+        # Filtered goal sets are not shared, workers build their own
+        if env_kwargs.get('filter_goals') is None:
+            goal_kwargs = dict(limit_goals=env_kwargs.get('limit_goals', -1), lazy=lazy)
+            if env_kwargs.get('goal_seed') is not None:
+                get_shared_cached_goal_set(
+                    file_path, num_products, human_goals, env_kwargs['goal_seed'], **goal_kwargs
+                )
+            else:
+                get_shared_goal_set(file_path, num_products, human_goals, **goal_kwargs)
+        if preload_search_engine:
+            get_search_engine(num_products, search_backend)
+
+        # Move everything loaded so far to the permanent generation, so that
+        # collections in workers do not write to (and copy) shared pages
+        gc.collect()
+        gc.freeze()
+
+    def spawn(self, num_envs, seed=None, **env_kwargs):
+        """
+        Forks `num_envs` workers and returns an `EnvProxy` for each
+
+        Arguments:
+        num_envs (`int`) -- Number of workers to start
+        seed (`int`) -- Worker `i` seeds `random` with `seed + i`; unseeded if None
+        env_kwargs -- Per-call overrides of the launcher's env keyword arguments
+        """
+        kwargs = dict(self.env_kwargs, **env_kwargs)
+        _check_fork_safe()
+        envs = []
+        for _ in range(num_envs):
+            parent_conn, child_conn = self.context.Pipe()
+            process = self.context.Process(
+                target=_worker,
+                args=(child_conn, len(self.envs) + len(envs), seed, kwargs),
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            envs.append(EnvProxy(process, parent_conn))
+
+        # Wait for workers after starting all of them, so they initialise concurrently
+        try:
+            for env in envs:
+                env._result()
+        except Exception:
+            for env in envs:
+                env.close()
+            raise
+        self.envs.extend(envs)
+        return envs
+
+    @staticmethod
+    def step_all(envs, actions):
+        """Steps every env with its action concurrently; returns their results in order"""
+        for env, action in zip(envs, actions):
+            env._request('call', 'step', action)
+        return [env._result() for env in envs]
+
+    @staticmethod
+    def reset_all(envs, sessions=None):
+        """Resets every env concurrently; returns their observations in order"""
+        sessions = [None] * len(envs) if sessions is None else sessions
+        for env, session in zip(envs, sessions):
+            env._request('call', 'reset', session=session)
+        return [env._result() for env in envs]
+
+    def close(self):
+        for env in self.envs:
+            env.close()
+        self.envs = []
+        gc.unfreeze()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
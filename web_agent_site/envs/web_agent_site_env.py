@@ -7,12 +7,12 @@ import io
 import base64
 
 from bs4 import BeautifulSoup
-from bs4.element import Comment
 from gym import spaces
 
 from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 
 from web_agent_site.engine.engine import parse_action, END_BUTTON
+from web_agent_site.engine.html_backend import parse_page, tag_visible
 
 from PIL import Image  # Added for PIL image wrapping
 
@@ -30,10 +30,13 @@ class WebAgentSiteEnv(gym.Env):
             Recommended value: 2.0s
         render (`bool`) -- Show browser if set to `True`.
         session ('str') -- Session ID to initialize environment with
+        html_backend (`str`) -- Parser reading observations from page HTML:
+            ['bs4' | 'lxml' | 'selectolax'] (default 'bs4')
         """
         super(WebAgentSiteEnv, self).__init__()
         self.observation_mode = observation_mode
         self.kwargs = kwargs
+        self.html_backend = kwargs.get('html_backend', 'bs4')
 
         # Start Playwright and launch browser
         self._playwright = sync_playwright().start()
@@ -147,27 +150,28 @@ class WebAgentSiteEnv(gym.Env):
         html_obj = BeautifulSoup(html, 'html.parser')
         return html_obj
 
+    def _parse_page(self, html=None):
+        """Returns the current observation (HTML), or `html`, parsed by the `html_backend`"""
+        if html is None:
+            html = self.state['html']
+        return parse_page(html, self.html_backend)
+
     def get_reward(self):
         """Get reward value at current step of the environment"""
-        html_obj = self._parse_html()
-        r = html_obj.find(id='reward')
-        r = float(r.findChildren("pre")[0].string) if r is not None else 0.0
-        return r
+        return self._parse_page().reward
 
     def get_instruction_text(self):
         """Get corresponding instruction text for environment current step"""
         try:
-            html_obj = self._parse_html(self.page.content())
-            instruction_text = html_obj.find(id='instruction-text').h4.text
+            instruction_text = self._parse_page(self.page.content()).instruction_text
         except Exception:
             instruction_text = "No instruction text on current page. You can explore website."
         return instruction_text
 
     def convert_html_to_text(self, html):
         """Strip HTML of tags and add separators to convert observation into simple mode"""
-        texts = self._parse_html(html).findAll(text=True)
-        visible_texts = filter(tag_visible, texts)
-        observation = ' [SEP] '.join(t.strip() for t in visible_texts if t != '\n')
+        nodes = self._parse_page(html).text_nodes
+        observation = ' [SEP] '.join(t.strip() for t, _ in nodes if t != '\n')
         return observation
 
     def _get_rendered_image(self):
@@ -245,10 +249,3 @@ class WebAgentSiteEnv(gym.Env):
         self.browser.close()
         self._playwright.stop()
         print('Browser closed.')
-
-def tag_visible(element):
-    """Helper method to strip HTML block of extraneous tags"""
-    ignore = {'style', 'script', 'head', 'title', 'meta', '[document]'}
-    return (
-        element.parent.name not in ignore and not isinstance(element, Comment)
-    )
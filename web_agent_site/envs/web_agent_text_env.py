@@ -3,30 +3,44 @@ import json
 import random
 import string
 import time
-import torch
-
-import numpy as np
 
 from bs4 import BeautifulSoup
-from bs4.element import Comment
 from collections import defaultdict
 from flask import Flask
 from web_agent_site.engine.engine import (
+    get_catalog_sources,
     load_products,
     init_search_engine,
-    get_top_n_product_from_keywords,
+    get_search_results,
     map_action_to_html,
     parse_action,
     get_product_per_page,
+    prefetch_searches,
     ACTION_TO_TEMPLATE,
     END_BUTTON, NEXT_PAGE, PREV_PAGE, BACK_TO_SEARCH,
 )
-from web_agent_site.engine.goal import get_reward, get_goals
+from web_agent_site.engine.catalog import ProductIndex
+from web_agent_site.engine.goal import get_reward, get_goal_set, get_goal_weights
+from web_agent_site.engine.html_backend import ParsedPage, parse_page
+from web_agent_site.engine.page import Page
+from web_agent_site.engine.page_cache import PageCache
+from web_agent_site.engine.goal_cache import get_cached_goal_set
+from web_agent_site.engine.profiler import StartupProfile, phase
+from web_agent_site.engine.sampler import WeightedSampler
+from web_agent_site.engine.search_cache import SearchCache
+from web_agent_site.engine.registry import (
+    get_catalog,
+    get_page_cache,
+    get_product_index,
+    get_search_cache,
+    get_search_engine,
+    get_shared_cached_goal_set,
+    get_shared_goal_set,
+)
 from web_agent_site.utils import (
     DEFAULT_FILE_PATH,
     FEAT_CONV,
     FEAT_IDS,
-    random_idx
 )
 
 app = Flask(__name__)
@@ -52,6 +66,14 @@ class WebAgentTextEnv(gym.Env):
         session
         session_prefix
         show_attrs
+        lazy_products
+        shared_data
+        log_startup
+        goal_seed
+        search_backend
+        render_html
+        html_backend
+        page_cache_mb
         """
         super(WebAgentTextEnv, self).__init__()
         self.observation_mode = observation_mode
@@ -68,12 +90,23 @@ class WebAgentTextEnv(gym.Env):
             self.kwargs.get('num_products'),
             self.kwargs.get('human_goals'),
             self.kwargs.get('show_attrs', False),
+            self.kwargs.get('lazy_products', False),
+            self.kwargs.get('shared_data', False),
+            self.kwargs.get('log_startup', False),
+            self.kwargs.get('goal_seed'),
+            self.kwargs.get('search_backend', 'lucene'),
+            self.kwargs.get('render_html', True),
+            self.kwargs.get('html_backend', 'bs4'),
+            self.kwargs.get('page_cache_mb', 0),
         ) if server is None else server
         self.browser = SimBrowser(self.server)
+        self.html_backend = self.kwargs.get('html_backend', 'bs4')
+        self._parsed_page = None
 
         self.session = self.kwargs.get('session')
         self.session_prefix = self.kwargs.get('session_prefix')
         if self.kwargs.get('get_image', 0):
+            import torch
             self.feats = torch.load(FEAT_CONV)
             self.ids = torch.load(FEAT_IDS)
             self.ids = {url: idx for idx, url in enumerate(self.ids)}
@@ -126,44 +159,42 @@ class WebAgentTextEnv(gym.Env):
 
     def get_available_actions(self):
         """Returns list of available actions at the current step"""
-        html_obj = self._parse_html()
-
+        page = self.page
         # Collect search bar, buttons, links, and options as clickables
-        search_bar = html_obj.find(id='search_input')
-        has_search_bar = True if search_bar is not None else False
-        buttons = html_obj.find_all(class_='btn')
-        product_links  = html_obj.find_all(class_='product-link')
-        buying_options = html_obj.select('input[type="radio"]')
-
-        self.text_to_clickable = {
-            f'{b.get_text()}'.lower(): b
-            for b in buttons + product_links
-        }
-        for opt in buying_options:
-            opt_value = opt.get('value')
-            self.text_to_clickable[f'{opt_value}'] = opt
+        self.text_to_clickable = dict(page.clickables)
         return dict(
-            has_search_bar=has_search_bar,
+            has_search_bar=page.has_search_bar,
             clickables=list(self.text_to_clickable.keys()),
         )
     
     def get_image(self):
         """Scrape image from page HTML and return as a list of pixel values"""
-        html_obj = self._parse_html(self.browser.page_source)
-        image_url = html_obj.find(id='product-image')
+        image_url = self.page.image_url
         if image_url is not None:
-            image_url = image_url['src']
             if image_url in self.ids:
                 image_idx = self.ids[image_url]
                 image = self.feats[image_idx]
                 return image
+        import torch
         return torch.zeros(512)
 
     def get_instruction_text(self):
         """Get corresponding instruction text for current environment session"""
-        html_obj = self._parse_html(self.browser.page_source)
-        instruction_text = html_obj.find(id='instruction-text').h4.text
-        return instruction_text
+        return self.page.instruction_text
+
+    @property
+    def page(self):
+        """
+        Content of the current page: its `Page` or `SessionPage` if the server
+        did not render it, otherwise its HTML parsed once per page by the
+        `html_backend`
+        """
+        page_source = self.browser.page_source
+        if not isinstance(page_source, str):
+            return page_source
+        if self._parsed_page is None or self._parsed_page.html is not page_source:
+            self._parsed_page = parse_page(page_source, self.html_backend)
+        return self._parsed_page
 
     def _parse_html(self, html=None):
         """
@@ -174,20 +205,31 @@ class WebAgentTextEnv(gym.Env):
             observation (HTML) for parsing.
         """
         if html is None:
-            html = self.state['html']
+            page = self.page
+            if isinstance(page, ParsedPage):
+                return page.html_obj
+            html = self.page_html
         html_obj = BeautifulSoup(html, 'html.parser')
         return html_obj
     
+    @property
+    def page_html(self):
+        """HTML of the current page, rendered now if the server did not render it"""
+        page_source = self.browser.page_source
+        if not isinstance(page_source, str):
+            with app.app_context(), app.test_request_context():
+                return page_source.html
+        return page_source
+
     @property
     def observation(self):
         """Compiles state into either the `html` or `text` observation mode"""
-        html = self.state['html']
         if self.observation_mode == 'html':
-            return html
-        elif self.observation_mode == 'text':
-            return self.convert_html_to_text(html, simple=True)
-        elif self.observation_mode == 'text_rich':
-            return self.convert_html_to_text(html, simple=False)
+            return self.page_html
+        elif self.observation_mode in ('text', 'text_rich'):
+            return self.convert_nodes_to_text(
+                self.page.text_nodes, simple=self.observation_mode == 'text'
+            )
         elif self.observation_mode == 'url':
             return self.state['url']
         else:
@@ -203,37 +245,40 @@ class WebAgentTextEnv(gym.Env):
         """
         return dict(
             url=self.browser.current_url,
-            html=self.browser.page_source,
+            html=self.page_html,
             instruction_text=self.instruction_text,
         )
     
     def convert_html_to_text(self, html, simple=False):
         """Strip HTML of tags and add separators to convert observation into simple mode"""
-        texts = self._parse_html(html).findAll(text=True)
-        visible_texts = filter(tag_visible, texts)
+        page = self.page if html is None else parse_page(html, self.html_backend)
+        return self.convert_nodes_to_text(page.text_nodes, simple)
+
+    def convert_nodes_to_text(self, nodes, simple=False):
+        """Join the visible `TextNode`s of a page into a text observation"""
+        nodes = [node for node in nodes if node.text != '\n']
         if simple:
             # For `simple` mode, return just [SEP] separators
-            return ' [SEP] '.join(t.strip() for t in visible_texts if t != '\n')
+            return ' [SEP] '.join(t.strip() for t, _ in nodes)
         else:
             # Otherwise, return an observation with tags mapped to specific, unique separators
             observation = ''
-            for t in visible_texts:
-                if t == '\n': continue
-                if t.parent.name == 'button':  # button
+            for t, kind in nodes:
+                if kind == 'button':  # button
                     processed_t = f'[button] {t} [button_]'
-                elif t.parent.name == 'label':  # options
-                    if f'"{t}"' in self.state['url']:
+                elif kind == 'label':  # options
+                    if f'"{t}"' in self.browser.current_url:
                         processed_t = f'  [clicked button] {t} [clicked button_]'
                         observation = f'You have clicked {t}.\n' + observation
                     else:
                         processed_t = f'  [button] {t} [button_]'
-                elif t.parent.get('class') == ["product-link"]: # product asins
+                elif kind == 'product-link': # product asins
                     if f'{t}' in self.server.user_sessions[self.session]['asins']:
                         processed_t = f'\n[clicked button] {t} [clicked button_]'
                     else:
                         processed_t = f'\n[button] {t} [button_]'
                 else: # regular, unclickable text
-                    processed_t =  str(t)
+                    processed_t = t
                 observation += processed_t + '\n'
             return observation
     
@@ -266,13 +311,6 @@ class WebAgentTextEnv(gym.Env):
         pass
     
 
-def tag_visible(element):
-    ignore = {'style', 'script', 'head', 'title', 'meta', '[document]'}
-    return (
-        element.parent.name not in ignore and not isinstance(element, Comment)
-    )
-
-
 class SimServer:
     """Lightweight simulator of WebShop Flask application for generating HTML observations"""
     def __init__(
@@ -284,6 +322,14 @@ class SimServer:
         num_products=None,
         human_goals=0,
         show_attrs=False,
+        lazy_products=False,
+        shared_data=False,
+        log_startup=False,
+        goal_seed=None,
+        search_backend='lucene',
+        render_html=True,
+        html_backend='bs4',
+        page_cache_mb=0,
     ):
         """
         Constructor for simulated server serving WebShop application
@@ -293,51 +339,130 @@ class SimServer:
         limit_goals (`int`) -- Limit to number of goals available
         num_products (`int`) -- Number of products to search across
         human_goals (`bool`) -- If true, load human goals; otherwise, load synthetic goals
+        lazy_products (`bool`) -- If true, decode products from the shared compiled catalog on access
+        shared_data (`bool`) -- If true, reuse products, search engine and goals already loaded in this process
+            (default False)
+        log_startup (`bool`) -- If true, print time and memory spent in each startup phase
+        goal_seed (`int`) -- If set, load goals and prices drawn with this seed from a precomputed goal set,
+            compiling it on first use; synthetic goals are then decoded on access
+        search_backend (`str`) -- ['lucene' | 'native' | 'dense' | 'hybrid'] search engine implementation
+            (default 'lucene')
+        render_html (`bool`) -- If false, pages are `Page`s, their text and clickables built from session
+            state, and their HTML only rendered when asked for
+        html_backend (`str`) -- ['bs4' | 'lxml' | 'selectolax'] parser of the pages the page cache renders
+        page_cache_mb (`float`) -- If set, pages are `SessionPage`s of a page cache of about this size
+            (shared with servers of the same products), rendered and parsed once for all sessions
         """
         # Load all products, goals, and search engine
         self.base_url = base_url
-        self.all_products, self.product_item_dict, self.product_prices, _ = \
-            load_products(filepath=file_path, num_products=num_products, human_goals=human_goals)
-        self.search_engine = init_search_engine(num_products=num_products)
-        self.goals = get_goals(self.all_products, self.product_prices, human_goals)
+        self.render_html = render_html
+        self.html_backend = html_backend
+        with StartupProfile('SimServer') as self.startup_profile:
+            with phase('load_products'):
+                if shared_data:
+                    catalog = get_catalog(file_path, num_products, human_goals, lazy_products)
+                    self.product_index = get_product_index(
+                        file_path, num_products, human_goals, lazy_products
+                    )
+                else:
+                    catalog = load_products(
+                        filepath=file_path,
+                        num_products=num_products,
+                        human_goals=human_goals,
+                        lazy=lazy_products,
+                    )
+                    self.product_index = ProductIndex.build(catalog[0])
+            with phase('init_search_engine'):
+                if shared_data:
+                    self.search_engine = get_search_engine(num_products, search_backend)
+                    self.search_cache = get_search_cache(num_products, search_backend)
+                else:
+                    self.search_engine = init_search_engine(num_products, search_backend)
+                    self.search_cache = SearchCache()
+            self.page_cache = None
+            if page_cache_mb and shared_data:
+                self.page_cache = get_page_cache(
+                    file_path, num_products, human_goals, lazy_products, int(page_cache_mb * 2 ** 20)
+                )
+            elif page_cache_mb:
+                self.page_cache = PageCache(int(page_cache_mb * 2 ** 20))
+            self.all_products, self.product_item_dict, self.product_prices, self.attribute_to_asins = catalog
+            with phase('get_goals'):
+                if goal_seed is not None and shared_data:
+                    self.goals, self.product_prices = get_shared_cached_goal_set(
+                        file_path,
+                        num_products,
+                        human_goals,
+                        goal_seed,
+                        filter_goals=filter_goals,
+                        limit_goals=limit_goals,
+                        lazy=lazy_products,
+                    )
+                elif goal_seed is not None:
+                    self.goals, self.product_prices = get_cached_goal_set(
+                        file_path,
+                        self.all_products,
+                        num_products,
+                        human_goals,
+                        goal_seed,
+                        filter_goals=filter_goals,
+                        limit_goals=limit_goals,
+                        sources=get_catalog_sources(file_path, human_goals),
+                    )
+                elif shared_data:
+                    self.goals = get_shared_goal_set(
+                        file_path,
+                        num_products,
+                        human_goals,
+                        filter_goals=filter_goals,
+                        limit_goals=limit_goals,
+                        lazy=lazy_products,
+                    )
+                else:
+                    self.goals = get_goal_set(
+                        self.all_products,
+                        self.product_prices,
+                        human_goals,
+                        filter_goals=filter_goals,
+                        limit_goals=limit_goals,
+                    )
+        if log_startup:
+            print(self.startup_profile.summary(max_depth=1))
         self.show_attrs = show_attrs
-
-        # Fix outcome for random shuffling of goals
-        random.seed(233)
-        random.shuffle(self.goals)
-
-        # Apply `filter_goals` parameter if exists to select speific goal(s)
-        if filter_goals is not None:
-            self.goals = [
-                goal for (i, goal) in enumerate(self.goals)
-                if filter_goals(i, goal)
-            ]
-        
-        # Imposes `limit` on goals via random selection
-        if limit_goals != -1 and limit_goals < len(self.goals):
-            self.weights = [goal['weight'] for goal in self.goals]
-            self.cum_weights = [0] + np.cumsum(self.weights).tolist()
-            idxs = []
-            while len(idxs) < limit_goals:
-                idx = random_idx(self.cum_weights)
-                if idx not in idxs:
-                    idxs.append(idx)
-            self.goals = [self.goals[i] for i in idxs]
         print(f'Loaded {len(self.goals)} goals.')
 
         # Set extraneous housekeeping variables
-        self.weights = [goal['weight'] for goal in self.goals]
-        self.cum_weights = [0] + np.cumsum(self.weights).tolist()
+        self.weights = get_goal_weights(self.goals)
+        self.goal_sampler = WeightedSampler(self.weights)
         self.user_sessions = dict()
         self.search_time = 0
         self.render_time = 0
         self.sample_time = 0
         self.assigned_instruction_text = None  # TODO: very hacky, should remove
         
+    def render(self, action, **kwargs):
+        """
+        HTML of the page for `action`, or its `Page` if the server does not render HTML,
+        or its `SessionPage` if the page cache has it
+        """
+        if self.page_cache is not None:
+            page = self.page_cache.get(self.render_page, action, **kwargs)
+            if page is not None:
+                return page
+        if self.render_html:
+            return map_action_to_html(action, **kwargs)
+        return Page(action, **kwargs)
+
+    def render_page(self, action, **kwargs):
+        """Content of the page for `action`, parsed from its HTML if the server renders HTML"""
+        if self.render_html:
+            return parse_page(map_action_to_html(action, **kwargs), self.html_backend)
+        return Page(action, **kwargs)
+
     @app.route('/', methods=['GET', 'POST'])
     def index(self, session_id, **kwargs):
         """Redirect to the search page with the given session ID"""
-        html = map_action_to_html(
+        html = self.render(
             'start',
             session_id=session_id,
             instruction_text=kwargs['instruction_text'],
@@ -345,6 +470,43 @@ class SimServer:
         url = f'{self.base_url}/{session_id}'
         return html, url
     
+    def prefetch_search_actions(self, actions):
+        """
+        Resolves the `search[...]` actions among `actions`, e.g. those of
+        every env sharing this server in one step, with one batched search,
+        so that stepping the envs afterwards finds the results cached
+        """
+        keywords_list = []
+        for action in actions:
+            action_name, action_arg = parse_action(action)
+            if action_name == 'search' and action_arg:
+                # keywords as `WebAgentTextEnv.step` passes them on
+                keywords_list.append(action_arg.lower().split(' '))
+        return prefetch_searches(keywords_list, self.search_engine, self.search_cache)
+
+    def get_search_results(self, session, keywords):
+        """
+        `SearchResults` for `keywords`, kept in the session so that moving
+        between pages of the same search does not search again. Random
+        (`<r>`) results are drawn anew every time, as before.
+        """
+        results_key = tuple(keywords)
+        if session.get('results_key') == results_key:
+            return session['results']
+        results = get_search_results(
+            keywords,
+            self.search_engine,
+            self.all_products,
+            self.product_item_dict,
+            self.attribute_to_asins,
+            search_cache=self.search_cache,
+            product_index=self.product_index,
+        )
+        if keywords[0] != '<r>':
+            session['results_key'] = results_key
+            session['results'] = results
+        return results
+
     @app.route('/', methods=['GET', 'POST'])
     def search_results(self, session_id, **kwargs):
         """Initialize session and return the search results page"""
@@ -360,12 +522,7 @@ class SimServer:
 
         # Perform search on keywords from items and record amount of time it takes
         old_time = time.time()
-        top_n_products = get_top_n_product_from_keywords(
-            keywords,
-            self.search_engine,
-            self.all_products,
-            self.product_item_dict,
-        )
+        top_n_products = self.get_search_results(session, keywords)
         self.search_time += time.time() - old_time
         
         # Get product list from search result asins and get list of corresponding URLs
@@ -379,7 +536,7 @@ class SimServer:
 
         # Render HTML search page and record amount of time taken
         old_time = time.time()
-        html = map_action_to_html(
+        html = self.render(
             'search',
             session_id=session_id,
             products=products,
@@ -421,7 +578,7 @@ class SimServer:
             f'{session["page"]}/{option_string}'
         )
 
-        html = map_action_to_html(
+        html = self.render(
             'click',
             session_id=session_id,
             product_info=product_info,
@@ -453,7 +610,7 @@ class SimServer:
             f'{session["asin"]}/{keywords_url_string}/{session["page"]}/'
             f'{clickable_name}/{session["options"]}'
         )
-        html = map_action_to_html(
+        html = self.render(
             f'click[{clickable_name}]',
             session_id=session_id,
             product_info=product_info,
@@ -491,7 +648,7 @@ class SimServer:
             f'{self.base_url}/done/{session_id}/'
             f'{session["asin"]}/{session["options"]}'
         )
-        html = map_action_to_html(
+        html = self.render(
             f'click[{END_BUTTON}]',
             session_id=session_id,
             reward=reward,
@@ -508,7 +665,7 @@ class SimServer:
         with app.app_context(), app.test_request_context():
             # Create/determine goal, instruction_text from current session
             if session_id not in self.user_sessions:
-                idx = session_int if (session_int is not None and isinstance(session_int, int)) else random_idx(self.cum_weights) 
+                idx = session_int if (session_int is not None and isinstance(session_int, int)) else self.goal_sampler.sample()
                 goal = self.goals[idx]
                 instruction_text = goal['instruction_text']
                 self.user_sessions[session_id] = {'goal': goal, 'done': False}
@@ -517,7 +674,9 @@ class SimServer:
                     self.user_sessions[session_id]['goal']['instruction_text']
             if self.assigned_instruction_text is not None:
                 instruction_text = self.assigned_instruction_text  # TODO: very hacky, should remove
-                self.user_sessions[session_id]['goal']['instruction_text'] = instruction_text
+                # goals are shared with other sessions and servers, so the session gets its own copy
+                goal = dict(self.user_sessions[session_id]['goal'], instruction_text=instruction_text)
+                self.user_sessions[session_id]['goal'] = goal
             session = self.user_sessions[session_id]
 
             if not kwargs:
@@ -1,5 +1,6 @@
 import bisect
 import hashlib
+import json
 import logging
 import random
 from os.path import dirname, abspath, join
@@ -10,6 +11,7 @@ DEBUG_PROD_SIZE = None  # set to `None` to disable
 DEFAULT_ATTR_PATH = join(BASE_DIR, '../data/items_ins_v2.json')
 DEFAULT_FILE_PATH = join(BASE_DIR, '../data/items_shuffle.json')
 DEFAULT_REVIEW_PATH = join(BASE_DIR, '../data/reviews.json')
+DEFAULT_GOAL_DIR = join(BASE_DIR, '../data/goals')
 
 FEAT_CONV = join(BASE_DIR, '../data/feat_conv.pt')
 FEAT_IDS = join(BASE_DIR, '../data/feat_ids.pt')
@@ -27,6 +29,52 @@ def random_idx(cum_weights):
     idx = min(idx, len(cum_weights) - 2)
     return idx
 
+def iter_json_array(path, chunk_size=1 << 20):
+    """Incrementally parse a file holding a JSON array, yielding one item at a
+    time, so that memory use is bounded by the largest item rather than by
+    the size of the file
+    """
+    decoder = json.JSONDecoder()
+    with open(path) as f:
+        buf, pos, eof = '', 0, False
+        in_array = False
+        while True:
+            # Skip whitespace, and separators between items of the array
+            while pos < len(buf) and (
+                buf[pos].isspace() or (in_array and buf[pos] == ',')
+            ):
+                pos += 1
+            if pos == len(buf):
+                if eof:
+                    raise ValueError(f'Unexpected end of JSON array in {path}')
+                buf, pos, eof = _read_more(f, buf, pos, chunk_size)
+                continue
+            if not in_array:
+                if buf[pos] != '[':
+                    raise ValueError(f'{path} does not contain a JSON array')
+                in_array = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                item, end = None, None
+            if end is None or (end == len(buf) and not eof):
+                # Item may be cut off at the end of the buffer
+                if eof:
+                    raise ValueError(f'Malformed item in JSON array in {path}')
+                buf, pos, eof = _read_more(f, buf, pos, chunk_size)
+                continue
+            yield item
+            pos = end
+
+def _read_more(f, buf, pos, chunk_size):
+    chunk = f.read(chunk_size)
+    return buf[pos:] + chunk, 0, not chunk
+
 def setup_logger(session_id, user_log_dir):
     """Creates a log file and logging object for the corresponding session ID"""
     logger = logging.getLogger(session_id)